@@ -0,0 +1,236 @@
+"""Load test for the hosting control plane.
+
+Builds synthetic fleets of trivial hosted bots in a scratch directory and measures
+start/stop latency, monitor ticks, database save/load, handler latency under
+concurrent callbacks and host RSS. Handlers run against a mocked Bot, so nothing
+touches the network. Results are printed (or written) as JSON:
+
+    python bench.py --sizes 10,100,1000 --output bench_output.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+TRIVIAL_SCRIPT = "import time\ntime.sleep(3600)\n"
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000
+    }
+
+
+# ==============================================================================
+# MOCKED TELEGRAM
+# ==============================================================================
+def make_mock_bot(kl03):
+    class MockBot(kl03.Bot):
+        """Answers every API method locally and counts the calls"""
+        def __init__(self):
+            super().__init__(token="123456:" + "A" * 35)
+            self.calls = 0
+
+        async def __call__(self, method, request_timeout=None):
+            self.calls += 1
+            return True
+
+    return MockBot()
+
+def make_callback(kl03, bot, user_id: int, data: str, index: int):
+    return kl03.CallbackQuery.model_validate({
+        'id': str(index),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+        'chat_instance': 'bench',
+        'data': data,
+        'message': {
+            'message_id': index,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'text': 'bench'
+        }
+    }, context={'bot': bot})
+
+
+# ==============================================================================
+# SCENARIOS
+# ==============================================================================
+def create_fleet(kl03, size: int, user_id: int):
+    bots = []
+    for i in range(size):
+        bot = kl03.HostedBot(user_id, f"bench{size}x{i:05d}", 'bot.py')
+        with open(bot.script_path, 'w') as f:
+            f.write(TRIVIAL_SCRIPT)
+        # Skip environment builds: point the venv interpreter at this one
+        os.makedirs(os.path.dirname(bot.venv_python), exist_ok=True)
+        if not os.path.exists(bot.venv_python):
+            os.symlink(sys.executable, bot.venv_python)
+        bot.dependencies_installed = True
+        kl03.db.add_bot(bot)
+        bots.append(bot)
+    return bots
+
+async def bench_fleet(kl03, size: int, concurrency: int):
+    import psutil
+
+    user_id = 1000 + size
+    result = {'fleet_size': size}
+    bots = create_fleet(kl03, size, user_id)
+    await kl03.db.flush()
+
+    started = time.perf_counter()
+    latencies = []
+    for bot in bots:
+        begin = time.perf_counter()
+        success, msg = await bot.start()
+        latencies.append(time.perf_counter() - begin)
+        if not success:
+            raise RuntimeError(f"start failed: {msg}")
+    result['start'] = dict(summarize(latencies), total_s=time.perf_counter() - started)
+
+    # Let interpreters finish booting before measuring steady-state costs
+    await asyncio.sleep(min(2 + size / 100, 15))
+    running = {bot.pid: bot.key for bot in bots}
+    kl03.metrics_collector.sample(running, set(kl03.db.bots))
+    await asyncio.sleep(1)
+    begin = time.perf_counter()
+    kl03.metrics_collector.sample(running, set(kl03.db.bots))
+    result['metrics_pass_ms'] = (time.perf_counter() - begin) * 1000
+    result['fleet_rss_bytes'] = sum(item['rss'] for item in kl03.metrics_collector.summary.values())
+    result['host_rss_bytes'] = psutil.Process().memory_info().rss
+
+    ticks = []
+    for _ in range(5):
+        begin = time.perf_counter()
+        await kl03.monitor_tick()
+        ticks.append(time.perf_counter() - begin)
+    result['monitor_tick'] = summarize(ticks)
+
+    saves = []
+    for bot in bots[:50]:
+        bot.crashes += 1
+        begin = time.perf_counter()
+        kl03.db.save()
+        await kl03.db.flush()
+        saves.append(time.perf_counter() - begin)
+    result['db_save'] = summarize(saves)
+    begin = time.perf_counter()
+    loaded = kl03.BotDatabase()
+    result['db_load_ms'] = (time.perf_counter() - begin) * 1000
+    loaded.conn.close()
+    result['db_file_bytes'] = sum(
+        os.path.getsize(path) for path in (kl03.BOTS_DB_PATH, kl03.BOTS_DB_PATH + '-wal')
+        if os.path.exists(path)
+    )
+
+    mock = make_mock_bot(kl03)
+    handler_latencies = []
+
+    async def one_callback(index: int):
+        callback = make_callback(kl03, mock, user_id, "my_bots", index)
+        begin = time.perf_counter()
+        await kl03.callback_my_bots(callback)
+        handler_latencies.append(time.perf_counter() - begin)
+
+    begin = time.perf_counter()
+    await asyncio.gather(*(one_callback(i) for i in range(concurrency)))
+    result['callback_my_bots'] = dict(
+        summarize(handler_latencies), concurrency=concurrency, wall_s=time.perf_counter() - begin
+    )
+    await mock.session.close()
+
+    sample = bots[:min(10, size)]
+    stop_latencies = []
+    for bot in sample:
+        begin = time.perf_counter()
+        await bot.stop()
+        stop_latencies.append(time.perf_counter() - begin)
+    result['stop'] = summarize(stop_latencies)
+    begin = time.perf_counter()
+    outcomes = await kl03.terminate_bots(bots[len(sample):])
+    result['stop_batch'] = {
+        'count': len(outcomes),
+        'total_s': time.perf_counter() - begin,
+        'killed': sum(1 for outcome in outcomes.values() if outcome == "killed")
+    }
+
+    for bot in bots:
+        kl03.db.remove_bot(bot.user_id, bot.bot_hash)
+    await kl03.db.flush()
+    return result
+
+async def run(sizes, concurrency: int):
+    # Keep the supervisor from restarting anything while fleets are torn down
+    os.environ.setdefault("RESTART_POLICY", "never")
+    os.environ.setdefault("LOG_MAX_BYTES", str(64 * 1024))
+    # Trivial scripts need no CPU or memory quota (reserved only under cgroups);
+    # admission still queues starts while free memory is below MEMORY_RESERVE
+    os.environ.setdefault("BOT_CPU_QUOTA", "0")
+    os.environ.setdefault("BOT_MEMORY_MAX", "0")
+    sys.path.insert(0, REPO_DIR)
+    import kl03
+
+    results = []
+    for size in sizes:
+        print(f"fleet of {size}...", file=sys.stderr)
+        results.append(await bench_fleet(kl03, size, concurrency))
+    return results
+
+
+# ==============================================================================
+# ENTRY POINT
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,100,1000', help="comma-separated fleet sizes")
+    parser.add_argument('--concurrency', type=int, default=50, help="concurrent callbacks per run")
+    parser.add_argument('--output', help="write JSON here instead of stdout")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix='kl03-bench-')
+    os.chdir(workdir)
+    try:
+        results = asyncio.run(run(sizes, args.concurrency))
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'launch_mode': os.environ.get("LAUNCH_MODE", "popen"),
+            'workdir': workdir
+        },
+        'results': results
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import asyncio
 import logging
+import logging.handlers
+import queue
+import atexit
 import os
 import sys
 import subprocess
@@ -10,13 +13,37 @@ from datetime import datetime
 from typing import Dict, Optional
 import json
 import shutil 
+import time
+import sqlite3
+import html
+import tempfile
+import re
+import uuid
+import socket
+import signal
+import threading
+import hmac
+import base64
+import zipfile
+import importlib.metadata
+import tarfile
+import gzip
+import weakref
+from array import array
+from collections import deque, OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiohttp import web, ClientSession, ClientTimeout, UnixConnector
 
 # ==============================================================================
 # CONFIGURATION
@@ -25,28 +52,374 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQu
 # ✅ FIXED: Now reads token from Railway environment variable
 TOKEN = os.environ.get("TOKEN", "8123942580:AAEnSdMm3L_gN87UjDBHIUOaW4xlTs_S9zg")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('hosting_bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Webhook mode is used when WEBHOOK_URL (the public base URL) is set; otherwise long polling.
+# The server listens on the platform's $PORT, as the Procfile `web:` process must.
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", hashlib.sha256(TOKEN.encode()).hexdigest()[:32])
+WEB_HOST = os.environ.get("WEB_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "16"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get("WEBHOOK_DRAIN_TIMEOUT", "10"))
+# Shared ingress: Telegram delivers participating hosted bots' updates to
+# INGRESS_URL/ingress/<bot key> and the host forwards them over a Unix socket
+INGRESS_URL = os.environ.get("INGRESS_URL", WEBHOOK_URL)
+INGRESS_QUEUE_SIZE = int(os.environ.get("INGRESS_QUEUE_SIZE", "500"))
+# Point the client at another Bot API server, e.g. a local stub in tests
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "")
+
+# Configure logging: records are queued and written by a listener thread, so a slow
+# disk or terminal never stalls the event loop
+log_handlers = [logging.FileHandler('hosting_bot.log'), logging.StreamHandler()]
+for log_handler in log_handlers:
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+logging.getLogger().setLevel(logging.INFO)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 HOSTED_BOTS_DIR = 'hosted_bots'
-BOTS_DB_FILE = 'hosted_bots_db.json'
+BOTS_DB_FILE = 'hosted_bots_db.json'  # legacy, migrated into BOTS_DB_PATH
+BOTS_DB_PATH = os.environ.get("BOTS_DB_PATH", 'hosted_bots.db')
+# Saves are coalesced and written this many seconds after the first change
+DB_SAVE_DELAY = float(os.environ.get("DB_SAVE_DELAY", "0.5"))
 os.makedirs(HOSTED_BOTS_DIR, exist_ok=True)
 
+# Supervisor restart policy: "always", "on-failure" or "never"
+RESTART_POLICY = os.environ.get("RESTART_POLICY", "on-failure")
+RESTART_BACKOFF_BASE = float(os.environ.get("RESTART_BACKOFF_BASE", "1"))
+RESTART_BACKOFF_MAX = float(os.environ.get("RESTART_BACKOFF_MAX", "300"))
+# A bot that stayed up this long gets its backoff reset
+RESTART_RESET_AFTER = float(os.environ.get("RESTART_RESET_AFTER", "60"))
+# Circuit breaker: stop restarting after this many restarts inside the window
+CRASH_LOOP_MAX_RESTARTS = int(os.environ.get("CRASH_LOOP_MAX_RESTARTS", "5"))
+CRASH_LOOP_WINDOW = float(os.environ.get("CRASH_LOOP_WINDOW", "300"))
+# Bot output: each process appends to output.log in its bot_dir; files over LOG_MAX_BYTES
+# are rotated every LOG_CHECK_INTERVAL seconds
+LOG_MAX_LINE = int(os.environ.get("LOG_MAX_LINE", "500"))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "3"))
+LOG_CHECK_INTERVAL = float(os.environ.get("LOG_CHECK_INTERVAL", "10"))
+# Shared content-addressed store of installed distributions, linked into each venv
+PACKAGE_STORE_DIR = os.environ.get("PACKAGE_STORE_DIR", 'package_store')
+PACKAGE_STORE_ENABLED = os.environ.get("PACKAGE_STORE_ENABLED", "1") == "1"
+# Host-wide wheel cache; installs try it offline first and record a lock file
+WHEELHOUSE_DIR = os.environ.get("WHEELHOUSE_DIR", 'wheelhouse')
+PREFETCH_INTERVAL = float(os.environ.get("PREFETCH_INTERVAL", "3600"))
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", "20"))
+# Import name -> distribution index, plus the imports found per source file hash
+IMPORT_INDEX_PATH = os.environ.get("IMPORT_INDEX_PATH", 'import_index.json')
+IMPORT_CACHE_SIZE = int(os.environ.get("IMPORT_CACHE_SIZE", "5000"))
+# Environment builds that may run at once, host-wide
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "2"))
+# "popen" runs each bot as a fresh interpreter; "zygote" forks it from a per-environment
+# process that has already imported the common bot frameworks
+LAUNCH_MODE = os.environ.get("LAUNCH_MODE", "popen")
+ZYGOTE_DIR = 'zygotes'
+ZYGOTE_PRELOAD = os.environ.get(
+    "ZYGOTE_PRELOAD", "aiogram,telebot,telegram,discord,aiohttp,requests,httpx"
+).split(',')
+# Seconds to wait for a zygote to report a child's exit status
+ZYGOTE_STATUS_TIMEOUT = float(os.environ.get("ZYGOTE_STATUS_TIMEOUT", "5"))
+# Seconds bots get to exit after SIGTERM before they are killed
+STOP_GRACE_PERIOD = float(os.environ.get("STOP_GRACE_PERIOD", "5"))
+# Uploads: a .py file, or a .zip/.tar.gz project unpacked within these limits
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_EXTRACTED_BYTES = int(os.environ.get("MAX_EXTRACTED_BYTES", str(100 * 1024 * 1024)))
+MAX_ARCHIVE_MEMBERS = int(os.environ.get("MAX_ARCHIVE_MEMBERS", "2000"))
+# Bulk start/restart: starts in flight at once, and the minimum gap between two starts
+FLEET_CONCURRENCY = int(os.environ.get("FLEET_CONCURRENCY", "4"))
+FLEET_STAGGER = float(os.environ.get("FLEET_STAGGER", "0.5"))
+# Telegram user ids allowed to run host-wide operations
+ADMIN_IDS = {int(uid) for uid in os.environ.get("ADMIN_IDS", "").split(',') if uid.strip()}
+# On update, the new version must stay up this long before the old one is stopped
+UPDATE_HEALTH_DELAY = float(os.environ.get("UPDATE_HEALTH_DELAY", "3"))
+# Per-bot resource sampling: interval in seconds and samples kept per bot
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "15"))
+METRICS_HISTORY = int(os.environ.get("METRICS_HISTORY", "240"))
+# Optional cgroup v2 limits per bot, and admission control against host capacity
+CGROUP_ENABLED = os.environ.get("CGROUP_ENABLED", "0") == "1"
+BOT_CPU_QUOTA = float(os.environ.get("BOT_CPU_QUOTA", "1.0"))  # cores
+BOT_MEMORY_MAX = int(os.environ.get("BOT_MEMORY_MAX", str(256 * 1024 * 1024)))
+BOT_PIDS_MAX = int(os.environ.get("BOT_PIDS_MAX", "128"))
+CPU_OVERCOMMIT = float(os.environ.get("CPU_OVERCOMMIT", "2.0"))
+MEMORY_OVERCOMMIT = float(os.environ.get("MEMORY_OVERCOMMIT", "1.0"))
+# Memory the host keeps free for itself; starts are queued below this
+MEMORY_RESERVE = int(os.environ.get("MEMORY_RESERVE", str(256 * 1024 * 1024)))
+# Hibernation: bots idle this many seconds are frozen until something needs them (0 = off).
+# Idle means CPU and read/write traffic (sockets included) stay under these thresholds.
+HIBERNATE_AFTER = float(os.environ.get("HIBERNATE_AFTER", "0"))
+HIBERNATE_CPU_PERCENT = float(os.environ.get("HIBERNATE_CPU_PERCENT", "1.0"))
+HIBERNATE_IO_RATE = float(os.environ.get("HIBERNATE_IO_RATE", "2048"))
+# Progress messages the host sends by itself: at most OUTBOX_RATE per second overall
+# and one per OUTBOX_CHAT_INTERVAL seconds per chat, well inside Telegram's limits
+OUTBOX_RATE = float(os.environ.get("OUTBOX_RATE", "25"))
+OUTBOX_CHAT_INTERVAL = float(os.environ.get("OUTBOX_CHAT_INTERVAL", "1"))
+# Disk janitor: checks DISK_GC_BATCH entries of HOSTED_BOTS_DIR every DISK_GC_INTERVAL seconds
+DISK_GC_INTERVAL = float(os.environ.get("DISK_GC_INTERVAL", "5"))
+DISK_GC_BATCH = int(os.environ.get("DISK_GC_BATCH", "20"))
+# Orphans and staging leftovers younger than this may still be in use and are kept
+DISK_GC_GRACE = float(os.environ.get("DISK_GC_GRACE", "3600"))
+# Disk space per user across all their bots and venvs, in bytes (0 = unlimited)
+USER_DISK_QUOTA = int(os.environ.get("USER_DISK_QUOTA", "0"))
+# Cluster: the control plane listens for worker agents on CLUSTER_PORT (0 = all bots run
+# here); workers (`kl03.py --worker`, each in its own directory) connect to CLUSTER_ADDRESS
+CLUSTER_HOST = os.environ.get("CLUSTER_HOST", "127.0.0.1")
+CLUSTER_PORT = int(os.environ.get("CLUSTER_PORT", "0"))
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+CLUSTER_ADDRESS = os.environ.get("CLUSTER_ADDRESS", "127.0.0.1:9500")
+# Give each agent its own WORKER_ID when several run on one machine
+WORKER_ID = os.environ.get("WORKER_ID", socket.gethostname())
+WORKER_HEARTBEAT = float(os.environ.get("WORKER_HEARTBEAT", "5"))
+CLUSTER_CALL_TIMEOUT = float(os.environ.get("CLUSTER_CALL_TIMEOUT", "60"))
+# Longest a migration waits for the target's environment build
+MIGRATE_TIMEOUT = float(os.environ.get("MIGRATE_TIMEOUT", "900"))
+# Safety-net sweep for processes the supervisor could not watch
+MONITOR_INTERVAL = float(os.environ.get("MONITOR_INTERVAL", "300"))
+# OpenMetrics endpoint for the host's own instrumentation; 0 disables it
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+
 # States
 class BotUpload(StatesGroup):
     waiting_for_file = State()
+    waiting_for_update = State()
+    waiting_for_token = State()
+
+# ==============================================================================
+# INSTRUMENTATION
+# ==============================================================================
+def format_labels(names, values, extra: str = ""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def samples(self):
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}_total{format_labels(self.labels, labels)} {value}"
+
+class Gauge:
+    """Last value per label set, or a callback read at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels=(), function=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.function = function
+        self.values: Dict[tuple, float] = {}
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def samples(self):
+        if self.function is not None:
+            yield f"{self.name} {self.function()}"
+            return
+        for labels, value in list(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set"""
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        return HistogramTimer(self, labels)
+
+    def samples(self):
+        for labels, series in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = format_labels(self.labels, labels, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            suffix = format_labels(self.labels, labels)
+            yield f"{self.name}_count{suffix} {cumulative}"
+            yield f"{self.name}_sum{suffix} {series[-1]}"
+
+class HistogramTimer:
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+class MetricsRegistry:
+    """Host instrumentation, rendered in the OpenMetrics text format"""
+    CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=(), function=None):
+        return self.register(Gauge(name, help_text, labels, function))
+
+    def histogram(self, name: str, help_text: str, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                logger.error(f"Failed to render metric {metric.name}: {e}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request):
+        return web.Response(body=self.render().encode(), headers={"Content-Type": self.CONTENT_TYPE})
+
+registry = MetricsRegistry()
+HANDLER_SECONDS = registry.histogram("hosting_handler_seconds", "Time spent in update handlers", ("handler",))
+HANDLER_ERRORS = registry.counter("hosting_handler_errors", "Handlers that raised", ("handler",))
+VENV_SECONDS = registry.histogram("hosting_venv_create_seconds", "Virtualenv creation time", ("result",))
+INSTALL_SECONDS = registry.histogram("hosting_dependency_install_seconds", "Dependency install time", ("result",))
+JOB_SECONDS = registry.histogram("hosting_job_seconds", "Environment job run time", ("status",))
+BOT_START_SECONDS = registry.histogram("hosting_bot_start_seconds", "Time to launch a bot process", ("mode",))
+BOT_STOP_SECONDS = registry.histogram("hosting_bot_stop_seconds", "Time to stop a batch of bots")
+BOT_STARTS = registry.counter("hosting_bot_starts", "Bot start attempts", ("result",))
+BOT_EXITS = registry.counter("hosting_bot_exits", "Bot process exits seen", ("reason",))
+BOT_RESTARTS = registry.counter("hosting_bot_restarts", "Automatic restarts by the supervisor", ("result",))
+DB_SAVE_SECONDS = registry.histogram("hosting_db_save_seconds", "Database write time")
+DB_ROWS_WRITTEN = registry.counter("hosting_db_rows_written", "Bot rows upserted or deleted")
+BOTS_RUNNING = registry.gauge(
+    "hosting_bots_running", "Bots currently running",
+    function=lambda: sum(1 for bot in list(db.bots.values()) if bot.status == "running")
+)
+BOTS_HIBERNATED = registry.gauge(
+    "hosting_bots_hibernated", "Bots currently hibernated",
+    function=lambda: sum(1 for bot in list(db.bots.values()) if bot.status == "hibernated")
+)
+DISK_RECLAIMED = registry.counter("hosting_disk_reclaimed_bytes", "Bytes freed by the disk janitor")
+MONITOR_SECONDS = registry.histogram("hosting_monitor_tick_seconds", "Safety-net monitor sweep time")
+LOOP_LAG_SECONDS = registry.histogram(
+    "hosting_event_loop_lag_seconds", "How late the event loop ran a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Times every handler call and counts the ones that raise"""
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else type(event).__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+async def probe_event_loop_lag():
+    """Measure how far past its deadline a short sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        deadline = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(loop.time() - deadline, 0.0))
+
+async def start_metrics_server():
+    """Serve /metrics on its own local listener so it never shares the public port"""
+    app = web.Application()
+    app.router.add_get("/metrics", registry.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
 
 # ==============================================================================
 # HOSTED BOT MANAGER
 # ==============================================================================
+# Host credentials: never passed to hosted scripts or to the package builds they trigger
+SECRET_ENV_PATTERN = re.compile(r"^(TOKEN|.*_TOKEN|.*_SECRET|CLUSTER_.*|WEBHOOK_.*)$")
+
+def scrubbed_environ():
+    """The host's environment without its credentials, for every process that runs user code"""
+    return {key: value for key, value in os.environ.items() if not SECRET_ENV_PATTERN.match(key)}
+
+def scan_imports(path: str):
+    """Top-level names of the absolute imports in one source file"""
+    with open(path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    cached = import_resolver.cached_imports(digest)
+    if cached is not None:
+        return cached
+    try:
+        tree = ast.parse(source, filename=path)
+    except (SyntaxError, ValueError) as e:
+        logger.warning(f"Skipping {path} while collecting imports: {e}")
+        return set()
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.add(alias.name.split('.')[0])
+        elif isinstance(node, ast.ImportFrom):
+            # Relative imports always point into the project
+            if node.module and not node.level:
+                imports.add(node.module.split('.')[0])
+    import_resolver.remember_imports(digest, imports)
+    return imports
+
 class HostedBot:
     def __init__(self, user_id: int, bot_hash: str, file_name: str):
         self.user_id = user_id
@@ -55,27 +428,57 @@ class HostedBot:
         self.bot_dir = os.path.join(HOSTED_BOTS_DIR, f"{user_id}_{bot_hash}")
         self.script_path = os.path.join(self.bot_dir, file_name)
         self.requirements_path = os.path.join(self.bot_dir, 'requirements.txt')
+        self.lock_path = os.path.join(self.bot_dir, 'requirements.lock')
 
         # Path logic for Virtual Environment (Windows vs Linux)
-        self.venv_path = os.path.join(self.bot_dir, 'venv')
+        self.venv_path = os.path.abspath(os.path.join(self.bot_dir, 'venv'))
         if sys.platform == "win32":
             self.venv_python = os.path.join(self.venv_path, 'Scripts', 'python.exe')
             self.venv_pip = os.path.join(self.venv_path, 'Scripts', 'pip.exe')
+            self.site_packages = os.path.join(self.venv_path, 'Lib', 'site-packages')
         else:
             self.venv_python = os.path.join(self.venv_path, 'bin', 'python')
             self.venv_pip = os.path.join(self.venv_path, 'bin', 'pip')
+            self.site_packages = os.path.join(
+                self.venv_path, 'lib', f"python{sys.version_info.major}.{sys.version_info.minor}", 'site-packages'
+            )
 
-        self.process: Optional[subprocess.Popen] = None
+        self.process: Optional[subprocess.Popen] = None  # or a ZygoteChild
         self.pid: Optional[int] = None
         self.status = "stopped"
         self.created_at = datetime.now().isoformat()
         self.started_at: Optional[str] = None
         self.stopped_at: Optional[str] = None
         self.crashes = 0
+        self.oom_kills = 0
         self.dependencies_installed = False
+        # requirements.txt came with the upload and is used as-is
+        self.project_requirements = False
+        # Worker node that runs the bot; None when it runs on this host
+        self.node: Optional[str] = None
+        # Token the shared ingress uses: registered by the owner, or found in the upload
+        self.api_token: Optional[str] = None
+        self.token_registered = False
+        self.ingress_token: Optional[str] = None
+        # (file name, backup path, requirements) of the version an update replaced, until it is swapped in
+        self.previous: Optional[tuple] = None
 
         os.makedirs(self.bot_dir, exist_ok=True)
 
+    @property
+    def key(self):
+        return f"{self.user_id}_{self.bot_hash}"
+
+    @property
+    def ingress_socket(self):
+        return os.path.abspath(os.path.join(self.bot_dir, 'ingress.sock'))
+
+    def child_env(self):
+        """Extra environment variables for the bot process"""
+        if self.ingress_token:
+            return {'HOSTED_INGRESS_SOCKET': self.ingress_socket}
+        return {}
+
     def to_dict(self):
         return {
             'user_id': self.user_id,
@@ -86,8 +489,14 @@ class HostedBot:
             'started_at': self.started_at,
             'stopped_at': self.stopped_at,
             'crashes': self.crashes,
+            'oom_kills': self.oom_kills,
             'pid': self.pid,
-            'dependencies_installed': self.dependencies_installed
+            'dependencies_installed': self.dependencies_installed,
+            'project_requirements': self.project_requirements,
+            'node': self.node,
+            'api_token': self.api_token,
+            'token_registered': self.token_registered,
+            'ingress_token': self.ingress_token
         }
 
     @classmethod
@@ -98,76 +507,173 @@ class HostedBot:
         bot.started_at = data.get('started_at')
         bot.stopped_at = data.get('stopped_at')
         bot.crashes = data.get('crashes', 0)
+        bot.oom_kills = data.get('oom_kills', 0)
         bot.pid = data.get('pid')
         bot.dependencies_installed = data.get('dependencies_installed', False)
+        bot.project_requirements = data.get('project_requirements', False)
+        bot.node = data.get('node')
+        bot.api_token = data.get('api_token')
+        bot.token_registered = data.get('token_registered', False)
+        bot.ingress_token = data.get('ingress_token')
         return bot
 
+    def source_files(self):
+        """Every .py file of the project, leaving out the venv and hidden or cache directories"""
+        files = []
+        for root, dirs, names in os.walk(self.bot_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ('venv', '__pycache__')]
+            files.extend(os.path.join(root, name) for name in names if name.endswith('.py'))
+        return files
+
+    def local_modules(self):
+        """Top-level names the project itself provides"""
+        names = set()
+        for entry in os.scandir(self.bot_dir):
+            if entry.name.startswith('.') or entry.name == 'venv':
+                continue
+            if entry.is_dir():
+                names.add(entry.name)
+            elif entry.name.endswith('.py'):
+                names.add(entry.name[:-3])
+        return names
+
     def extract_imports(self):
         try:
-            with open(self.script_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            tree = ast.parse(content)
             imports = set()
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        imports.add(alias.name.split('.')[0])
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        imports.add(node.module.split('.')[0])
+            files = self.source_files()
+            # Serial on purpose: ast.parse holds the GIL, so threads would not parse in parallel,
+            # and files seen before are answered from the digest cache without parsing
+            for path in files:
+                imports |= scan_imports(path)
+            import_resolver.save()
             stdlib_modules = set(sys.stdlib_module_names)
-            external_imports = imports - stdlib_modules - {'__future__'}
+            external_imports = imports - stdlib_modules - self.local_modules() - {'__future__'}
             return list(external_imports)
         except Exception as e:
             logger.error(f"Error extracting imports: {e}")
             return []
 
     def create_requirements(self):
+        if self.project_requirements:
+            return sorted(self.requirement_set())
         imports = self.extract_imports()
-        package_mapping = {
-            'aiogram': 'aiogram',
-            'telegram': 'python-telegram-bot',
-            'telebot': 'pyTelegramBotAPI',
-            'cv2': 'opencv-python',
-            'PIL': 'Pillow',
-            'sklearn': 'scikit-learn',
-            'yaml': 'PyYAML',
-            'discord': 'discord.py',
-            'requests': 'requests',
-            'numpy': 'numpy'
-        }
-        packages = []
-        for imp in imports:
-            package = package_mapping.get(imp, imp)
-            packages.append(package)
+        packages = import_resolver.resolve(imports)
 
         if packages:
             with open(self.requirements_path, 'w') as f:
                 f.write('\n'.join(packages))
+        return packages
+
+    def requirement_set(self):
+        """Requirements currently listed in requirements.txt"""
+        if not os.path.exists(self.requirements_path):
+            return set()
+        with open(self.requirements_path) as f:
+            return {line.strip() for line in f if line.strip() and not line.startswith('#')}
+
+    def replace_script(self, file_name: str, source: str):
+        """Move a new version of the script (a file on the same filesystem) into place,
+        keeping the old one for rollback.
+
+        Returns the requirements the new version needs that are not installed yet.
+        """
+        self.discard_previous()
+        backup = os.path.join(self.bot_dir, f".{self.file_name}.prev")
+        requirements = lock = None
+        if os.path.exists(self.requirements_path):
+            with open(self.requirements_path) as f:
+                requirements = f.read()
+        if os.path.exists(self.lock_path):
+            with open(self.lock_path) as f:
+                lock = f.read()
+        if os.path.exists(self.script_path):
+            os.replace(self.script_path, backup)
+            self.previous = (self.file_name, backup, requirements, lock)
+        self.file_name = file_name
+        self.script_path = os.path.join(self.bot_dir, file_name)
+        os.replace(source, self.script_path)
+
+        installed = self.requirement_set()
+        missing = sorted(set(self.create_requirements()) - installed)
+        if missing and os.path.exists(self.lock_path):
+            # The pins no longer cover the requirements; refrozen after the install
+            os.remove(self.lock_path)
+        return missing
+
+    def rollback_script(self):
+        if self.previous is None:
+            return
+        file_name, backup, requirements, lock = self.previous
+        self.previous = None
+        if os.path.exists(self.script_path):
+            os.remove(self.script_path)
+        self.file_name = file_name
+        self.script_path = os.path.join(self.bot_dir, file_name)
+        os.replace(backup, self.script_path)
+        # The lock refrozen for the new version would reinstall its packages on the next build
+        for path, content in ((self.requirements_path, requirements), (self.lock_path, lock)):
+            if content is not None:
+                with open(path, 'w') as f:
+                    f.write(content)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def discard_previous(self):
+        if self.previous is not None and os.path.exists(self.previous[1]):
+            os.remove(self.previous[1])
+        self.previous = None
 
     async def create_venv(self):
         """Creates a virtual environment for the bot"""
         if os.path.exists(self.venv_python):
             return True, "Venv already exists"
 
-        try:
-            # Use sys.executable to ensure we use the same python version
-            process = await asyncio.create_subprocess_exec(
-                sys.executable, '-m', 'venv', self.venv_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
+        with VENV_SECONDS.time("failed") as timer:
+            try:
+                # Use sys.executable to ensure we use the same python version
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, '-m', 'venv', self.venv_path,
+                    env=scrubbed_environ(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate()
 
-            if process.returncode == 0:
-                return True, "Venv created"
-            else:
-                return False, stderr.decode()
-        except Exception as e:
-            return False, str(e)
+                if process.returncode == 0:
+                    timer.labels = ("ok",)
+                    return True, "Venv created"
+                else:
+                    return False, stderr.decode()
+            except Exception as e:
+                return False, str(e)
 
     async def install_dependencies(self):
         """Install dependencies from requirements.txt INTO THE VENV"""
+        with INSTALL_SECONDS.time("failed") as timer:
+            success, msg = await self._install_dependencies()
+            if success:
+                timer.labels = ("ok",)
+        return success, msg
+
+    async def install_packages(self, packages):
+        """Install only the given requirements into the existing venv"""
+        with INSTALL_SECONDS.time("failed") as timer:
+            for index_args in (['--no-index'], []):
+                returncode, _, stderr = await run_process(
+                    self.venv_pip, 'install', '--find-links', wheelhouse.root, *index_args, *packages,
+                    cwd=self.bot_dir
+                )
+                if returncode == 0:
+                    break
+            if returncode != 0:
+                logger.error(f"Installing {', '.join(packages)} failed: {stderr}")
+                return False, f"Installation failed: {stderr[-200:]}"
+            timer.labels = ("ok",)
+        self.dependencies_installed = True
+        await wheelhouse.freeze_lock(self)
+        return True, f"Installed {', '.join(packages)}"
+
+    async def _install_dependencies(self):
         if not os.path.exists(self.requirements_path):
             self.dependencies_installed = True
             return True, "No dependencies to install"
@@ -176,20 +682,36 @@ class HostedBot:
         if not success:
             return False, f"Failed to create environment: {msg}"
 
+        if PACKAGE_STORE_ENABLED:
+            success, msg = await package_store.install(self)
+            if success:
+                self.dependencies_installed = True
+                return True, msg
+            logger.warning(f"Package store install failed, falling back to pip: {msg}")
+
         try:
-            cmd = [self.venv_pip, 'install', '-r', 'requirements.txt']
+            # Offline from the wheelhouse first, then let pip reach the index
+            for index_args in (['--no-index'], []):
+                cmd = [
+                    self.venv_pip, 'install', '--find-links', wheelhouse.root, *index_args,
+                    '-r', wheelhouse.requirements_file(self)
+                ]
 
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                cwd=self.bot_dir,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    cwd=self.bot_dir,
+                    env=scrubbed_environ(),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
 
-            stdout, stderr = await process.communicate()
+                stdout, stderr = await process.communicate()
+                if process.returncode == 0:
+                    break
 
             if process.returncode == 0:
                 self.dependencies_installed = True
+                await wheelhouse.freeze_lock(self)
                 return True, "Dependencies installed successfully"
             else:
                 error_msg = stderr.decode()
@@ -202,78 +724,165 @@ class HostedBot:
 
     async def start(self):
         """Start the bot script"""
+        if self.node:
+            return await cluster.start(self)
         if self.status == "running":
             return False, "Bot is already running"
+        if self.status == "hibernated":
+            return await hibernator.wake(self)
 
         if not os.path.exists(self.script_path):
             return False, "Bot script not found"
 
-        if not os.path.exists(self.venv_python):
-             await self.create_venv()
+        if not os.path.exists(self.venv_python) or (
+            not self.dependencies_installed and os.path.exists(self.requirements_path)
+        ):
+            # Environment builds go through the job queue; it starts the bot when done
+            job = job_scheduler.submit(self, autostart=True)
+            return False, f"⏳ Preparing environment (job {job.job_id}). The bot will start when it's ready."
 
-        if not self.dependencies_installed and os.path.exists(self.requirements_path):
-            success, message = await self.install_dependencies()
-            if not success:
-                return False, f"Dependency installation failed: {message}"
+        admitted, reason = admission.admit(self)
+        if not admitted:
+            admission.queue(self)
+            return False, f"⏳ Host is at capacity ({reason}). The start is queued and will run when resources free up."
 
+        launch_started = time.perf_counter()
         try:
-            # Platform specific flags
-            kwargs = {}
-            if sys.platform != "win32":
-                kwargs['start_new_session'] = True
-
-            self.process = subprocess.Popen(
-                [self.venv_python, self.file_name],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=self.bot_dir,
-                **kwargs
-            )
-
-            self.pid = self.process.pid
+            self.process, self.pid = await self._spawn()
             self.status = "running"
             self.started_at = datetime.now().isoformat()
+            supervisor.watch(self)
+            BOT_START_SECONDS.observe(time.perf_counter() - launch_started, "zygote" if isinstance(self.process, ZygoteChild) else "popen")
+            BOT_STARTS.inc("ok")
 
             logger.info(f"Bot started: {self.file_name} (PID: {self.pid})")
             return True, f"✅ Bot started successfully!\nPID: {self.pid}"
 
         except Exception as e:
             logger.error(f"Failed to start bot: {e}")
+            admission.release(self)
+            BOT_STARTS.inc("failed")
             self.status = "error"
             self.crashes += 1
             return False, f"Failed to start: {str(e)}"
 
-    async def stop(self):
-        """Stop the bot process"""
-        if self.status != "running":
-            return False, "Bot is not running"
-
+    async def _spawn(self, scale: int = 1):
+        """Launch the script; returns (Popen or ZygoteChild, pid)"""
+        # The child joins its cgroup before the script runs, so nothing it spawns escapes the limits
+        cgroup_procs = cgroup_manager.prepare(self, scale)
+        # Output goes straight to the log file, which outlives a restart of the host
+        log_fd = bot_logs.open(self)
         try:
-            if self.pid:
-                try:
-                    process = psutil.Process(self.pid)
-                    for child in process.children(recursive=True):
-                        child.terminate()
-                    process.terminate()
-                    try:
-                        process.wait(timeout=5)
-                    except psutil.TimeoutExpired:
-                        for child in process.children(recursive=True):
-                            child.kill()
-                        process.kill()
-                except psutil.NoSuchProcess:
-                    pass
+            if LAUNCH_MODE == "zygote":
+                child = await zygote_manager.launch(self, log_fd, cgroup_procs)
+                if child is not None:
+                    return child, child.pid
+
+            # Platform specific flags
+            kwargs = {}
+            if sys.platform != "win32":
+                kwargs['start_new_session'] = True
+            cmd = [self.venv_python, self.file_name]
+            if cgroup_procs:
+                # preexec_fn is unsafe with the host's threads; a small exec wrapper joins instead
+                cmd = [self.venv_python, '-I', '-S', '-c', CGROUP_EXEC_SOURCE, cgroup_procs, *cmd]
 
-            if self.process:
-                self.process.terminate()
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=log_fd,
+                stderr=log_fd,
+                cwd=self.bot_dir,
+                env={**scrubbed_environ(), **self.child_env()},
+                **kwargs
+            )
+            return process, process.pid
+        finally:
+            os.close(log_fd)
 
-            self.status = "stopped"
-            self.stopped_at = datetime.now().isoformat()
-            self.pid = None
-            return True, "✅ Bot stopped successfully"
+    async def swap(self):
+        """Blue/green restart: bring the new version up, then retire the old process"""
+        old_process, old_pid = self.process, self.pid
+        # An exit of the old process during the swap is not a crash
+        supervisor.unwatch(self)
+        try:
+            # Both versions share the bot's cgroup until the old one is gone
+            return await self._swap_to_new(old_process, old_pid)
+        finally:
+            cgroup_manager.prepare(self)
 
+    async def _swap_to_new(self, old_process, old_pid: int):
+        try:
+            process, pid = await self._spawn(scale=2)
         except Exception as e:
-            return False, f"Failed to stop: {str(e)}"
+            logger.error(f"Failed to start new version of {self.file_name}: {e}")
+            self.rollback_script()
+            supervisor.watch(self)
+            return False, f"Failed to start the new version: {e}"
+
+        await asyncio.sleep(UPDATE_HEALTH_DELAY)
+        if process is not None:
+            process.poll()
+        try:
+            healthy = is_alive(psutil.Process(pid))
+        except psutil.NoSuchProcess:
+            healthy = False
+        if not healthy:
+            logger.warning(f"New version of {self.file_name} exited during startup; keeping PID {old_pid}")
+            self.rollback_script()
+            supervisor.watch(self)
+            return False, "❌ The new version exited during startup. The previous version keeps running."
+
+        self.process, self.pid = process, pid
+        self.started_at = datetime.now().isoformat()
+        supervisor.watch(self)
+        self.discard_previous()
+        result = await terminate_process(old_pid)
+        if old_process is not None:
+            old_process.poll()
+        BOT_STARTS.inc("ok")
+        logger.info(f"Bot updated: {self.file_name} (PID: {old_pid} -> {pid}, old process {result})")
+        return True, f"✅ Bot updated!\nPID: {pid}"
+
+    async def update(self, file_name: str, source: str):
+        """Deploy a new version (the file at `source`) under the same identity.
+
+        Returns (success, message, job or None).
+        """
+        file_name = os.path.basename(file_name)
+        if self.node:
+            return await cluster.update(self, file_name, source)
+        woke, msg = await hibernator.wake(self)
+        if self.status == "hibernated":
+            return woke, msg, None
+        running = self.status == "running"
+        ready = self.dependencies_installed and os.path.exists(self.venv_python)
+        missing = await asyncio.to_thread(self.replace_script, file_name, source)
+        if not ready or missing:
+            # New packages install beside the running version, which is swapped out afterwards
+            if ready:
+                self.dependencies_installed = False
+            job = job_scheduler.submit(self, packages=missing if ready else None, swap=running)
+            return True, f"⏳ Preparing the new version (job {job.job_id}).", job
+        if not running:
+            self.discard_previous()
+            return True, "✅ Updated. The new version runs on the next start.", None
+        success, msg = await self.swap()
+        return success, msg, None
+
+    async def stop(self):
+        """Stop the bot process"""
+        if self.node:
+            return await cluster.stop(self)
+        supervisor.cancel_restart(self)
+        admission.cancel(self)
+        if self.status not in ("running", "hibernated"):
+            return False, "Bot is not running"
+
+        result = (await terminate_bots([self]))[self.key]
+        if result.startswith("failed"):
+            return False, f"Failed to stop: {result}"
+        return True, "✅ Bot stopped successfully"
 
     async def restart(self):
         await self.stop()
@@ -281,17 +890,33 @@ class HostedBot:
         return await self.start()
 
     async def check_status(self):
+        if self.node:
+            # Kept current by the worker's status reports
+            return
+        if supervisor.is_watching(self):
+            # Exits of watched processes are reported by the supervisor
+            return
+        if self.status == "hibernated":
+            if self.pid and not psutil.pid_exists(self.pid):
+                # Died while frozen; it starts afresh when woken
+                self.pid = None
+                admission.release(self)
+            return
         if self.status == "running" and self.pid:
             try:
                 process = psutil.Process(self.pid)
                 if not process.is_running() or process.status() == psutil.STATUS_ZOMBIE:
+                    BOT_EXITS.inc("lost")
                     self.status = "crashed"
                     self.crashes += 1
                     self.stopped_at = datetime.now().isoformat()
+                    admission.release(self)
             except psutil.NoSuchProcess:
+                BOT_EXITS.inc("lost")
                 self.status = "crashed"
                 self.crashes += 1
                 self.stopped_at = datetime.now().isoformat()
+                admission.release(self)
 
     def get_uptime(self):
         if self.status != "running" or not self.started_at:
@@ -306,32 +931,128 @@ class HostedBot:
 # DATABASE MANAGER
 # ==============================================================================
 class BotDatabase:
-    def __init__(self):
+    """SQLite (WAL) backed store; writes only changed rows, batched off the event loop"""
+    def __init__(self, path: str = BOTS_DB_PATH):
         self.bots: Dict[str, HostedBot] = {}
+        self.user_index: Dict[int, Dict[str, HostedBot]] = {}
+        # Last serialized row written per key, used to find what changed; owned by the writer thread
+        self.written: Dict[str, str] = {}
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.pending_writes = set()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS bots ("
+            "key TEXT PRIMARY KEY, user_id INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS bots_user_id ON bots (user_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.commit()
+
+        self.migrate_json()
         self.load()
 
+    def migrate_json(self):
+        """One-time import of the legacy hosted_bots_db.json file"""
+        if not os.path.exists(BOTS_DB_FILE):
+            return
+        if self.conn.execute("SELECT COUNT(*) FROM bots").fetchone()[0]:
+            return
+        try:
+            with open(BOTS_DB_FILE, 'r') as f:
+                data = json.load(f)
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bots (key, user_id, data) VALUES (?, ?, ?)",
+                    [(key, bot_data['user_id'], json.dumps(bot_data)) for key, bot_data in data.items()]
+                )
+            os.replace(BOTS_DB_FILE, BOTS_DB_FILE + '.migrated')
+            logger.info(f"Migrated {len(data)} bots from {BOTS_DB_FILE}")
+        except Exception as e:
+            logger.error(f"Failed to migrate database: {e}")
+
     def load(self):
-        if os.path.exists(BOTS_DB_FILE):
-            try:
-                with open(BOTS_DB_FILE, 'r') as f:
-                    data = json.load(f)
-                    for key, bot_data in data.items():
-                        self.bots[key] = HostedBot.from_dict(bot_data)
-                logger.info(f"Loaded {len(self.bots)} bots from database")
-            except Exception as e:
-                logger.error(f"Failed to load database: {e}")
+        try:
+            for key, row in self.conn.execute("SELECT key, data FROM bots"):
+                bot = HostedBot.from_dict(json.loads(row))
+                self.bots[key] = bot
+                self.user_index.setdefault(bot.user_id, {})[key] = bot
+                self.written[key] = row
+            logger.info(f"Loaded {len(self.bots)} bots from database")
+        except Exception as e:
+            logger.error(f"Failed to load database: {e}")
 
     def save(self):
+        """Schedule a batched write of every bot whose row changed"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush_snapshot(self.snapshot())
+            return
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(DB_SAVE_DELAY, self._start_flush)
+
+    def snapshot(self):
+        """Plain (key, user_id, data) copies of every bot, taken on the loop so no row is
+        read while a handler is halfway through changing the bot"""
+        return [(key, bot.user_id, bot.to_dict()) for key, bot in self.bots.items()]
+
+    def _collect_changes(self, rows):
+        upserts = []
+        for key, user_id, data in rows:
+            row = json.dumps(data)
+            if self.written.get(key) != row:
+                upserts.append((key, user_id, row))
+                self.written[key] = row
+        live = {key for key, _, _ in rows}
+        deletes = [key for key in self.written if key not in live]
+        for key in deletes:
+            del self.written[key]
+        return upserts, deletes
+
+    def _flush_snapshot(self, rows):
+        self._write(*self._collect_changes(rows))
+
+    def _write(self, upserts, deletes):
+        if not upserts and not deletes:
+            return
         try:
-            data = {key: bot.to_dict() for key, bot in self.bots.items()}
-            with open(BOTS_DB_FILE, 'w') as f:
-                json.dump(data, f, indent=2)
+            with DB_SAVE_SECONDS.time(), self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bots (key, user_id, data) VALUES (?, ?, ?)", upserts
+                )
+                self.conn.executemany("DELETE FROM bots WHERE key = ?", [(key,) for key in deletes])
+            DB_ROWS_WRITTEN.inc(amount=len(upserts) + len(deletes))
         except Exception as e:
             logger.error(f"Failed to save database: {e}")
+            # Forget what we thought was written so the next save retries these rows
+            for key, _, _ in upserts:
+                self.written.pop(key, None)
+            for key in deletes:
+                self.written[key] = ""
+
+    def _start_flush(self):
+        self.flush_handle = None
+        # Encoding and diffing the rows happens on the writer thread
+        future = asyncio.get_running_loop().run_in_executor(self.writer, self._flush_snapshot, self.snapshot())
+        self.pending_writes.add(future)
+        future.add_done_callback(self.pending_writes.discard)
+        return future
+
+    async def flush(self):
+        """Write everything outstanding now and wait for it to hit the disk"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+        self._start_flush()
+        if self.pending_writes:
+            await asyncio.gather(*self.pending_writes)
 
     def add_bot(self, bot: HostedBot):
-        key = f"{bot.user_id}_{bot.bot_hash}"
-        self.bots[key] = bot
+        self.bots[bot.key] = bot
+        self.user_index.setdefault(bot.user_id, {})[bot.key] = bot
         self.save()
 
     def get_bot(self, user_id: int, bot_hash: str) -> Optional[HostedBot]:
@@ -339,212 +1060,3924 @@ class BotDatabase:
         return self.bots.get(key)
 
     def get_user_bots(self, user_id: int):
-        return [bot for bot in self.bots.values() if bot.user_id == user_id]
+        return list(self.user_index.get(user_id, {}).values())
 
     def remove_bot(self, user_id: int, bot_hash: str):
         key = f"{user_id}_{bot_hash}"
         if key in self.bots:
             del self.bots[key]
+            self.user_index.get(user_id, {}).pop(key, None)
             self.save()
 
+    def load_jobs(self):
+        return [json.loads(row) for row, in self.conn.execute("SELECT data FROM jobs")]
+
+    def save_job(self, job_id: str, data: Optional[dict]):
+        """Persist a job, or forget it when data is None"""
+        if data is None:
+            self._submit(self._execute, "DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        else:
+            self._submit(
+                self._execute, "INSERT OR REPLACE INTO jobs (job_id, data) VALUES (?, ?)", (job_id, json.dumps(data))
+            )
+
+    def _execute(self, sql: str, params: tuple):
+        try:
+            with self.conn:
+                self.conn.execute(sql, params)
+        except Exception as e:
+            logger.error(f"Failed to save database: {e}")
+
+    def _submit(self, fn, *args):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            fn(*args)
+            return
+        future = loop.run_in_executor(self.writer, fn, *args)
+        self.pending_writes.add(future)
+        future.add_done_callback(self.pending_writes.discard)
+
 db = BotDatabase()
 
 # ==============================================================================
-# UI HELPERS
+# PROCESS SUPERVISOR
 # ==============================================================================
-def get_main_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📤 Upload Bot", callback_data="upload_bot"),
-            InlineKeyboardButton(text="📋 My Bots", callback_data="my_bots")
-        ],
-        [InlineKeyboardButton(text="📊 Statistics", callback_data="stats")]
-    ])
-    return keyboard
+class BotSupervisor:
+    """Watches every hosted bot process and reacts to exits as they happen"""
+    def __init__(self):
+        self.pidfds: Dict[str, tuple] = {}
+        self.waiters: Dict[str, tuple] = {}
+        self.pending_restarts: Dict[str, asyncio.Task] = {}
+        self.restart_history: Dict[str, deque] = {}
+        self.backoff_level: Dict[str, int] = {}
+        self.tripped = set()
+        # Called as listener(bot, returncode) after every unexpected exit
+        self.listeners = []
 
-def get_bot_control_keyboard(bot_hash: str, status: str):
-    buttons = []
-    if status == "running":
-        buttons.append([
-            InlineKeyboardButton(text="⏹ Stop", callback_data=f"stop_{bot_hash}"),
-            InlineKeyboardButton(text="🔄 Restart", callback_data=f"restart_{bot_hash}")
-        ])
-    else:
-        buttons.append([
-            InlineKeyboardButton(text="▶️ Start", callback_data=f"start_{bot_hash}"),
-            InlineKeyboardButton(text="🔄 Restart", callback_data=f"restart_{bot_hash}")
-        ])
-    buttons.extend([
-        [InlineKeyboardButton(text="🗑 Delete", callback_data=f"delete_{bot_hash}")]
-    ])
-    buttons.append([InlineKeyboardButton(text="« Back", callback_data="my_bots")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    def is_watching(self, bot: HostedBot):
+        return bot.key in self.pidfds or bot.key in self.waiters
 
-# ==============================================================================
-# HANDLERS
-# ==============================================================================
-async def cmd_start(message: types.Message):
-    await message.answer(
-        "🤖 <b>Bot Hosting Service</b>\nUpload .py files to host them.",
-        reply_markup=get_main_keyboard(),
-        parse_mode="HTML"
-    )
+    def watch(self, bot: HostedBot):
+        """Get notified as soon as the bot's current process exits"""
+        self.unwatch(bot)
+        pid = bot.pid
+        if not pid:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
 
-async def callback_upload_bot(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("📤 Send me your <b>.py</b> file.", parse_mode="HTML")
-    await state.set_state(BotUpload.waiting_for_file)
-    await callback.answer()
+        if hasattr(os, 'pidfd_open'):
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                loop.call_soon(self._on_exit, bot, pid)
+                return
+            except OSError:
+                fd = None
+            if fd is not None:
+                self.pidfds[bot.key] = (pid, fd)
+                loop.add_reader(fd, self._on_exit, bot, pid)
+                return
 
-async def callback_my_bots(callback: CallbackQuery):
-    user_bots = db.get_user_bots(callback.from_user.id)
-    if not user_bots:
-        await callback.message.edit_text("You have no bots.", reply_markup=get_main_keyboard())
-        await callback.answer()
-        return
+        # No pidfd support: block on the exit in a worker thread instead
+        self.waiters[bot.key] = (pid, loop.create_task(self._wait_in_thread(bot, pid)))
 
-    for bot in user_bots:
-        await bot.check_status()
-    db.save()
+    def unwatch(self, bot: HostedBot, pid: Optional[int] = None):
+        """Drop the watch on the bot's process, or only on `pid` if given"""
+        entry = self.pidfds.get(bot.key)
+        if entry is not None and pid in (None, entry[0]):
+            del self.pidfds[bot.key]
+            try:
+                asyncio.get_running_loop().remove_reader(entry[1])
+            except RuntimeError:
+                pass
+            os.close(entry[1])
+        entry = self.waiters.get(bot.key)
+        if entry is not None and pid in (None, entry[0]):
+            del self.waiters[bot.key]
+            if entry[1] is not asyncio.current_task():
+                entry[1].cancel()
 
-    text = "📋 <b>Your Hosted Bots</b>\n"
-    buttons = []
-    for bot in user_bots:
-        status_icon = "🟢" if bot.status == "running" else "🔴"
-        buttons.append([InlineKeyboardButton(
-            text=f"{status_icon} {bot.file_name}", 
-            callback_data=f"view_{bot.bot_hash}"
-        )])
-    buttons.append([InlineKeyboardButton(text="« Back", callback_data="main_menu")])
+    async def _wait_in_thread(self, bot: HostedBot, pid: int):
+        try:
+            if isinstance(bot.process, subprocess.Popen) and bot.process.pid == pid:
+                await asyncio.to_thread(bot.process.wait)
+            else:
+                await asyncio.to_thread(psutil.Process(pid).wait)
+        except psutil.NoSuchProcess:
+            pass
+        self._on_exit(bot, pid)
 
-    await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
-    await callback.answer()
+    def _reap(self, bot: HostedBot, pid: int):
+        """Collect the exit code; None when the process isn't our child"""
+        if bot.process is not None and bot.process.pid == pid:
+            return bot.process.poll()
+        return None
 
-async def callback_view_bot(callback: CallbackQuery):
-    try:
-        bot_hash = callback.data.split("_")[1]
-        bot = db.get_bot(callback.from_user.id, bot_hash)
-        if not bot:
-            await callback.answer("Bot not found.", show_alert=True)
+    def _on_exit(self, bot: HostedBot, pid: int):
+        self.unwatch(bot, pid)
+        process = bot.process
+        if isinstance(process, ZygoteChild) and process.pid == pid and not process.reported.done():
+            # The zygote sends the status right after reaping the child
+            asyncio.get_running_loop().create_task(self._await_status(bot, process))
             return
+        self._handle_exit(bot, pid, self._reap(bot, pid))
 
-        await bot.check_status()
-        text = f"🤖 <b>{bot.file_name}</b>\nStatus: {bot.status}\nUptime: {bot.get_uptime()}"
-        await callback.message.edit_text(text, reply_markup=get_bot_control_keyboard(bot_hash, bot.status), parse_mode="HTML")
-        await callback.answer()
-    except IndexError:
-        await callback.answer("Error viewing bot.")
+    async def _await_status(self, bot: HostedBot, process):
+        try:
+            await asyncio.wait_for(asyncio.shield(process.reported), ZYGOTE_STATUS_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        self._handle_exit(bot, process.pid, process.returncode)
 
-async def callback_action_bot(callback: CallbackQuery):
-    action, bot_hash = callback.data.split("_", 1)
-    bot = db.get_bot(callback.from_user.id, bot_hash)
-    if not bot: 
-        await callback.answer("Bot not found", show_alert=True)
-        return
+    def _handle_exit(self, bot: HostedBot, pid: int, returncode: Optional[int]):
+        if bot.pid == pid and bot.status == "hibernated":
+            # Killed while frozen; it starts afresh when woken
+            bot.pid = None
+            bot.process = None
+            admission.release(bot)
+            db.save()
+            return
+        if bot.pid != pid or bot.status != "running":
+            # Replaced or stopped on purpose
+            return
 
-    if action == "start":
-        await callback.answer("Starting...", show_alert=False)
-        success, msg = await bot.start()
-        await callback.answer(msg, show_alert=True)
-    elif action == "stop":
-        await callback.answer("Stopping...", show_alert=False)
-        success, msg = await bot.stop()
-        await callback.answer(msg, show_alert=True)
-    elif action == "restart":
-        await callback.answer("Restarting...", show_alert=False)
-        success, msg = await bot.restart()
-        await callback.answer(msg, show_alert=True)
-    elif action == "delete":
-        if bot.status == "running": 
-            await bot.stop()
-        if os.path.exists(bot.bot_dir):
-            try:
-                shutil.rmtree(bot.bot_dir)
-            except Exception as e:
-                logger.error(f"Error deleting dir: {e}")
-        db.remove_bot(callback.from_user.id, bot_hash)
-        await callback.answer("Deleted", show_alert=True)
-        await callback_my_bots(callback)
-        return
+        bot.stopped_at = datetime.now().isoformat()
+        if returncode == 0:
+            BOT_EXITS.inc("clean")
+            bot.status = "stopped"
+            logger.info(f"Bot exited: {bot.file_name} (PID: {pid})")
+        elif cgroup_manager.consume_oom(bot):
+            # Out of memory is the bot hitting its limit, tracked apart from crashes
+            BOT_EXITS.inc("oom")
+            bot.status = "crashed"
+            bot.oom_kills += 1
+            logger.warning(f"Bot OOM-killed: {bot.file_name} (PID: {pid}, memory.max: {format_bytes(BOT_MEMORY_MAX)})")
+        else:
+            BOT_EXITS.inc("crash")
+            bot.status = "crashed"
+            bot.crashes += 1
+            logger.warning(f"Bot crashed: {bot.file_name} (PID: {pid}, exit code: {returncode})")
+        admission.release(bot)
+        db.save()
+        for listener in self.listeners:
+            listener(bot, returncode)
+        self.schedule_restart(bot, returncode)
 
-    db.save()
-    await callback_view_bot(callback)
+    def schedule_restart(self, bot: HostedBot, returncode: Optional[int]):
+        """Apply the restart policy with exponential backoff and a crash-loop breaker"""
+        if RESTART_POLICY == "never":
+            return
+        if RESTART_POLICY == "on-failure" and returncode == 0:
+            return
+        if bot.key in self.tripped or bot.key in self.pending_restarts:
+            return
 
-async def callback_main_menu(callback: CallbackQuery):
-    await callback.message.edit_text(
-        "🤖 <b>Bot Hosting Service</b>\nUpload .py files to host them.",
-        reply_markup=get_main_keyboard(),
+        now = time.monotonic()
+        history = self.restart_history.setdefault(bot.key, deque())
+        while history and now - history[0] > CRASH_LOOP_WINDOW:
+            history.popleft()
+        if len(history) >= CRASH_LOOP_MAX_RESTARTS:
+            self.tripped.add(bot.key)
+            logger.error(f"Crash loop detected for {bot.file_name}; automatic restarts suspended")
+            return
+
+        level = self.backoff_level.get(bot.key, 0)
+        if bot.started_at and bot.stopped_at:
+            uptime = datetime.fromisoformat(bot.stopped_at) - datetime.fromisoformat(bot.started_at)
+            if uptime.total_seconds() >= RESTART_RESET_AFTER:
+                level = 0
+        delay = min(RESTART_BACKOFF_BASE * (2 ** level), RESTART_BACKOFF_MAX)
+        self.backoff_level[bot.key] = level + 1
+        history.append(now)
+
+        self.pending_restarts[bot.key] = asyncio.create_task(self._restart_later(bot, delay))
+
+    async def _restart_later(self, bot: HostedBot, delay: float):
+        try:
+            logger.info(f"Restarting {bot.file_name} in {delay:.0f}s")
+            await asyncio.sleep(delay)
+        finally:
+            self.pending_restarts.pop(bot.key, None)
+        if db.bots.get(bot.key) is not bot or bot.status == "running":
+            return
+        success, msg = await bot.start()
+        BOT_RESTARTS.inc("ok" if success else "failed")
+        if not success:
+            logger.error(f"Automatic restart of {bot.file_name} failed: {msg}")
+        db.save()
+
+    def cancel_restart(self, bot: HostedBot):
+        task = self.pending_restarts.pop(bot.key, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def reset(self, bot: HostedBot):
+        """Clear backoff and crash-loop state, e.g. after a manual start"""
+        self.cancel_restart(bot)
+        self.tripped.discard(bot.key)
+        self.restart_history.pop(bot.key, None)
+        self.backoff_level.pop(bot.key, None)
+
+    def forget(self, bot: HostedBot):
+        self.unwatch(bot)
+        self.reset(bot)
+
+    def _is_bot_process(self, bot: HostedBot):
+        try:
+            process = psutil.Process(bot.pid)
+            if not process.is_running() or process.status() == psutil.STATUS_ZOMBIE:
+                return False
+            return os.path.samefile(process.cwd(), bot.bot_dir)
+        except (psutil.Error, OSError):
+            return False
+
+    async def reconcile(self):
+        """Adopt bots left running by a previous host process; restart those whose PID is stale"""
+        for bot in list(db.bots.values()):
+            if bot.node:
+                continue
+            if bot.status == "hibernated":
+                if bot.pid and self._is_bot_process(bot):
+                    self.watch(bot)
+                else:
+                    bot.pid = None
+                continue
+            if bot.status != "running":
+                continue
+            if bot.pid and self._is_bot_process(bot):
+                logger.info(f"Adopted running bot: {bot.file_name} (PID: {bot.pid})")
+                admission.admit(bot, force=True)
+                self.watch(bot)
+            else:
+                logger.warning(f"Stale PID for {bot.file_name}, marking as crashed")
+                bot.status = "crashed"
+                bot.crashes += 1
+                bot.stopped_at = datetime.now().isoformat()
+                self.schedule_restart(bot, None)
+        db.save()
+
+supervisor = BotSupervisor()
+
+# ==============================================================================
+# TERMINATION
+# ==============================================================================
+def signal_tree(pid: int, members, sig):
+    """Signal the process group led by `pid`, plus any member that left it"""
+    grouped = set()
+    if sys.platform != "win32":
+        try:
+            if os.getpgid(pid) == pid:
+                grouped = {p.pid for p in members if os.getpgid(p.pid) == pid}
+                os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+    for process in members:
+        if process.pid in grouped:
+            continue
+        try:
+            process.send_signal(sig)
+        except psutil.Error:
+            pass
+
+def is_alive(process: psutil.Process):
+    """Zombies count as gone: their parent may never reap them"""
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+async def poll_exits(processes, timeout: float):
+    """wait_exits() for processes without a pidfd: checks /proc every 50 ms"""
+    deadline = time.monotonic() + timeout
+    alive = [p for p in processes if is_alive(p)]
+    while alive and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        alive = [p for p in alive if is_alive(p)]
+    return alive
+
+async def wait_exits(processes, timeout: float):
+    """Wait until all processes exit or the timeout passes; returns those still alive.
+
+    Exits arrive as pidfd events, so stopping a large fleet does not poll /proc.
+    """
+    loop = asyncio.get_running_loop()
+    watched: Dict[int, tuple] = {}
+    polled = []
+    for process in processes:
+        try:
+            fd = os.pidfd_open(process.pid)
+        except ProcessLookupError:
+            continue
+        except (AttributeError, OSError):
+            # No pidfd support, or out of descriptors
+            polled.append(process)
+            continue
+        exited = loop.create_future()
+        loop.add_reader(fd, lambda exited=exited: exited.done() or exited.set_result(None))
+        watched[fd] = (process, exited)
+    try:
+        waits = [poll_exits(polled, timeout)]
+        if watched:
+            waits.append(asyncio.wait([exited for _, exited in watched.values()], timeout=timeout))
+        still_polled = (await asyncio.gather(*waits))[0]
+    finally:
+        for fd in watched:
+            loop.remove_reader(fd)
+            os.close(fd)
+    return [process for process, exited in watched.values() if not exited.done()] + still_polled
+
+async def terminate_bots(bots, grace: float = STOP_GRACE_PERIOD):
+    """Stop many bots at once: SIGTERM all, wait concurrently, SIGKILL the rest as a batch.
+
+    Returns {bot key: "terminated" | "killed" | "not running" | "failed: ..."}.
+    """
+    started = time.perf_counter()
+    results: Dict[str, str] = {}
+    owners: Dict[psutil.Process, HostedBot] = {}
+    stopping = []
+    remote = [bot for bot in bots if bot.node]
+    bots = [bot for bot in bots if not bot.node]
+    for bot in bots:
+        supervisor.cancel_restart(bot)
+        if bot.status not in ("running", "hibernated") or not bot.pid:
+            if bot.status == "hibernated":
+                # Evicted: nothing left to stop
+                bot.status = "stopped"
+            results[bot.key] = "not running"
+            continue
+        if bot.status == "hibernated":
+            # Frozen processes cannot act on SIGTERM
+            hibernator.resume_process(bot)
+        try:
+            root = psutil.Process(bot.pid)
+            members = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            members = []
+        # Anything but "running" tells the supervisor this exit is expected
+        bot.status = "stopping"
+        stopping.append(bot)
+        if members:
+            signal_tree(bot.pid, members, signal.SIGTERM)
+            for process in members:
+                owners[process] = bot
+
+    # Workers stop their own bots while the local ones get their grace period
+    remote_stops = asyncio.gather(*(cluster.stop(bot) for bot in remote))
+    alive = await wait_exits(list(owners), grace)
+    killed = set()
+    if alive:
+        for bot in {owners[process] for process in alive}:
+            signal_tree(bot.pid, [p for p in alive if owners[p] is bot], getattr(signal, 'SIGKILL', signal.SIGTERM))
+            killed.add(bot.key)
+        alive = await wait_exits(alive, 1)
+    stuck = {owners[process].key for process in alive}
+
+    for bot in stopping:
+        if bot.key in stuck:
+            bot.status = "running"
+            results[bot.key] = "failed: process did not exit"
+            continue
+        if bot.process is not None:
+            bot.process.poll()
+        supervisor.unwatch(bot)
+        admission.release(bot)
+        bot.status = "stopped"
+        bot.stopped_at = datetime.now().isoformat()
+        bot.pid = None
+        results[bot.key] = "killed" if bot.key in killed else "terminated"
+    for bot, (success, msg) in zip(remote, await remote_stops):
+        results[bot.key] = "terminated" if success else f"failed: {msg}"
+    if stopping:
+        BOT_STOP_SECONDS.observe(time.perf_counter() - started)
+    return results
+
+async def terminate_process(pid: int, grace: float = STOP_GRACE_PERIOD):
+    """Stop a process tree that no longer belongs to any bot, e.g. the old side of an update"""
+    try:
+        root = psutil.Process(pid)
+        members = [root] + root.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return "not running"
+    signal_tree(pid, members, signal.SIGTERM)
+    alive = await wait_exits(members, grace)
+    if not alive:
+        return "terminated"
+    signal_tree(pid, alive, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    alive = await wait_exits(alive, 1)
+    return "failed: process did not exit" if alive else "killed"
+
+# ==============================================================================
+# LOG CAPTURE
+# ==============================================================================
+class BotLog:
+    """Output of one bot. The process appends to output.log itself; rotation copies the file
+    aside and truncates it, so the bot's O_APPEND descriptor carries on at the new end."""
+    def __init__(self, bot_dir: str):
+        self.path = os.path.join(bot_dir, 'output.log')
+
+    def open(self):
+        return os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) <= LOG_MAX_BYTES:
+                return False
+            for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            if LOG_BACKUP_COUNT > 0:
+                shutil.copyfile(self.path, f"{self.path}.1")
+            # Output written between the copy and the truncate is lost
+            os.truncate(self.path, 0)
+            return True
+        except OSError as e:
+            logger.error(f"Error rotating bot log {self.path}: {e}")
+            return False
+
+    def tail(self, count: int):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(max(0, os.path.getsize(self.path) - count * LOG_MAX_LINE))
+                data = f.read()
+        except OSError:
+            return []
+        return [line[:LOG_MAX_LINE].decode('utf-8', 'replace').rstrip('\r') for line in data.splitlines()[-count:]]
+
+
+class BotLogs:
+    """Per-bot output files: the host never writes bot output, it only rotates the files off the loop"""
+    def get(self, bot: HostedBot) -> BotLog:
+        return BotLog(bot.bot_dir)
+
+    def open(self, bot: HostedBot):
+        """An append-only descriptor for a new process's stdout and stderr"""
+        return self.get(bot).open()
+
+    async def tail(self, bot: HostedBot, count: int):
+        return await asyncio.to_thread(self.get(bot).tail, count)
+
+    def rotate(self, bots):
+        for bot in bots:
+            self.get(bot).rotate_if_needed()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(LOG_CHECK_INTERVAL)
+            bots = [bot for bot in db.bots.values() if bot.status in ("running", "hibernated") and not bot.node]
+            try:
+                await asyncio.to_thread(self.rotate, bots)
+            except Exception as e:
+                logger.error(f"Log rotation error: {e}")
+
+bot_logs = BotLogs()
+
+# ==============================================================================
+# SHARED PACKAGE STORE
+# ==============================================================================
+async def run_process(*cmd, cwd: Optional[str] = None):
+    """Run a command to completion, returning (returncode, stdout, stderr) as text"""
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        env=scrubbed_environ(),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+def file_digest(path: str, algorithm: str = 'sha256'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_tree(src: str, dst: str):
+    """Mirror src into dst using hardlinks, falling back to symlinks, then copies"""
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        if rel == '.' and 'bin' in dirs:
+            # Console scripts have shebangs for the store, not the venv
+            dirs.remove('bin')
+        target_dir = os.path.normpath(os.path.join(dst, rel))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in files:
+            source = os.path.join(root, name)
+            target = os.path.join(target_dir, name)
+            if os.path.lexists(target):
+                os.remove(target)
+            try:
+                os.link(source, target)
+            except OSError:
+                try:
+                    os.symlink(os.path.abspath(source), target)
+                except OSError:
+                    shutil.copy2(source, target)
+
+def unlink_tree(src: str, dst: str):
+    """Remove from dst every file that link_tree(src, dst) put there"""
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        for name in files:
+            target = os.path.normpath(os.path.join(dst, rel, name))
+            if os.path.lexists(target):
+                os.remove(target)
+
+
+class PackageStore:
+    """Installed distributions keyed by name, version and wheel hash, shared by every bot venv"""
+    def __init__(self, root: str = PACKAGE_STORE_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        # entry id -> {"name", "version", "sha256", "refs": [bot keys]}
+        self.entries: Dict[str, dict] = {}
+        os.makedirs(root, exist_ok=True)
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.error(f"Failed to load package store index: {e}")
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def entry_dir(self, entry_id: str):
+        return os.path.join(self.root, entry_id)
+
+    def bot_entries(self, bot_key: str):
+        return [entry_id for entry_id, entry in self.entries.items() if bot_key in entry['refs']]
+
+    async def add_wheel(self, bot: HostedBot, wheel_path: str):
+        """Unpack a wheel into the store unless an identical one is already there"""
+        sha256 = await asyncio.to_thread(file_digest, wheel_path)
+        name, version = os.path.basename(wheel_path).split('-')[:2]
+        entry_id = f"{name.lower()}-{version}-{sha256[:16]}"
+        entry = self.entries.setdefault(entry_id, {'name': name, 'version': version, 'sha256': sha256, 'refs': []})
+        if bot.key not in entry['refs']:
+            # Referenced before unpacking so a concurrent release can't collect it
+            entry['refs'].append(bot.key)
+        if not os.path.isdir(self.entry_dir(entry_id)):
+            tmp_dir = tempfile.mkdtemp(prefix='.unpack-', dir=self.root)
+            returncode, _, stderr = await run_process(
+                bot.venv_pip, 'install', '--no-deps', '--no-compile', '--target', tmp_dir, wheel_path
+            )
+            if returncode != 0:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise RuntimeError(f"Unpacking {os.path.basename(wheel_path)} failed: {stderr[-200:]}")
+            try:
+                os.replace(tmp_dir, self.entry_dir(entry_id))
+            except OSError:
+                # Another install stored the same wheel first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        return entry_id
+
+    async def install(self, bot: HostedBot):
+        """Resolve the bot's requirements to wheels and link them into its venv"""
+        wheel_dir = os.path.abspath(os.path.join(bot.bot_dir, '.wheels'))
+        shutil.rmtree(wheel_dir, ignore_errors=True)
+        previous = set(self.bot_entries(bot.key))
+        try:
+            success, msg = await wheelhouse.build(bot, wheel_dir)
+            if not success:
+                return False, f"Resolving wheels failed: {msg}"
+
+            wanted = []
+            for wheel in sorted(os.listdir(wheel_dir)):
+                if wheel.endswith('.whl'):
+                    wanted.append(await self.add_wheel(bot, os.path.join(wheel_dir, wheel)))
+
+            stale = previous - set(wanted)
+            for entry_id in stale:
+                await asyncio.to_thread(unlink_tree, self.entry_dir(entry_id), bot.site_packages)
+            for entry_id in wanted:
+                await asyncio.to_thread(link_tree, self.entry_dir(entry_id), bot.site_packages)
+            await self.collect(self.release_entries(bot.key, stale))
+            wheelhouse.write_lock(bot, wheel_dir)
+            return True, f"Dependencies linked from shared store ({len(wanted)} packages)"
+        except Exception as e:
+            return False, str(e)
+        finally:
+            shutil.rmtree(wheel_dir, ignore_errors=True)
+
+    def release_entries(self, bot_key: str, entry_ids):
+        """Drop the bot's references, returning the entries nobody uses anymore"""
+        dead = []
+        for entry_id in entry_ids:
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                continue
+            if bot_key in entry['refs']:
+                entry['refs'].remove(bot_key)
+            if not entry['refs']:
+                del self.entries[entry_id]
+                dead.append(entry_id)
+        return dead
+
+    async def collect(self, dead):
+        self.save_index()
+        for entry_id in dead:
+            await asyncio.to_thread(shutil.rmtree, self.entry_dir(entry_id), True)
+            logger.info(f"Package store: collected {entry_id}")
+
+    async def release(self, bot: HostedBot):
+        entry_ids = self.bot_entries(bot.key)
+        if entry_ids:
+            await self.collect(self.release_entries(bot.key, entry_ids))
+
+package_store = PackageStore()
+
+# ==============================================================================
+# WHEELHOUSE & LOCK FILES
+# ==============================================================================
+def canonical_name(name: str):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def parse_wheel_name(file_name: str):
+    """Return (canonical name, version) from a wheel file name"""
+    name, version = file_name.split('-')[:2]
+    return canonical_name(name), version
+
+def requirements_fingerprint(path: str):
+    """Hash of a requirements or lock file that ignores ordering and comments"""
+    with open(path, 'r') as f:
+        lines = sorted(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return hashlib.sha256('\n'.join(lines).encode()).hexdigest()
+
+class Wheelhouse:
+    """Host-wide cache of built wheels that installs can use without network access"""
+    def __init__(self, root: str = WHEELHOUSE_DIR):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def requirements_file(self, bot: HostedBot):
+        """The bot's lock file once it has one, so rebuilds get the same versions"""
+        return 'requirements.lock' if os.path.exists(bot.lock_path) else 'requirements.txt'
+
+    def cached(self):
+        return {parse_wheel_name(name) for name in os.listdir(self.root) if name.endswith('.whl')}
+
+    async def build(self, bot: HostedBot, wheel_dir: str):
+        """Collect wheels for the bot into wheel_dir, offline when the cache is enough"""
+        stderr = ""
+        for index_args in (['--no-index'], []):
+            returncode, _, stderr = await run_process(
+                bot.venv_pip, 'wheel', '--find-links', self.root, *index_args,
+                '-r', self.requirements_file(bot), '-w', wheel_dir, cwd=bot.bot_dir
+            )
+            if returncode == 0:
+                await asyncio.to_thread(self.absorb, wheel_dir)
+                return True, "offline" if index_args else "downloaded"
+        return False, stderr[-200:]
+
+    def absorb(self, wheel_dir: str):
+        """Keep every newly downloaded or built wheel in the cache"""
+        for name in os.listdir(wheel_dir):
+            target = os.path.join(self.root, name)
+            if not name.endswith('.whl') or os.path.exists(target):
+                continue
+            try:
+                os.link(os.path.join(wheel_dir, name), target)
+            except OSError:
+                shutil.copy2(os.path.join(wheel_dir, name), target)
+
+    def write_lock(self, bot: HostedBot, wheel_dir: str):
+        if os.path.exists(bot.lock_path):
+            return
+        pins = sorted(parse_wheel_name(name) for name in os.listdir(wheel_dir) if name.endswith('.whl'))
+        self._write_lock(bot, [f"{name}=={version}" for name, version in pins])
+
+    async def freeze_lock(self, bot: HostedBot):
+        if os.path.exists(bot.lock_path):
+            return
+        returncode, stdout, _ = await run_process(bot.venv_pip, 'freeze', '--exclude-editable')
+        if returncode == 0:
+            self._write_lock(bot, [line for line in stdout.splitlines() if '==' in line])
+
+    def _write_lock(self, bot: HostedBot, pins):
+        with open(bot.lock_path, 'w') as f:
+            f.write(f"# Resolved on first install, {datetime.now().isoformat()}\n")
+            f.write('\n'.join(pins) + '\n')
+
+    def popular(self):
+        """Most used requirement specs across all bots, preferring locked pins"""
+        counts: Dict[str, int] = {}
+        for bot in list(db.bots.values()):
+            path = bot.lock_path if os.path.exists(bot.lock_path) else bot.requirements_path
+            try:
+                with open(path, 'r') as f:
+                    specs = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            except OSError:
+                continue
+            for spec in specs:
+                counts[spec] = counts.get(spec, 0) + 1
+        return sorted(counts, key=counts.get, reverse=True)[:PREFETCH_TOP_N]
+
+    async def prefetch(self):
+        cached = self.cached()
+        cached_names = {name for name, _ in cached}
+        for spec in self.popular():
+            name, _, version = spec.partition('==')
+            name = canonical_name(name)
+            if (name, version) in cached or (not version and name in cached_names):
+                continue
+            returncode, _, stderr = await run_process(
+                sys.executable, '-m', 'pip', 'wheel', '--find-links', self.root, '-w', self.root, spec
+            )
+            if returncode != 0:
+                logger.warning(f"Prefetch of {spec} failed: {stderr[-200:]}")
+            # Stay in the background; don't compete with user installs
+            await asyncio.sleep(1)
+
+    async def prefetch_loop(self):
+        while True:
+            try:
+                await self.prefetch()
+            except Exception as e:
+                logger.error(f"Prefetch error: {e}")
+            await asyncio.sleep(PREFETCH_INTERVAL)
+
+wheelhouse = Wheelhouse()
+
+# ==============================================================================
+# IMPORT RESOLVER
+# ==============================================================================
+# Import names whose distribution is named differently, for when nothing installed says so
+KNOWN_DISTRIBUTIONS = {
+    'telegram': 'python-telegram-bot',
+    'telebot': 'pyTelegramBotAPI',
+    'discord': 'discord.py',
+    'cv2': 'opencv-python',
+    'PIL': 'Pillow',
+    'sklearn': 'scikit-learn',
+    'skimage': 'scikit-image',
+    'yaml': 'PyYAML',
+    'bs4': 'beautifulsoup4',
+    'dotenv': 'python-dotenv',
+    'decouple': 'python-decouple',
+    'Crypto': 'pycryptodome',
+    'Cryptodome': 'pycryptodomex',
+    'jwt': 'PyJWT',
+    'jose': 'python-jose',
+    'dateutil': 'python-dateutil',
+    'slugify': 'python-slugify',
+    'multipart': 'python-multipart',
+    'docx': 'python-docx',
+    'pptx': 'python-pptx',
+    'magic': 'python-magic',
+    'fitz': 'PyMuPDF',
+    'OpenSSL': 'pyOpenSSL',
+    'nacl': 'PyNaCl',
+    'socks': 'PySocks',
+    'serial': 'pyserial',
+    'zmq': 'pyzmq',
+    'websocket': 'websocket-client',
+    'attr': 'attrs',
+    'bson': 'pymongo',
+    'psycopg2': 'psycopg2-binary',
+    'MySQLdb': 'mysqlclient',
+    'telethon': 'Telethon',
+    'vk_api': 'vk-api',
+    'yt_dlp': 'yt-dlp',
+    'fake_useragent': 'fake-useragent',
+    'googleapiclient': 'google-api-python-client',
+    'Bio': 'biopython',
+}
+
+class ImportResolver:
+    """Maps import names to the distributions that provide them.
+
+    The index is built from installed distribution metadata and the wheelhouse, and is
+    kept on disk together with the imports already found per source file hash.
+    """
+    def __init__(self, path: str = IMPORT_INDEX_PATH):
+        self.path = path
+        self.mappings: Dict[str, str] = {}
+        self.scanned_wheels = set()
+        self.scripts: Dict[str, list] = {}
+        self.loaded = False
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.path) as f:
+                    data = json.load(f)
+                self.mappings = data.get('mappings', {})
+                self.scanned_wheels = set(data.get('wheels', []))
+                self.scripts = data.get('scripts', {})
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Failed to load import index, rebuilding it: {e}")
+            if not self.mappings:
+                for name, distributions in importlib.metadata.packages_distributions().items():
+                    if not name.startswith('_') and len(set(distributions)) == 1:
+                        self.mappings[name] = distributions[0]
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            # Copies: scans of other uploads keep adding entries from their threads while the file is written
+            data = {'mappings': dict(self.mappings), 'wheels': sorted(self.scanned_wheels), 'scripts': dict(self.scripts)}
+            self.dirty = False
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save import index: {e}")
+            with self.lock:
+                self.dirty = True
+
+    @staticmethod
+    def wheel_modules(wheel_path: str):
+        """Top-level import names a wheel installs"""
+        with zipfile.ZipFile(wheel_path) as archive:
+            names = archive.namelist()
+            for name in names:
+                if name.endswith('.dist-info/top_level.txt'):
+                    return {line.strip() for line in archive.read(name).decode().splitlines() if line.strip()}
+        modules = set()
+        for name in names:
+            top = name.split('/')[0]
+            if top.endswith(('.dist-info', '.data')) or top.startswith('_'):
+                continue
+            modules.add(top[:-3] if top.endswith('.py') else top.split('.')[0])
+        return modules
+
+    def scan_wheelhouse(self):
+        """Index wheels added to the wheelhouse since the last scan"""
+        for file_name in os.listdir(wheelhouse.root):
+            if not file_name.endswith('.whl') or file_name in self.scanned_wheels:
+                continue
+            try:
+                modules = self.wheel_modules(os.path.join(wheelhouse.root, file_name))
+            except Exception as e:
+                logger.warning(f"Could not read {file_name}: {e}")
+                modules = set()
+            distribution = file_name.split('-')[0]
+            with self.lock:
+                for module in modules:
+                    self.mappings.setdefault(module, distribution)
+                self.scanned_wheels.add(file_name)
+                self.dirty = True
+
+    def resolve(self, imports):
+        """Distribution names for a set of imports; unknown names are assumed to match"""
+        self.load()
+        self.scan_wheelhouse()
+        packages = []
+        for name in sorted(imports):
+            package = KNOWN_DISTRIBUTIONS.get(name) or self.mappings.get(name) or name
+            if package not in packages:
+                packages.append(package)
+        self.save()
+        return packages
+
+    def cached_imports(self, digest: str):
+        self.load()
+        imports = self.scripts.get(digest)
+        return set(imports) if imports is not None else None
+
+    def remember_imports(self, digest: str, imports):
+        with self.lock:
+            self.scripts[digest] = sorted(imports)
+            while len(self.scripts) > IMPORT_CACHE_SIZE:
+                del self.scripts[next(iter(self.scripts))]
+            self.dirty = True
+
+import_resolver = ImportResolver()
+
+# ==============================================================================
+# JOB QUEUE
+# ==============================================================================
+class Job:
+    def __init__(self, job_id: str, bot_key: str, user_id: int, autostart: bool = False):
+        self.job_id = job_id
+        self.bot_key = bot_key
+        self.user_id = user_id
+        self.autostart = autostart
+        # Set by updates: install just these requirements, then swap in the new version
+        self.packages: Optional[list] = None
+        self.swap = False
+        # Worker node running the job; such jobs are only mirrored here and never persisted
+        self.node: Optional[str] = None
+        self.status = "queued"
+        self.stage = "Waiting for a free slot"
+        self.result: Optional[str] = None
+        self.chat_id: Optional[int] = None
+        self.message_id: Optional[int] = None
+        self.created_at = datetime.now().isoformat()
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'bot_key': self.bot_key,
+            'user_id': self.user_id,
+            'autostart': self.autostart,
+            'packages': self.packages,
+            'swap': self.swap,
+            'status': self.status,
+            'stage': self.stage,
+            'result': self.result,
+            'chat_id': self.chat_id,
+            'message_id': self.message_id,
+            'created_at': self.created_at
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['job_id'], data['bot_key'], data['user_id'], data.get('autostart', False))
+        job.packages = data.get('packages')
+        job.swap = data.get('swap', False)
+        job.status = data.get('status', 'queued')
+        job.stage = data.get('stage', '')
+        job.result = data.get('result')
+        job.chat_id = data.get('chat_id')
+        job.message_id = data.get('message_id')
+        job.created_at = data.get('created_at', job.created_at)
+        return job
+
+
+class JobScheduler:
+    """Runs venv builds and dependency installs with a global limit and per-user fair queuing"""
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.queues: Dict[int, deque] = {}
+        # Users with queued jobs, served round-robin
+        self.turns = deque()
+        self.running = 0
+        # Identical requirement sets install one at a time so followers hit the caches; a lock
+        # goes away once no job holds or waits for it
+        self.requirement_locks = weakref.WeakValueDictionary()
+        # Called as listener(job) on every progress update
+        self.listeners = []
+
+    def active_job(self, hosted_bot: HostedBot) -> Optional[Job]:
+        for job in self.jobs.values():
+            if job.bot_key == hosted_bot.key and job.active:
+                return job
+        return None
+
+    def submit(self, hosted_bot: HostedBot, autostart: bool = False,
+               packages: Optional[list] = None, swap: bool = False) -> Job:
+        job = self.active_job(hosted_bot)
+        if job is not None:
+            job.autostart = job.autostart or autostart
+            job.swap = job.swap or swap
+            if packages and job.packages is not None:
+                job.packages = sorted(set(job.packages) | set(packages))
+            self.persist(job)
+            return job
+        job = Job(uuid.uuid4().hex[:8], hosted_bot.key, hosted_bot.user_id, autostart)
+        job.packages = packages
+        job.swap = swap
+        self.jobs[job.job_id] = job
+        self._enqueue(job)
+        return job
+
+    def _enqueue(self, job: Job):
+        if job.user_id not in self.queues:
+            self.queues[job.user_id] = deque()
+            self.turns.append(job.user_id)
+        self.queues[job.user_id].append(job)
+        self.persist(job)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < JOB_CONCURRENCY and self.turns:
+            user_id = self.turns.popleft()
+            queue = self.queues[user_id]
+            job = queue.popleft()
+            if queue:
+                self.turns.append(user_id)
+            else:
+                del self.queues[user_id]
+            self.running += 1
+            asyncio.create_task(self._run(job))
+
+    def position(self, job: Job):
+        queue = self.queues.get(job.user_id)
+        if not queue or job not in queue:
+            return 0
+        return list(queue).index(job) + 1
+
+    def attach(self, job: Job, chat_id: int, message_id: int):
+        """Keep a status message up to date as the job progresses"""
+        job.chat_id = chat_id
+        job.message_id = message_id
+        self.persist(job)
+
+    def persist(self, job: Job):
+        if job.node:
+            return
+        db.save_job(job.job_id, job.to_dict() if job.active else None)
+
+    async def _run(self, job: Job):
+        try:
+            hosted_bot = db.bots.get(job.bot_key)
+            if hosted_bot is None:
+                raise RuntimeError("Bot was deleted")
+            job.status = "running"
+            job_started = time.perf_counter()
+            await self.progress(job, "Creating environment")
+            success, msg = await hosted_bot.create_venv()
+            if success and job.packages:
+                await self.progress(job, "Installing new dependencies")
+                success, msg = await hosted_bot.install_packages(job.packages)
+            elif success and not hosted_bot.dependencies_installed:
+                async with self.requirement_lock(hosted_bot):
+                    await self.progress(job, "Installing dependencies")
+                    success, msg = await hosted_bot.install_dependencies()
+            if not success and job.packages:
+                # The previous version's environment is still complete
+                hosted_bot.rollback_script()
+                hosted_bot.dependencies_installed = True
+            if success and job.swap and hosted_bot.status == "running":
+                await self.progress(job, "Swapping in the new version")
+                success, msg = await hosted_bot.swap()
+            elif success and job.autostart:
+                await self.progress(job, "Starting bot")
+                success, msg = await hosted_bot.start()
+            job.status = "done" if success else "failed"
+            job.result = msg
+            JOB_SECONDS.observe(time.perf_counter() - job_started, job.status)
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.result = str(e)
+        finally:
+            self.running -= 1
+            db.save()
+            await self.progress(job, "Finished")
+            self._forget_finished()
+            self._dispatch()
+
+    def requirement_lock(self, hosted_bot: HostedBot):
+        key = ""
+        for path in (hosted_bot.lock_path, hosted_bot.requirements_path):
+            if os.path.exists(path):
+                key = requirements_fingerprint(path)
+                break
+        return self.requirement_locks.setdefault(key, asyncio.Lock())
+
+    def _forget_finished(self, keep: int = 500):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:-keep]:
+            del self.jobs[job_id]
+
+    async def progress(self, job: Job, stage: str):
+        job.stage = stage
+        self.persist(job)
+        for listener in self.listeners:
+            listener(job)
+        if job.message_id is None:
+            return
+        outbox.edit(job.chat_id, job.message_id, self.render(job), reply_markup=get_job_keyboard(job))
+
+    def render(self, job: Job):
+        hosted_bot = db.bots.get(job.bot_key)
+        name = html.escape(hosted_bot.file_name) if hosted_bot else job.bot_key
+        icon = {"queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}.get(job.status, "•")
+        text = f"{icon} <b>Environment job {job.job_id}</b>\nBot: {name}\nStatus: {job.status}\nStage: {job.stage}"
+        if job.status == "queued":
+            text += f"\nQueue position: {self.position(job)}"
+        if job.result:
+            text += f"\n\n{html.escape(job.result[-500:])}"
+        return text
+
+    def resume(self):
+        """Requeue jobs that were pending when the host last stopped"""
+        for data in db.load_jobs():
+            job = Job.from_dict(data)
+            if job.job_id in self.jobs:
+                continue
+            job.status = "queued"
+            self.jobs[job.job_id] = job
+            self._enqueue(job)
+        if self.jobs:
+            logger.info(f"Resumed {len(self.jobs)} pending jobs")
+
+job_scheduler = JobScheduler()
+
+# ==============================================================================
+# RESOURCE METRICS
+# ==============================================================================
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def format_bytes(size: float):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+class MetricsRing:
+    """Fixed-size sample history of one bot, kept in flat arrays"""
+    # io_rate counts every byte through read/write calls, sockets included
+    FIELDS = ('time', 'cpu', 'rss', 'threads', 'fds', 'read_rate', 'write_rate', 'io_rate')
+
+    def __init__(self, size: int = METRICS_HISTORY):
+        self.size = size
+        self.columns = {field: array('d', bytes(8 * size)) for field in self.FIELDS}
+        self.count = 0
+        self.next = 0
+
+    def append(self, sample: dict):
+        for field in self.FIELDS:
+            self.columns[field][self.next] = sample[field]
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def series(self, field: str):
+        """Values oldest first"""
+        column = self.columns[field]
+        if self.count < self.size:
+            return column[:self.count]
+        return column[self.next:] + column[:self.next]
+
+
+class MetricsCollector:
+    """Samples every running bot's process tree in one pass per interval.
+
+    On Linux this reads /proc directly (one stat read per process, no per-attribute
+    calls); elsewhere it falls back to psutil oneshot(). Aggregates are computed at
+    sampling time so views only read dictionaries.
+    """
+    def __init__(self):
+        self.rings: Dict[str, MetricsRing] = {}
+        # Latest per-bot aggregates and host-wide totals, served to the UI
+        self.summary: Dict[str, dict] = {}
+        self.host: dict = {}
+        # bot key -> (timestamp, cpu ticks, read bytes, write bytes, syscall io bytes) of the last sample
+        self.previous: Dict[str, tuple] = {}
+        self.use_proc = os.path.isdir('/proc/self/task')
+
+    @staticmethod
+    def _read_stat(pid: int):
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+        # Fields after "(comm)": state ppid ... utime(11) stime(12) ... num_threads(17) ... rss(21)
+        return {
+            'ppid': int(fields[1]),
+            'ticks': int(fields[11]) + int(fields[12]),
+            'threads': int(fields[17]),
+            'rss': int(fields[21]) * PAGE_SIZE
+        }
+
+    @staticmethod
+    def _read_io(pid: int):
+        read_bytes = write_bytes = chars = 0
+        try:
+            with open(f'/proc/{pid}/io', 'rb') as f:
+                for line in f:
+                    if line.startswith(b'read_bytes:'):
+                        read_bytes = int(line.split()[1])
+                    elif line.startswith(b'write_bytes:'):
+                        write_bytes = int(line.split()[1])
+                    elif line.startswith((b'rchar:', b'wchar:')):
+                        chars += int(line.split()[1])
+        except OSError:
+            pass
+        return read_bytes, write_bytes, chars
+
+    def _scan_proc(self, roots: Dict[int, str]):
+        """One pass over /proc; returns raw totals per bot key"""
+        stats = {}
+        children: Dict[int, list] = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                stat = self._read_stat(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+            stats[int(entry)] = stat
+            children.setdefault(stat['ppid'], []).append(int(entry))
+
+        totals = {}
+        for root, key in roots.items():
+            if root not in stats:
+                continue
+            total = {'ticks': 0, 'rss': 0, 'threads': 0, 'fds': 0, 'read_bytes': 0, 'write_bytes': 0, 'chars': 0}
+            pending = [root]
+            while pending:
+                pid = pending.pop()
+                stat = stats[pid]
+                total['ticks'] += stat['ticks']
+                total['rss'] += stat['rss']
+                total['threads'] += stat['threads']
+                try:
+                    total['fds'] += len(os.listdir(f'/proc/{pid}/fd'))
+                except OSError:
+                    pass
+                read_bytes, write_bytes, chars = self._read_io(pid)
+                total['read_bytes'] += read_bytes
+                total['write_bytes'] += write_bytes
+                total['chars'] += chars
+                pending.extend(children.get(pid, []))
+            totals[key] = total
+        return totals
+
+    def _scan_psutil(self, roots: Dict[int, str]):
+        totals = {}
+        for root, key in roots.items():
+            total = {'ticks': 0, 'rss': 0, 'threads': 0, 'fds': 0, 'read_bytes': 0, 'write_bytes': 0, 'chars': 0}
+            try:
+                process = psutil.Process(root)
+                members = [process] + process.children(recursive=True)
+            except psutil.Error:
+                continue
+            for member in members:
+                try:
+                    with member.oneshot():
+                        times = member.cpu_times()
+                        total['ticks'] += (times.user + times.system) * CLOCK_TICKS
+                        total['rss'] += member.memory_info().rss
+                        total['threads'] += member.num_threads()
+                        if hasattr(member, 'num_fds'):
+                            total['fds'] += member.num_fds()
+                        elif hasattr(member, 'num_handles'):
+                            total['fds'] += member.num_handles()
+                        io = member.io_counters() if hasattr(member, 'io_counters') else None
+                        if io is not None:
+                            total['read_bytes'] += io.read_bytes
+                            total['write_bytes'] += io.write_bytes
+                            total['chars'] += getattr(io, 'read_chars', 0) + getattr(io, 'write_chars', 0)
+                except psutil.Error:
+                    continue
+            totals[key] = total
+        return totals
+
+    def sample(self, running: Dict[int, str], known_keys: set):
+        totals = self._scan_proc(running) if self.use_proc else self._scan_psutil(running)
+        now = time.time()
+
+        for key in list(self.summary):
+            if key not in totals:
+                del self.summary[key]
+                self.previous.pop(key, None)
+        for key in list(self.rings):
+            if key not in known_keys:
+                del self.rings[key]
+
+        for key, total in totals.items():
+            last = self.previous.get(key)
+            self.previous[key] = (now, total['ticks'], total['read_bytes'], total['write_bytes'], total['chars'])
+            if last is None:
+                continue
+            elapsed = max(now - last[0], 1e-6)
+            sample = {
+                'time': now,
+                'cpu': max(total['ticks'] - last[1], 0) / CLOCK_TICKS / elapsed * 100,
+                'rss': total['rss'],
+                'threads': total['threads'],
+                'fds': total['fds'],
+                'read_rate': max(total['read_bytes'] - last[2], 0) / elapsed,
+                'write_rate': max(total['write_bytes'] - last[3], 0) / elapsed,
+                'io_rate': max(total['chars'] - last[4], 0) / elapsed
+            }
+            ring = self.rings.setdefault(key, MetricsRing())
+            ring.append(sample)
+            cpu_history = ring.series('cpu')
+            self.summary[key] = dict(
+                sample,
+                cpu_avg=sum(cpu_history) / len(cpu_history),
+                rss_max=max(ring.series('rss'))
+            )
+
+        try:
+            host_rss = psutil.Process().memory_info().rss
+            memory = psutil.virtual_memory().percent
+        except psutil.Error:
+            host_rss, memory = 0, 0
+        self.host = {
+            'time': now,
+            'bots': len(totals),
+            'cpu': sum(item['cpu'] for item in self.summary.values()),
+            'rss': sum(item['rss'] for item in self.summary.values()),
+            'host_rss': host_rss,
+            'system_memory': memory
+        }
+
+    async def run(self):
+        while True:
+            try:
+                running = {
+                    bot.pid: bot.key for bot in db.bots.values()
+                    if bot.status == "running" and bot.pid and not bot.node
+                }
+                # /proc reads are cheap but not free; keep them off the event loop
+                await asyncio.to_thread(self.sample, running, set(db.bots))
+            except Exception as e:
+                logger.error(f"Metrics error: {e}")
+            await asyncio.sleep(METRICS_INTERVAL)
+
+metrics_collector = MetricsCollector()
+
+# ==============================================================================
+# RESOURCE LIMITS & ADMISSION
+# ==============================================================================
+CGROUP_MOUNT = '/sys/fs/cgroup'
+
+# Runs as `python -c CGROUP_EXEC_SOURCE <cgroup.procs> <argv...>`: joins the cgroup, then execs argv
+CGROUP_EXEC_SOURCE = r"""
+import os, sys
+with open(sys.argv[1], 'w') as f:
+    f.write('0')
+os.execv(sys.argv[2], sys.argv[2:])
+"""
+
+def write_cgroup_file(path: str, value: str):
+    with open(path, 'w') as f:
+        f.write(value)
+
+class CgroupManager:
+    """Places each bot in its own cgroup v2 leaf with CPU, memory and pids limits"""
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.oom_seen: Dict[str, int] = {}
+
+    def setup(self):
+        if not CGROUP_ENABLED:
+            return
+        if not os.path.exists(os.path.join(CGROUP_MOUNT, 'cgroup.controllers')):
+            logger.warning("cgroup v2 is not mounted; running bots without resource limits")
+            return
+        try:
+            with open('/proc/self/cgroup', 'r') as f:
+                own = next(line.split('::', 1)[1].strip() for line in f if line.startswith('0::'))
+            base = os.path.join(CGROUP_MOUNT, own.lstrip('/'))
+            # Controllers can only be delegated from a cgroup without processes,
+            # so the hosting service moves itself into a sibling leaf first
+            host = os.path.join(base, 'host')
+            os.makedirs(host, exist_ok=True)
+            with open(os.path.join(base, 'cgroup.procs'), 'r') as f:
+                pids = f.read().split()
+            for pid in pids:
+                try:
+                    write_cgroup_file(os.path.join(host, 'cgroup.procs'), pid)
+                except OSError:
+                    pass
+            write_cgroup_file(os.path.join(base, 'cgroup.subtree_control'), '+cpu +memory +pids')
+            root = os.path.join(base, 'hosted_bots')
+            os.makedirs(root, exist_ok=True)
+            write_cgroup_file(os.path.join(root, 'cgroup.subtree_control'), '+cpu +memory +pids')
+            # Under contention the event loop wins over the bots
+            write_cgroup_file(os.path.join(root, 'cpu.weight'), '50')
+            self.root = root
+            logger.info(f"cgroup limits enabled under {root}")
+        except (OSError, StopIteration) as e:
+            logger.warning(f"cgroup setup failed, running bots without resource limits: {e}")
+
+    def path(self, bot: HostedBot):
+        return os.path.join(self.root, bot.key)
+
+    def prepare(self, bot: HostedBot, scale: int = 1):
+        """Create the bot's cgroup with its limits; returns the cgroup.procs path the child joins.
+
+        `scale` multiplies the limits while an old and a new version run side by side.
+        """
+        if self.root is None:
+            return None
+        try:
+            path = self.path(bot)
+            os.makedirs(path, exist_ok=True)
+            write_cgroup_file(os.path.join(path, 'cpu.max'), f"{int(BOT_CPU_QUOTA * scale * 100000)} 100000")
+            write_cgroup_file(os.path.join(path, 'memory.max'), str(BOT_MEMORY_MAX * scale))
+            write_cgroup_file(os.path.join(path, 'pids.max'), str(BOT_PIDS_MAX * scale))
+            self.oom_seen[bot.key] = self.oom_kills(bot)
+            return os.path.join(path, 'cgroup.procs')
+        except OSError as e:
+            logger.error(f"Failed to apply limits to {bot.file_name}: {e}")
+            return None
+
+    def oom_kills(self, bot: HostedBot):
+        try:
+            with open(os.path.join(self.path(bot), 'memory.events'), 'r') as f:
+                for line in f:
+                    if line.startswith('oom_kill '):
+                        return int(line.split()[1])
+        except (OSError, TypeError):
+            pass
+        return 0
+
+    def consume_oom(self, bot: HostedBot):
+        """True once for every new OOM kill in the bot's cgroup"""
+        if self.root is None:
+            return False
+        count = self.oom_kills(bot)
+        if count > self.oom_seen.get(bot.key, 0):
+            self.oom_seen[bot.key] = count
+            return True
+        return False
+
+    def freeze(self, bot: HostedBot, frozen: bool):
+        """Freeze or thaw the bot's cgroup; False when there is no cgroup to use"""
+        if self.root is None or not os.path.isdir(self.path(bot)):
+            return False
+        try:
+            write_cgroup_file(os.path.join(self.path(bot), 'cgroup.freeze'), '1' if frozen else '0')
+            return True
+        except OSError as e:
+            logger.warning(f"cgroup freezer failed for {bot.file_name}: {e}")
+            return False
+
+    def reclaim(self, bot: HostedBot):
+        """Ask the kernel to page out the bot's memory (memory.reclaim, Linux 5.19+)"""
+        if self.root is None:
+            return False
+        try:
+            with open(os.path.join(self.path(bot), 'memory.current')) as f:
+                current = f.read().strip()
+            write_cgroup_file(os.path.join(self.path(bot), 'memory.reclaim'), current)
+            return True
+        except OSError:
+            # Also raised when the kernel could not reclaim the full amount
+            return False
+
+    def remove(self, bot: HostedBot):
+        if self.root is None:
+            return
+        self.oom_seen.pop(bot.key, None)
+        try:
+            os.rmdir(self.path(bot))
+        except OSError:
+            pass
+
+cgroup_manager = CgroupManager()
+
+
+class AdmissionController:
+    """Tracks resources committed to running bots and queues starts beyond host capacity"""
+    def __init__(self):
+        self.reserved: Dict[str, tuple] = {}
+        self.waiting = deque()
+        self.cpu_capacity = (psutil.cpu_count() or 1) * CPU_OVERCOMMIT
+        self.memory_capacity = psutil.virtual_memory().total * MEMORY_OVERCOMMIT
+
+    def committed(self):
+        return (
+            sum(cpu for cpu, _ in self.reserved.values()),
+            sum(memory for _, memory in self.reserved.values())
+        )
+
+    def admit(self, bot: HostedBot, force: bool = False):
+        """Reserve the bot's share of the host; returns (admitted, reason)"""
+        if bot.key in self.reserved:
+            return True, ""
+        # Without cgroups the quotas are not enforced, so only free memory is checked
+        limited = cgroup_manager.root is not None
+        if not force:
+            cpu, memory = self.committed()
+            if limited and cpu + BOT_CPU_QUOTA > self.cpu_capacity:
+                return False, f"{cpu:.1f}/{self.cpu_capacity:.1f} CPU committed"
+            if limited and memory + BOT_MEMORY_MAX > self.memory_capacity:
+                return False, f"{format_bytes(memory)}/{format_bytes(self.memory_capacity)} memory committed"
+            if psutil.virtual_memory().available < MEMORY_RESERVE:
+                return False, "host memory is low"
+        # An empty reservation still marks the bot as running, so its exit drains the queue
+        self.reserved[bot.key] = (BOT_CPU_QUOTA, BOT_MEMORY_MAX) if limited else (0.0, 0)
+        return True, ""
+
+    def queue(self, bot: HostedBot):
+        if bot not in self.waiting:
+            self.waiting.append(bot)
+
+    def cancel(self, bot: HostedBot):
+        if bot in self.waiting:
+            self.waiting.remove(bot)
+
+    def release(self, bot: HostedBot):
+        if self.reserved.pop(bot.key, None) is not None:
+            self.drain()
+
+    def drain(self):
+        """Start queued bots, oldest first, while they fit"""
+        while self.waiting:
+            bot = self.waiting[0]
+            if db.bots.get(bot.key) is not bot or bot.status == "running":
+                self.waiting.popleft()
+                continue
+            admitted, _ = self.admit(bot)
+            if not admitted:
+                break
+            self.waiting.popleft()
+            try:
+                asyncio.get_running_loop().create_task(bot.start())
+            except RuntimeError:
+                self.reserved.pop(bot.key, None)
+                break
+
+admission = AdmissionController()
+
+# ==============================================================================
+# HIBERNATION
+# ==============================================================================
+class Hibernator:
+    """Freezes bots that stay idle and wakes them when they are needed again.
+
+    A hibernated bot keeps its process, stopped by the cgroup freezer or SIGSTOP. Under
+    memory pressure its memory is reclaimed, or the process is evicted, and waking it
+    then starts it afresh.
+    """
+    def __init__(self):
+        self.idle_since: Dict[str, float] = {}
+
+    @staticmethod
+    def members(bot: HostedBot):
+        if not bot.pid:
+            # psutil.Process(None) would be the host itself
+            return []
+        try:
+            root = psutil.Process(bot.pid)
+            return [root] + root.children(recursive=True)
+        except (psutil.NoSuchProcess, ValueError):
+            return []
+
+    def hibernate(self, bot: HostedBot):
+        members = self.members(bot)
+        if not members:
+            return
+        if not cgroup_manager.freeze(bot, True):
+            signal_tree(bot.pid, members, signal.SIGSTOP)
+        bot.status = "hibernated"
+        self.idle_since.pop(bot.key, None)
+        # A frozen bot uses no CPU; its share goes to queued starts until it wakes
+        admission.release(bot)
+        logger.info(f"Bot hibernated: {bot.file_name} (PID: {bot.pid})")
+
+    def resume_process(self, bot: HostedBot):
+        """Thaw whichever way the process was frozen; harmless if it was not"""
+        cgroup_manager.freeze(bot, False)
+        members = self.members(bot)
+        if members and hasattr(signal, 'SIGCONT'):
+            signal_tree(bot.pid, members, signal.SIGCONT)
+
+    async def wake(self, bot: HostedBot):
+        """Bring a hibernated bot back; returns (success, message) like start()"""
+        if bot.status != "hibernated":
+            return True, ""
+        if bot.node:
+            return await bot.start()
+        self.idle_since.pop(bot.key, None)
+        members = self.members(bot)
+        if members and is_alive(members[0]):
+            admitted, reason = admission.admit(bot)
+            if not admitted:
+                admission.queue(bot)
+                return False, f"⏳ Host is at capacity ({reason}). The bot stays hibernated and wakes when resources free up."
+            self.resume_process(bot)
+            bot.status = "running"
+            logger.info(f"Bot woke up: {bot.file_name} (PID: {bot.pid})")
+            db.save()
+            return True, "✅ Bot woke up from hibernation"
+        # Evicted while hibernated
+        bot.status = "stopped"
+        bot.pid = None
+        return await bot.start()
+
+    async def evict(self, bot: HostedBot):
+        """Stop a hibernated bot's process to free its memory; it starts again when woken"""
+        pid = bot.pid
+        supervisor.unwatch(bot)
+        # Frozen processes cannot act on SIGTERM
+        self.resume_process(bot)
+        result = await terminate_process(pid)
+        if bot.process is not None:
+            bot.process.poll()
+        bot.process = None
+        bot.pid = None
+        logger.info(f"Evicted hibernated bot {bot.file_name} (PID: {pid}, {result})")
+
+    async def relieve_pressure(self):
+        """Free memory held by hibernated bots, largest first, until the host has headroom"""
+        frozen = []
+        for bot in db.bots.values():
+            if bot.status != "hibernated" or not bot.pid or bot.node:
+                continue
+            rss = 0
+            for member in self.members(bot):
+                try:
+                    rss += member.memory_info().rss
+                except psutil.Error:
+                    pass
+            frozen.append((rss, bot))
+        for _, bot in sorted(frozen, key=lambda item: item[0], reverse=True):
+            if psutil.virtual_memory().available >= MEMORY_RESERVE * 2:
+                break
+            if await asyncio.to_thread(cgroup_manager.reclaim, bot):
+                continue
+            await self.evict(bot)
+
+    async def tick(self):
+        now = time.monotonic()
+        changed = False
+        for bot in list(db.bots.values()):
+            if bot.status != "running" or bot.node:
+                self.idle_since.pop(bot.key, None)
+                continue
+            usage = metrics_collector.summary.get(bot.key)
+            if usage is None:
+                continue
+            if usage['cpu'] > HIBERNATE_CPU_PERCENT or usage['io_rate'] > HIBERNATE_IO_RATE:
+                self.idle_since.pop(bot.key, None)
+                continue
+            if now - self.idle_since.setdefault(bot.key, now) >= HIBERNATE_AFTER:
+                self.hibernate(bot)
+                changed = True
+        if psutil.virtual_memory().available < MEMORY_RESERVE * 2:
+            await self.relieve_pressure()
+            changed = True
+        if changed:
+            db.save()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Hibernation error: {e}")
+
+hibernator = Hibernator()
+
+# ==============================================================================
+# DISK JANITOR
+# ==============================================================================
+# Staging leftovers of uploads, deploys and transfers; trash is removed on sight
+STAGING_PREFIXES = ('.upload-', '.deploy-', '.cluster-')
+TRASH_PREFIX = '.trash-'
+
+def lower_priority():
+    """Run the calling thread at the lowest CPU priority (Linux applies nice per thread)"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, 19)
+    except (AttributeError, OSError):
+        pass
+
+def disk_usage(path: str):
+    """Bytes a tree occupies on disk; a hardlinked file is split evenly between its links"""
+    if not os.path.isdir(path):
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return 0
+        return stat.st_blocks * 512 // max(stat.st_nlink, 1)
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                total += stat.st_blocks * 512 // max(stat.st_nlink, 1)
+    return total
+
+def remove_path(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def is_log_file(name: str):
+    return name == 'output.log' or name.startswith('output.log.')
+
+def measure_bot_dir(bot: HostedBot, previous: Optional[tuple]):
+    """Disk usage of a bot directory, re-walking only the parts that changed.
+
+    The bot's own files are re-walked when a top-level entry changes; the venv only when
+    its site-packages directory does; logs, which change all the time, are just stat'ed.
+    Returns (total bytes, state to pass back as `previous` next time).
+    """
+    files_signature, files_size, venv_signature, venv_size = previous or (None, 0, None, 0)
+    venv_name = os.path.basename(bot.venv_path)
+    items, own, logs = [], [], 0
+    try:
+        with os.scandir(bot.bot_dir) as entries:
+            for entry in entries:
+                if entry.name == venv_name:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if is_log_file(entry.name):
+                    logs += stat.st_blocks * 512 // max(stat.st_nlink, 1)
+                    continue
+                items.append((entry.name, stat.st_size, stat.st_mtime_ns))
+                own.append(entry.path)
+    except OSError:
+        return 0, None
+    signature = tuple(sorted(items))
+    if previous is None or signature != files_signature:
+        files_signature, files_size = signature, sum(disk_usage(path) for path in own)
+
+    signature = None
+    # A venv still being built may not have site-packages yet
+    for path in (bot.site_packages, bot.venv_path):
+        try:
+            signature = (path, os.stat(path).st_mtime_ns)
+            break
+        except OSError:
+            continue
+    if previous is None or signature != venv_signature:
+        venv_signature, venv_size = signature, disk_usage(bot.venv_path) if signature else 0
+    return files_size + venv_size + logs, (files_signature, files_size, venv_signature, venv_size)
+
+class DiskJanitor:
+    """Walks HOSTED_BOTS_DIR a few entries at a time, removing what no bot owns and keeping
+    per-user disk totals that only change by the difference when a directory is re-measured"""
+    BOT_DIR_PATTERN = re.compile(r"(\d+)_([0-9a-zA-Z]+)")
+
+    def __init__(self):
+        self.pending = deque()
+        # Bytes per bot key: measured here, and reported by worker nodes for their bots
+        self.sizes: Dict[str, int] = {}
+        self.remote_sizes: Dict[str, int] = {}
+        self.signatures: Dict[str, tuple] = {}
+        self.usage: Dict[int, int] = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-gc", initializer=lower_priority)
+
+    def user_usage(self, user_id: int):
+        return self.usage.get(user_id, 0)
+
+    async def measure_user(self, user_id: int):
+        """A user's total, first measuring any of their bots the scan has not reached yet"""
+        for bot in db.get_user_bots(user_id):
+            if bot.key not in self.sizes:
+                await self.track(bot)
+        return self.user_usage(user_id)
+
+    def account(self, sizes: Dict[str, int], bot: HostedBot, size: int):
+        old = sizes.get(bot.key, 0)
+        sizes[bot.key] = size
+        self.usage[bot.user_id] = self.usage.get(bot.user_id, 0) + size - old
+
+    def forget(self, bot: HostedBot):
+        removed = self.sizes.pop(bot.key, 0) + self.remote_sizes.pop(bot.key, 0)
+        self.signatures.pop(bot.key, None)
+        if removed:
+            self.usage[bot.user_id] = max(0, self.usage.get(bot.user_id, 0) - removed)
+
+    async def offload(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def track(self, bot: HostedBot):
+        """Measure a bot directory now, re-walking only what changed since the last measurement"""
+        size, state = await self.offload(measure_bot_dir, bot, self.signatures.get(bot.key))
+        if state is None:
+            self.signatures.pop(bot.key, None)
+        else:
+            self.signatures[bot.key] = state
+        self.account(self.sizes, bot, size)
+
+    async def discard(self, path: str, reason: str):
+        """Move a tree aside at once, then delete it in the background thread"""
+        trash = os.path.join(HOSTED_BOTS_DIR, f"{TRASH_PREFIX}{uuid.uuid4().hex[:8]}")
+        try:
+            os.replace(path, trash)
+        except OSError as e:
+            logger.error(f"Disk janitor could not remove {path}: {e}")
+            return
+        size = await self.offload(disk_usage, trash)
+        await self.offload(remove_path, trash)
+        DISK_RECLAIMED.inc(amount=size)
+        logger.info(f"Disk janitor removed {path} ({reason}, {format_bytes(size)})")
+
+    def is_stale(self, path: str):
+        try:
+            return time.time() - os.stat(path).st_mtime > DISK_GC_GRACE
+        except OSError:
+            return False
+
+    async def check(self, name: str):
+        path = os.path.join(HOSTED_BOTS_DIR, name)
+        if name.startswith(TRASH_PREFIX):
+            await self.offload(remove_path, path)
+            return
+        if name.startswith(STAGING_PREFIXES):
+            if self.is_stale(path):
+                await self.discard(path, "abandoned staging")
+            return
+        match = self.BOT_DIR_PATTERN.fullmatch(name)
+        if match is None or not os.path.isdir(path):
+            return
+        bot = db.bots.get(name)
+        if bot is None:
+            if self.is_stale(path):
+                # A failed delete or a bot removed from the database by hand
+                dead = package_store.release_entries(name, package_store.bot_entries(name))
+                await package_store.collect(dead)
+                await self.discard(path, "no bot owns it")
+            return
+        await self.clean_bot(bot)
+        await self.track(bot)
+
+    async def clean_bot(self, bot: HostedBot):
+        """Remove what a known bot no longer needs"""
+        busy = job_scheduler.active_job(bot) is not None
+        if os.path.isdir(bot.venv_path) and not busy:
+            if bot.node:
+                await self.discard(bot.venv_path, "bot runs on a worker node")
+            elif not bot.dependencies_installed and bot.status == "stopped" and self.is_stale(bot.venv_path):
+                # Half-built by a failed job; rebuilt on the next start
+                await package_store.release(bot)
+                await self.discard(bot.venv_path, "unfinished environment")
+        try:
+            entries = list(os.scandir(bot.bot_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if busy or not entry.name.startswith('.'):
+                continue
+            if entry.name == '.wheels':
+                await self.discard(entry.path, "leftover wheels")
+            elif entry.name.endswith('.prev') and (bot.previous is None or bot.previous[1] != entry.path):
+                await self.discard(entry.path, "replaced version")
+
+    def reconcile_database(self):
+        """Drop bots whose files are gone; nothing is left to run or rebuild them from"""
+        for bot in list(db.bots.values()):
+            if bot.node or bot.status != "stopped" or os.path.exists(bot.script_path):
+                continue
+            if job_scheduler.active_job(bot) is not None:
+                continue
+            logger.warning(f"Disk janitor: {bot.key} has no {bot.file_name}; removing it from the database")
+            self.forget(bot)
+            db.remove_bot(bot.user_id, bot.bot_hash)
+
+    async def step(self):
+        if not self.pending:
+            self.reconcile_database()
+            self.pending.extend(await self.offload(os.listdir, HOSTED_BOTS_DIR))
+        for _ in range(min(DISK_GC_BATCH, len(self.pending))):
+            await self.check(self.pending.popleft())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(DISK_GC_INTERVAL)
+            try:
+                await self.step()
+            except Exception as e:
+                logger.error(f"Disk janitor error: {e}")
+
+disk_janitor = DiskJanitor()
+
+# ==============================================================================
+# HOSTED BOT INGRESS
+# ==============================================================================
+BOT_TOKEN_PATTERN = re.compile(r"\b\d{6,12}:[A-Za-z0-9_-]{30,}\b")
+
+def find_upload_token(bot: HostedBot):
+    """A token written into the project's sources or .env, captured once when it is uploaded.
+
+    Bots that read their token from the environment have none; their owner registers it.
+    """
+    paths = bot.source_files()
+    env_path = os.path.join(bot.bot_dir, '.env')
+    if os.path.exists(env_path):
+        paths.append(env_path)
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                match = BOT_TOKEN_PATTERN.search(f.read())
+        except OSError:
+            continue
+        if match:
+            return match.group(0)
+    return None
+
+def capture_upload_token(bot: HostedBot):
+    if not bot.token_registered:
+        bot.api_token = find_upload_token(bot) or bot.api_token
+
+def register_token(bot: HostedBot, token: str):
+    """Token sent by the owner; it takes precedence over anything found in the upload"""
+    token = token.strip()
+    if not BOT_TOKEN_PATTERN.fullmatch(token):
+        return False
+    bot.api_token = token
+    bot.token_registered = True
+    return True
+
+def api_session():
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+
+class IngressChannel:
+    """Per-bot buffer of raw updates and the task forwarding them to the bot's socket"""
+    def __init__(self, bot_key: str):
+        self.bot_key = bot_key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=INGRESS_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+
+
+class IngressRouter:
+    """Receives webhook updates for participating hosted bots and routes them over Unix sockets.
+
+    A participating bot serves HTTP on the socket named by $HOSTED_INGRESS_SOCKET and gets
+    each update as a POST with the JSON body Telegram sent. Updates are buffered while the
+    bot is down or restarting; a full buffer answers 503 so Telegram retries later.
+    """
+    def __init__(self):
+        self.channels: Dict[str, IngressChannel] = {}
+
+    def register(self, app: web.Application):
+        app.router.add_post('/ingress/{bot_key}', self.handle)
+
+    @staticmethod
+    def secret(bot: HostedBot):
+        return hmac.new(WEBHOOK_SECRET.encode(), bot.key.encode(), hashlib.sha256).hexdigest()[:32]
+
+    async def handle(self, request: web.Request):
+        bot = db.bots.get(request.match_info['bot_key'])
+        if bot is None or not bot.ingress_token:
+            return web.Response(status=404)
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret(bot):
+            return web.Response(status=401)
+        channel = self.channel(bot)
+        try:
+            channel.queue.put_nowait(await request.read())
+        except asyncio.QueueFull:
+            return web.Response(status=503, headers={'Retry-After': '2'})
+        return web.Response()
+
+    def channel(self, bot: HostedBot):
+        channel = self.channels.get(bot.key)
+        if channel is None:
+            channel = self.channels[bot.key] = IngressChannel(bot.key)
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.create_task(self.deliver(bot, channel))
+        return channel
+
+    async def deliver(self, bot: HostedBot, channel: IngressChannel):
+        delay = 0.5
+        async with ClientSession(
+            connector=UnixConnector(path=bot.ingress_socket), timeout=ClientTimeout(total=30)
+        ) as session:
+            while True:
+                body = await channel.queue.get()
+                if bot.status == "hibernated":
+                    await hibernator.wake(bot)
+                while True:
+                    try:
+                        async with session.post(
+                            'http://hosted-bot/update', data=body, headers={'Content-Type': 'application/json'}
+                        ) as response:
+                            if response.status < 500:
+                                break
+                    except Exception as e:
+                        logger.debug(f"Ingress delivery to {bot.key} failed: {e}")
+                    # Bot restarting or not listening yet: keep the update and retry
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5)
+                delay = 0.5
+                channel.queue.task_done()
+
+    async def enable(self, bot: HostedBot):
+        if not INGRESS_URL:
+            return False, "Ingress is not configured on this host (INGRESS_URL)."
+        if bot.node:
+            return False, "Ingress is not available for bots running on worker nodes."
+        token = bot.api_token
+        if not token:
+            return False, (
+                "This bot's token is not known: none was written in the upload. "
+                "Tap 🔑 Set token and send the token from @BotFather."
+            )
+        api = Bot(token=token, session=api_session())
+        try:
+            await api.set_webhook(
+                f"{INGRESS_URL.rstrip('/')}/ingress/{bot.key}", secret_token=self.secret(bot)
+            )
+        except Exception as e:
+            return False, f"setWebhook failed: {e}"
+        finally:
+            await api.session.close()
+        bot.ingress_token = token
+        db.save()
+        return True, "✅ Ingress enabled. Restart the bot so it receives HOSTED_INGRESS_SOCKET."
+
+    async def disable(self, bot: HostedBot):
+        if not bot.ingress_token:
+            return True, "Ingress is already off."
+        api = Bot(token=bot.ingress_token, session=api_session())
+        try:
+            await api.delete_webhook()
+        except Exception as e:
+            logger.warning(f"deleteWebhook for {bot.key} failed: {e}")
+        finally:
+            await api.session.close()
+        bot.ingress_token = None
+        db.save()
+        channel = self.channels.pop(bot.key, None)
+        if channel is not None and channel.task is not None:
+            channel.task.cancel()
+        return True, "Ingress disabled. Restart the bot to go back to polling."
+
+ingress = IngressRouter()
+
+# ==============================================================================
+# ZYGOTE LAUNCHER
+# ==============================================================================
+# Runs inside a bot venv as `python -c ZYGOTE_SOURCE <socket> <modules> <site-packages>`.
+# Forked bots share the preloaded modules' pages copy-on-write.
+ZYGOTE_SOURCE = r"""
+import importlib, json, os, runpy, signal, socket, sys
+
+sock_path, modules, site_packages = sys.argv[1], sys.argv[2], sys.argv[3]
+for name in filter(None, modules.split(',')):
+    try:
+        importlib.import_module(name)
+    except Exception as e:
+        print(f"zygote: preloading {name} failed: {e}", file=sys.stderr)
+
+# Each child's exit status goes back to the host over the status pipe sent with its launch
+status_fds = {}
+
+def reap(signum, frame):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        fd = status_fds.pop(pid, None)
+        if fd is not None:
+            try:
+                os.write(fd, f"{os.waitstatus_to_exitcode(status)}\n".encode())
+            except OSError:
+                pass
+            os.close(fd)
+
+signal.signal(signal.SIGCHLD, reap)
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+if os.path.exists(sock_path):
+    os.unlink(sock_path)
+server.bind(sock_path)
+server.listen(16)
+print("ready", flush=True)
+
+def rebase(path, new_site_packages):
+    return new_site_packages + path[len(site_packages):] if path.startswith(site_packages) else path
+
+def launch(request, out_fd, err_fd, status_fd):
+    server.close()
+    os.setsid()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+    for fd in [status_fd, *status_fds.values()]:
+        os.close(fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(out_fd, 1)
+    os.dup2(err_fd, 2)
+    for fd in (devnull, out_fd, err_fd):
+        os.close(fd)
+    if request['cgroup']:
+        try:
+            with open(request['cgroup'], 'w') as f:
+                f.write('0')
+        except OSError as e:
+            print(f"zygote: joining {request['cgroup']} failed: {e}", file=sys.stderr)
+            os._exit(1)
+    os.chdir(request['cwd'])
+    os.environ.update(request['env'])
+    # Resolve further imports from the bot's own venv, not the one the zygote started in
+    sys.path[:] = [request['cwd']] + [rebase(p, request['site_packages']) for p in sys.path[1:]]
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__path__', None)
+        if isinstance(path, list):
+            path[:] = [rebase(p, request['site_packages']) for p in path]
+    sys.argv = [request['script']]
+    runpy.run_path(request['script'], run_name='__main__')
+    sys.exit(0)
+
+while True:
+    conn, _ = server.accept()
+    with conn:
+        message, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+        request = json.loads(message)
+        # Hold SIGCHLD until the child's status pipe is registered
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            launch(request, *fds)
+        status_fds[pid] = fds[2]
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+        for fd in fds[:2]:
+            os.close(fd)
+        conn.sendall(json.dumps({'pid': pid}).encode())
+"""
+
+class ZygoteChild:
+    """Popen-like handle for a bot forked by a zygote, which reports the exit status over a pipe"""
+    def __init__(self, pid: int, status_fd: int):
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.status_fd = status_fd
+        loop = asyncio.get_running_loop()
+        # Resolves with the exit status, or None if the zygote went away first
+        self.reported = loop.create_future()
+        loop.add_reader(status_fd, self._collect)
+
+    def _collect(self):
+        try:
+            data = os.read(self.status_fd, 64)
+        except OSError:
+            data = b''
+        asyncio.get_running_loop().remove_reader(self.status_fd)
+        os.close(self.status_fd)
+        if data.strip():
+            self.returncode = int(data)
+        self.reported.set_result(self.returncode)
+
+    def poll(self):
+        return self.returncode
+
+class ZygoteManager:
+    """One fork server per distinct environment (locked requirements + preloaded modules)"""
+    def __init__(self):
+        self.zygotes: Dict[str, tuple] = {}
+        self.owners: Dict[str, str] = {}
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    def supported():
+        return hasattr(os, 'fork') and hasattr(socket, 'send_fds') and sys.platform != "win32"
+
+    def environment(self, bot: HostedBot):
+        modules = sorted(set(bot.extract_imports()) & set(ZYGOTE_PRELOAD))
+        digest = hashlib.sha256(','.join(modules).encode())
+        for path in (bot.lock_path, bot.requirements_path):
+            if os.path.exists(path):
+                digest.update(requirements_fingerprint(path).encode())
+                break
+        return digest.hexdigest()[:16], modules
+
+    async def get(self, bot: HostedBot):
+        key, modules = await asyncio.to_thread(self.environment, bot)
+        async with self.lock:
+            zygote = self.zygotes.get(key)
+            if zygote is not None and zygote[0].poll() is None:
+                return zygote[1]
+
+            os.makedirs(ZYGOTE_DIR, exist_ok=True)
+            sock_path = os.path.abspath(os.path.join(ZYGOTE_DIR, f"{key}.sock"))
+            with open(os.path.join(ZYGOTE_DIR, f"{key}.log"), 'ab') as log_file:
+                process = subprocess.Popen(
+                    [bot.venv_python, '-c', ZYGOTE_SOURCE, sock_path, ','.join(modules), bot.site_packages],
+                    stdout=subprocess.PIPE,
+                    stderr=log_file,
+                    cwd=bot.bot_dir,
+                    env=scrubbed_environ(),
+                    start_new_session=True
+                )
+            ready = await asyncio.to_thread(process.stdout.readline)
+            if ready.strip() != b"ready":
+                process.kill()
+                process.wait()
+                raise RuntimeError(f"zygote for {bot.file_name} did not come up")
+            self.zygotes[key] = (process, sock_path)
+            self.owners[key] = bot.key
+            logger.info(f"Zygote {key} ready (PID: {process.pid}, preloaded: {', '.join(modules) or 'none'})")
+            return sock_path
+
+    @staticmethod
+    def _request(sock_path: str, payload: bytes, fds):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(10)
+            conn.connect(sock_path)
+            socket.send_fds(conn, [payload], fds)
+            return json.loads(conn.recv(4096))
+
+    async def launch(self, bot: HostedBot, log_fd: int, cgroup_procs: Optional[str] = None):
+        """Fork the bot from its environment's zygote; returns a ZygoteChild, or None to fall back"""
+        if not self.supported():
+            return None
+        pipes = []
+        try:
+            sock_path = await self.get(bot)
+            pipes = [os.pipe()]
+            request = json.dumps({
+                'cwd': os.path.abspath(bot.bot_dir),
+                'script': bot.file_name,
+                'site_packages': bot.site_packages,
+                'env': bot.child_env(),
+                'cgroup': cgroup_procs
+            }).encode()
+            reply = await asyncio.to_thread(self._request, sock_path, request, [log_fd, log_fd, pipes[0][1]])
+        except Exception as e:
+            logger.warning(f"Zygote launch failed for {bot.file_name}, using a fresh interpreter: {e}")
+            for read_end, write_end in pipes:
+                os.close(read_end)
+                os.close(write_end)
+            return None
+        os.close(pipes[0][1])
+        return ZygoteChild(reply['pid'], pipes[0][0])
+
+    def retire(self, bot: HostedBot):
+        """Stop zygotes started from this bot's venv, which is about to be deleted"""
+        for key, owner in list(self.owners.items()):
+            if owner == bot.key:
+                del self.owners[key]
+                process, _ = self.zygotes.pop(key)
+                process.terminate()
+
+    def shutdown(self):
+        for process, _ in self.zygotes.values():
+            process.terminate()
+        self.zygotes.clear()
+        self.owners.clear()
+
+zygote_manager = ZygoteManager()
+
+# ==============================================================================
+# PROJECT UPLOADS
+# ==============================================================================
+UPLOAD_SUFFIXES = ('.py', '.zip', '.tar.gz', '.tgz')
+ENTRY_POINT_NAMES = ('main.py', 'bot.py', 'app.py', 'run.py', '__main__.py')
+# Never unpacked: they would clash with the host's venv or are just clutter
+SKIPPED_ARCHIVE_DIRS = {'venv', '.venv', '.git', '__pycache__', '__MACOSX'}
+
+def member_path(root: str, name: str):
+    """Where an archive member lands under root; None for members that are skipped"""
+    if name.startswith(('/', '\\')):
+        raise ValueError(f"Unsafe path in archive: {name}")
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if '..' in parts or (parts and ':' in parts[0]):
+        raise ValueError(f"Unsafe path in archive: {name}")
+    if not parts or SKIPPED_ARCHIVE_DIRS & set(parts):
+        return None
+    path = os.path.join(root, *parts)
+    if not os.path.realpath(path).startswith(os.path.realpath(root) + os.sep):
+        raise ValueError(f"Unsafe path in archive: {name}")
+    return path
+
+def copy_limited(src, path: str, budget: int):
+    """Copy a member to path in chunks, failing once it exceeds the remaining budget"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, 'wb') as dst:
+        for chunk in iter(lambda: src.read(1024 * 1024), b''):
+            written += len(chunk)
+            if written > budget:
+                raise ValueError(f"Project unpacks to more than {format_bytes(MAX_EXTRACTED_BYTES)}")
+            dst.write(chunk)
+    return written
+
+def extract_archive(archive_path: str, dest: str, archive_name: str):
+    """Unpack a .zip or .tar.gz member by member; symlinks and special files are dropped"""
+    total = 0
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            members = archive.infolist()
+            if len(members) > MAX_ARCHIVE_MEMBERS:
+                raise ValueError(f"Archive has more than {MAX_ARCHIVE_MEMBERS} files")
+            if sum(info.file_size for info in members) > MAX_EXTRACTED_BYTES:
+                raise ValueError(f"Project unpacks to more than {format_bytes(MAX_EXTRACTED_BYTES)}")
+            for info in members:
+                if info.is_dir() or (info.external_attr >> 16) & 0o170000 == 0o120000:
+                    continue
+                path = member_path(dest, info.filename)
+                if path is None:
+                    continue
+                with archive.open(info) as src:
+                    total += copy_limited(src, path, MAX_EXTRACTED_BYTES - total)
+    else:
+        # Stream mode reads the archive front to back without seeking or an index; gzip
+        # decompresses in bounded steps, which tarfile's own 'r|gz' does not
+        with gzip.open(archive_path, 'rb') as stream, tarfile.open(fileobj=stream, mode='r|') as archive:
+            for count, member in enumerate(archive):
+                if count >= MAX_ARCHIVE_MEMBERS:
+                    raise ValueError(f"Archive has more than {MAX_ARCHIVE_MEMBERS} files")
+                if not member.isfile():
+                    continue
+                path = member_path(dest, member.name)
+                if path is None:
+                    continue
+                total += copy_limited(archive.extractfile(member), path, MAX_EXTRACTED_BYTES - total)
+
+    # Projects are often packed inside a single top-level directory
+    entries = os.listdir(dest)
+    if len(entries) == 1 and os.path.isdir(os.path.join(dest, entries[0])):
+        inner = os.path.join(dest, f".unwrap-{uuid.uuid4().hex[:8]}")
+        os.replace(os.path.join(dest, entries[0]), inner)
+        for child in os.listdir(inner):
+            os.replace(os.path.join(inner, child), os.path.join(dest, child))
+        os.rmdir(inner)
+
+def find_entry_point(root: str):
+    """The script to run: Procfile, a conventional name, the only script, or the only one with a main guard"""
+    scripts = sorted(
+        name for name in os.listdir(root)
+        if name.endswith('.py') and os.path.isfile(os.path.join(root, name))
+    )
+    procfile = os.path.join(root, 'Procfile')
+    if os.path.isfile(procfile):
+        with open(procfile, errors='replace') as f:
+            match = re.search(r'python[\d.]*\s+(?:-u\s+)?([\w.-]+\.py)', f.read())
+        if match and match.group(1) in scripts:
+            return match.group(1)
+    for name in ENTRY_POINT_NAMES:
+        if name in scripts:
+            return name
+    if len(scripts) == 1:
+        return scripts[0]
+    guarded = []
+    for name in scripts:
+        with open(os.path.join(root, name), 'rb') as f:
+            if re.search(rb'if\s+__name__\s*==\s*[\'"]__main__[\'"]', f.read()):
+                guarded.append(name)
+    return guarded[0] if len(guarded) == 1 else None
+
+async def receive_upload(bot: Bot, user_id: int, document: types.Document):
+    """Stream an upload to disk and unpack it into a new bot directory.
+
+    Returns (True, HostedBot) or (False, error message).
+    """
+    file_name = os.path.basename(document.file_name)
+    staging = tempfile.mkdtemp(prefix='.upload-', dir=HOSTED_BOTS_DIR)
+    try:
+        download_path = os.path.join(staging, 'download')
+        await bot.download(document, destination=download_path)
+        bot_hash = (await asyncio.to_thread(file_digest, download_path, 'md5'))[:16]
+        if db.get_bot(user_id, bot_hash):
+            return False, "You already host this exact upload."
+
+        project = os.path.join(staging, 'project')
+        os.makedirs(project)
+        if file_name.endswith('.py'):
+            entry_point = file_name
+            os.replace(download_path, os.path.join(project, file_name))
+        else:
+            await asyncio.to_thread(extract_archive, download_path, project, file_name)
+            os.remove(download_path)
+            entry_point = find_entry_point(project)
+            if entry_point is None:
+                return False, "No entry point found. Put a main.py or bot.py at the top level of the project."
+
+        hosted_bot = HostedBot(user_id, bot_hash, entry_point)
+        for child in os.listdir(project):
+            os.replace(os.path.join(project, child), os.path.join(hosted_bot.bot_dir, child))
+        hosted_bot.project_requirements = os.path.exists(hosted_bot.requirements_path)
+        return True, hosted_bot
+    except ValueError as e:
+        return False, str(e)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+        logger.error(f"Failed to unpack {file_name}: {e}")
+        return False, "Could not unpack the upload. Is the archive complete?"
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+# ==============================================================================
+# FLEET OPERATIONS
+# ==============================================================================
+def requirement_names(bot: HostedBot):
+    """Canonical names of the distributions a bot's lock file or requirements list"""
+    names = set()
+    for path in (bot.lock_path, bot.requirements_path):
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            for line in f:
+                name = re.split(r"[<>=!~;@\[\s]", line.strip(), maxsplit=1)[0]
+                if name and not name.startswith(('#', '-')):
+                    names.add(canonical_name(name))
+    return names
+
+def bots_using(package: str, bots):
+    wanted = canonical_name(package)
+    return [bot for bot in bots if wanted in requirement_names(bot)]
+
+class FleetOperation:
+    """A start, stop, restart or migration across many bots, reported in one message that is edited as it goes"""
+    ICONS = {"start": "▶️", "stop": "⏹", "restart": "🔄", "migrate": "🚚"}
+
+    def __init__(self, action: str, bots, title: str):
+        self.action = action
+        self.bots = bots
+        self.title = title
+        self.ok = 0
+        self.queued = 0
+        self.failed = []
+        self.message: Optional[types.Message] = None
+
+    @property
+    def finished(self):
+        return self.ok + self.queued + len(self.failed)
+
+    def render(self):
+        text = (
+            f"{self.ICONS[self.action]} <b>{html.escape(self.title)}</b>\n"
+            f"Progress: {self.finished}/{len(self.bots)}\n✅ {self.ok}"
+        )
+        if self.queued:
+            text += f" | ⏳ {self.queued} queued"
+        if self.failed:
+            text += f" | ❌ {len(self.failed)}\n"
+            text += "\n".join(f"• {html.escape(name)}: {html.escape(msg[:100])}" for name, msg in self.failed[:10])
+        if self.finished == len(self.bots):
+            text += "\n\nDone."
+        return text
+
+    def report(self):
+        """Queue the current progress; the outbox sends only the newest version"""
+        if self.message is not None:
+            outbox.edit(self.message.chat.id, self.message.message_id, self.render())
+
+    def record(self, bot: HostedBot, success: bool, msg: str):
+        if success:
+            self.ok += 1
+        elif msg.startswith("⏳"):
+            # Waiting on an environment build or free capacity; it will start by itself
+            self.queued += 1
+        else:
+            self.failed.append((bot.file_name, msg))
+
+    async def run(self, chat: types.Message):
+        self.message = await chat.answer(self.render(), parse_mode="HTML")
+        if self.action == "migrate":
+            await self.migrate_all()
+            self.report()
+            return
+        to_start = self.bots if self.action == "start" else []
+        if self.action in ("stop", "restart"):
+            for bot in self.bots:
+                supervisor.cancel_restart(bot)
+                admission.cancel(bot)
+            # One batch: every bot gets SIGTERM at once and shares the grace period
+            results = await terminate_bots(self.bots)
+            for bot in self.bots:
+                result = results[bot.key]
+                if result.startswith("failed"):
+                    self.record(bot, False, result)
+                elif self.action == "stop":
+                    self.record(bot, True, result)
+                else:
+                    to_start.append(bot)
+            self.report()
+        if to_start:
+            await self.start_all(to_start)
+        db.save()
+        self.report()
+
+    async def start_all(self, bots):
+        """Start with bounded concurrency, spacing the starts to avoid CPU spikes"""
+        semaphore = asyncio.Semaphore(FLEET_CONCURRENCY)
+        next_start = time.monotonic()
+
+        async def start(bot: HostedBot):
+            nonlocal next_start
+            async with semaphore:
+                now = time.monotonic()
+                delay = max(0.0, next_start - now)
+                next_start = max(now, next_start) + FLEET_STAGGER
+                await asyncio.sleep(delay)
+                supervisor.reset(bot)
+                try:
+                    success, msg = await bot.start()
+                except Exception as e:
+                    success, msg = False, str(e)
+                self.record(bot, success, msg)
+                self.report()
+
+        await asyncio.gather(*(start(bot) for bot in bots))
+
+    async def migrate_all(self):
+        """Move each bot to the least loaded worker, or to this host when none is left"""
+        semaphore = asyncio.Semaphore(FLEET_CONCURRENCY)
+
+        async def migrate(bot: HostedBot):
+            async with semaphore:
+                try:
+                    success, msg = await cluster.migrate(bot, cluster.place(bot))
+                except Exception as e:
+                    success, msg = False, str(e)
+                self.record(bot, success, msg)
+                self.report()
+
+        await asyncio.gather(*(migrate(bot) for bot in self.bots))
+
+# ==============================================================================
+# CLUSTER
+# ==============================================================================
+# The control plane keeps the Telegram UI and the database; worker agents own bot
+# processes and venvs. Both sides exchange JSON lines over TCP: the worker opens the
+# connection with a hello, then the control plane sends {id, method, params} requests
+# and the worker answers {id, result | error} and pushes status and job events.
+CLUSTER_FRAME_LIMIT = 4 * 1024 * 1024
+CLUSTER_CHUNK = 512 * 1024
+# Left behind when a bot is shipped to a worker: rebuilt or regenerated there
+DEPLOY_EXCLUDED = {'venv', '__pycache__', 'output.log', 'ingress.sock'}
+
+async def send_frame(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+
+def bot_state(bot: HostedBot):
+    """What a worker reports about one of its bots"""
+    return {
+        'status': bot.status,
+        'file_name': bot.file_name,
+        'started_at': bot.started_at,
+        'stopped_at': bot.stopped_at,
+        'crashes': bot.crashes,
+        'oom_kills': bot.oom_kills,
+        'disk': disk_janitor.sizes.get(bot.key),
+        'usage': metrics_collector.summary.get(bot.key) if bot.status == "running" else None
+    }
+
+def bot_usage(bot: HostedBot):
+    if bot.node:
+        return cluster.usage.get(bot.key)
+    return metrics_collector.summary.get(bot.key)
+
+async def release_local(bot: HostedBot):
+    """Drop the state this host keeps for a bot that no longer runs here"""
+    supervisor.forget(bot)
+    zygote_manager.retire(bot)
+    admission.cancel(bot)
+    cgroup_manager.remove(bot)
+    await ingress.disable(bot)
+    await package_store.release(bot)
+
+async def delete_bot(bot: HostedBot):
+    """Stop a bot and remove every trace of it from this host and the database"""
+    if bot.node:
+        await cluster.delete(bot)
+    elif bot.status in ("running", "hibernated"):
+        await bot.stop()
+    await release_local(bot)
+    disk_janitor.forget(bot)
+    if os.path.exists(bot.bot_dir):
+        try:
+            shutil.rmtree(bot.bot_dir)
+        except Exception as e:
+            logger.error(f"Error deleting dir: {e}")
+    db.remove_bot(bot.user_id, bot.bot_hash)
+
+def pack_bot(bot: HostedBot, path: str):
+    """Write the bot's sources as a .tar.gz under a top-level directory named after the bot"""
+    def keep(info: tarfile.TarInfo):
+        parts = info.name.split('/')[1:]
+        if any(part.startswith('.') or part in DEPLOY_EXCLUDED for part in parts):
+            return None
+        if not (info.isfile() or info.isdir()):
+            return None
+        return info
+
+    with tarfile.open(path, 'w:gz') as archive:
+        archive.add(bot.bot_dir, arcname=bot.key, filter=keep)
+
+class WorkerNode:
+    """A connected worker agent and the calls waiting for its answers"""
+    def __init__(self, node_id: str, writer: asyncio.StreamWriter, load: dict):
+        self.node_id = node_id
+        self.writer = writer
+        self.load = load
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.seen = time.monotonic()
+
+    async def call(self, method: str, timeout: float = CLUSTER_CALL_TIMEOUT, **params):
+        self.next_id += 1
+        call_id = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[call_id] = future
+        try:
+            await send_frame(self.writer, {'id': call_id, 'method': method, 'params': params})
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(call_id, None)
+
+    def resolve(self, message: dict):
+        future = self.pending.get(message.get('id'))
+        if future is None or future.done():
+            return
+        if 'error' in message:
+            future.set_exception(RuntimeError(message['error']))
+        else:
+            future.set_result(message.get('result'))
+
+    def fail_pending(self, reason: str):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(reason))
+
+class ClusterManager:
+    """Control plane side: tracks workers, places bots on them and moves bots between them"""
+    def __init__(self):
+        self.nodes: Dict[str, WorkerNode] = {}
+        # Nodes that take no new bots; kept across reconnects
+        self.draining = set()
+        # Latest resource usage of remote bots, by bot key
+        self.usage: Dict[str, dict] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start_server(self):
+        self.server = await asyncio.start_server(
+            self.handle_connection, CLUSTER_HOST, CLUSTER_PORT, limit=CLUSTER_FRAME_LIMIT
+        )
+        logger.info(f"Cluster control plane listening on {CLUSTER_HOST}:{CLUSTER_PORT}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        peer = writer.get_extra_info('peername')
+        node = None
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), WORKER_HEARTBEAT * 3))
+            node_id = str(hello.get('hello', ''))
+            if not hmac.compare_digest(str(hello.get('secret', '')), CLUSTER_SECRET) or not node_id:
+                logger.warning(f"Rejected worker connection from {peer}")
+                await send_frame(writer, {'error': 'unauthorized'})
+                return
+            if node_id in self.nodes:
+                await send_frame(writer, {'error': f'worker {node_id} is already connected'})
+                return
+            node = WorkerNode(node_id, writer, hello.get('load', {}))
+            self.nodes[node_id] = node
+            await send_frame(writer, {'welcome': True})
+            logger.info(f"Worker {node_id} connected from {peer}")
+            self.apply_status(node, hello.get('bots', {}))
+            asyncio.create_task(self.reconcile(node, set(hello.get('bots', {}))))
+
+            while True:
+                line = await asyncio.wait_for(reader.readline(), WORKER_HEARTBEAT * 3)
+                if not line:
+                    break
+                node.seen = time.monotonic()
+                message = json.loads(line)
+                event = message.get('event')
+                if event is None:
+                    node.resolve(message)
+                elif event == 'status':
+                    node.load = message.get('load', node.load)
+                    self.apply_status(node, message.get('bots', {}))
+                elif event == 'job':
+                    await self.apply_job(node, message['job'])
+        except (asyncio.TimeoutError, ConnectionError, ValueError, KeyError) as e:
+            logger.warning(f"Worker connection from {peer} lost: {e!r}")
+        finally:
+            if node is not None and self.nodes.get(node.node_id) is node:
+                del self.nodes[node.node_id]
+                node.fail_pending(f"Worker {node.node_id} disconnected")
+                for job in job_scheduler.jobs.values():
+                    if job.node == node.node_id and job.active:
+                        job.status = "failed"
+                        job.result = "Worker disconnected"
+                logger.warning(f"Worker {node.node_id} disconnected")
+            writer.close()
+
+    def apply_status(self, node: WorkerNode, bots: Dict[str, dict]):
+        changed = False
+        for key, state in bots.items():
+            bot = db.bots.get(key)
+            if bot is None or bot.node != node.node_id:
+                continue
+            for field in ('status', 'started_at', 'stopped_at', 'crashes', 'oom_kills'):
+                if getattr(bot, field) != state[field]:
+                    setattr(bot, field, state[field])
+                    changed = True
+            if state.get('disk') is not None:
+                disk_janitor.account(disk_janitor.remote_sizes, bot, state['disk'])
+            if state.get('usage'):
+                self.usage[key] = state['usage']
+            else:
+                self.usage.pop(key, None)
+        if changed:
+            db.save()
+
+    async def apply_job(self, node: WorkerNode, data: dict):
+        """Mirror a worker's job so its status message here follows the build"""
+        job = self.mirror_job(node.node_id, data)
+        await job_scheduler.progress(job, data['stage'])
+
+    def mirror_job(self, node_id: str, data: dict) -> Job:
+        job = job_scheduler.jobs.get(data['job_id'])
+        if job is None:
+            job = Job.from_dict(data)
+            job.node = node_id
+            job.chat_id = job.message_id = None
+            job_scheduler.jobs[job.job_id] = job
+        job.status = data['status']
+        job.result = data.get('result')
+        return job
+
+    async def reconcile(self, node: WorkerNode, keys):
+        """Remove bots the worker still has but no longer owns; redeploy ones it lost"""
+        try:
+            for key in keys:
+                bot = db.bots.get(key)
+                if bot is None or bot.node != node.node_id:
+                    logger.info(f"Removing stale {key} from worker {node.node_id}")
+                    await node.call('delete', key=key)
+            for bot in list(db.bots.values()):
+                if bot.node == node.node_id and bot.key not in keys:
+                    logger.warning(f"Worker {node.node_id} lost {bot.key}; redeploying")
+                    await self.deploy(bot, node.node_id, autostart=bot.status in ("running", "hibernated"))
+        except Exception as e:
+            logger.error(f"Reconciling worker {node.node_id} failed: {e}")
+
+    def place(self, bot: HostedBot) -> Optional[str]:
+        """The connected worker with the most free memory per hosted bot; None when there is none"""
+        best, best_score = None, -1.0
+        for node in self.nodes.values():
+            if node.node_id in self.draining or node.node_id == bot.node:
+                continue
+            score = node.load.get('memory_available', 0) / (node.load.get('bots', 0) + 1)
+            if score > best_score:
+                best, best_score = node, score
+        if best is None:
+            return None
+        # Counted now so a burst of uploads spreads out before the next report
+        best.load['bots'] = best.load.get('bots', 0) + 1
+        return best.node_id
+
+    def node_for(self, node_id: Optional[str]):
+        node = self.nodes.get(node_id)
+        if node is None:
+            raise ConnectionError(f"Worker {node_id} is offline.")
+        return node
+
+    async def upload(self, node: WorkerNode, name: str, chunks):
+        """Stream data to a staging file on the worker"""
+        first = True
+        for chunk in chunks:
+            await node.call('put', name=name, data=base64.b64encode(chunk).decode(), append=not first)
+            first = False
+        if first:
+            await node.call('put', name=name, data='', append=False)
+
+    async def deploy(self, bot: HostedBot, node_id: str, autostart: bool = False):
+        """Ship the bot's sources to a worker and queue its environment build there.
+
+        Returns (success, message, job or None).
+        """
+        try:
+            node = self.node_for(node_id)
+            archive_path = os.path.join(HOSTED_BOTS_DIR, f".deploy-{bot.key}.tar.gz")
+            await asyncio.to_thread(pack_bot, bot, archive_path)
+            try:
+                with open(archive_path, 'rb') as f:
+                    await self.upload(node, bot.key, iter(lambda: f.read(CLUSTER_CHUNK), b''))
+            finally:
+                os.remove(archive_path)
+            result = await node.call(
+                'deploy', key=bot.key, user_id=bot.user_id, bot_hash=bot.bot_hash, file_name=bot.file_name,
+                project_requirements=bot.project_requirements, autostart=autostart
+            )
+        except Exception as e:
+            logger.error(f"Deploying {bot.key} to {node_id} failed: {e}")
+            return False, f"❌ Could not deploy to worker {node_id}: {e}", None
+        job = self.mirror_job(node_id, result['job'])
+        return True, f"⏳ Deployed to worker {node_id} (job {job.job_id}).", job
+
+    async def action(self, bot: HostedBot, method: str, **params):
+        try:
+            result = await self.node_for(bot.node).call(method, key=bot.key, **params)
+        except Exception as e:
+            return False, f"❌ {e}"
+        node = self.nodes.get(bot.node)
+        if node is not None and result.get('bot'):
+            self.apply_status(node, {bot.key: result['bot']})
+        return result['ok'], result['msg']
+
+    async def start(self, bot: HostedBot):
+        return await self.action(bot, 'start')
+
+    async def stop(self, bot: HostedBot):
+        return await self.action(bot, 'stop')
+
+    async def delete(self, bot: HostedBot):
+        self.usage.pop(bot.key, None)
+        success, msg = await self.action(bot, 'delete')
+        if not success:
+            # Removed when the worker reconnects and reports a bot it no longer owns
+            logger.warning(f"Could not delete {bot.key} on {bot.node}: {msg}")
+
+    async def logs(self, bot: HostedBot, count: int = 30):
+        try:
+            return (await self.node_for(bot.node).call('logs', key=bot.key, count=count))['lines']
+        except Exception as e:
+            return [f"(logs unavailable: {e})"]
+
+    async def update(self, bot: HostedBot, file_name: str, source: str):
+        """Hand a new version to the worker; the copy kept here follows so migrations ship it"""
+        try:
+            node = self.node_for(bot.node)
+            with open(source, 'rb') as f:
+                await self.upload(node, bot.key, iter(lambda: f.read(CLUSTER_CHUNK), b''))
+            result = await node.call('update', key=bot.key, file_name=file_name)
+        except Exception as e:
+            return False, f"❌ {e}", None
+        if result['ok']:
+            await asyncio.to_thread(bot.replace_script, file_name, source)
+            bot.discard_previous()
+        self.apply_status(node, {bot.key: result['bot']})
+        job = self.mirror_job(bot.node, result['job']) if result.get('job') else None
+        return result['ok'], result['msg'], job
+
+    async def wait_job(self, job: Job):
+        deadline = time.monotonic() + MIGRATE_TIMEOUT
+        while job.active and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+        return job.status == "done"
+
+    async def migrate(self, bot: HostedBot, target: Optional[str]):
+        """Move a bot to a worker (or to this host when target is None).
+
+        The new environment is built before the bot is stopped at its old place.
+        """
+        source = bot.node
+        if target == source:
+            return False, "Bot is already there."
+        was_running = bot.status in ("running", "hibernated")
+        if target is None:
+            job = job_scheduler.submit(bot)
+        else:
+            success, msg, job = await self.deploy(bot, target)
+            if not success:
+                return False, msg
+        if not await self.wait_job(job):
+            if target is not None:
+                await self.action(bot, 'delete')
+            return False, f"❌ Environment build failed: {job.result or 'timed out'}"
+
+        if was_running:
+            await bot.stop()
+        if source is None:
+            # The environment here is no longer needed
+            await release_local(bot)
+            await asyncio.to_thread(shutil.rmtree, bot.venv_path, True)
+            bot.dependencies_installed = False
+            bot.pid = None
+        else:
+            await self.delete(bot)
+        bot.node = target
+        bot.status = "stopped"
+        db.save()
+        where = f"worker {target}" if target else "the control plane"
+        if was_running:
+            supervisor.reset(bot)
+            success, msg = await bot.start()
+            if not success:
+                return False, f"Moved to {where} but failed to start: {msg}"
+        return True, f"✅ Moved to {where}."
+
+cluster = ClusterManager()
+
+class WorkerAgent:
+    """Worker side: keeps a connection to the control plane and serves its requests"""
+    def __init__(self):
+        host, _, port = CLUSTER_ADDRESS.rpartition(':')
+        self.host = host
+        self.port = int(port)
+        self.writer: Optional[asyncio.StreamWriter] = None
+        supervisor.listeners.append(self.on_exit)
+        job_scheduler.listeners.append(self.on_job)
+
+    def load(self):
+        memory = psutil.virtual_memory()
+        return {
+            'bots': len(db.bots),
+            'running': sum(1 for bot in db.bots.values() if bot.status == "running"),
+            'cpu': metrics_collector.host.get('cpu', 0.0) if metrics_collector.host else 0.0,
+            'memory_available': memory.available,
+            'memory_percent': memory.percent
+        }
+
+    def snapshot(self):
+        return {key: bot_state(bot) for key, bot in db.bots.items()}
+
+    def notify(self, message: dict):
+        """Send an event without waiting; dropped while disconnected"""
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+    def on_exit(self, bot: HostedBot, returncode):
+        self.notify({'event': 'status', 'load': self.load(), 'bots': {bot.key: bot_state(bot)}})
+
+    def on_job(self, job: Job):
+        self.notify({'event': 'job', 'job': job.to_dict()})
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(WORKER_HEARTBEAT)
+            self.notify({'event': 'status', 'load': self.load(), 'bots': self.snapshot()})
+
+    async def run(self):
+        """Connect, serve until the connection drops, and reconnect with backoff"""
+        delay = 1.0
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=CLUSTER_FRAME_LIMIT)
+                await send_frame(writer, {
+                    'hello': WORKER_ID, 'secret': CLUSTER_SECRET, 'load': self.load(), 'bots': self.snapshot()
+                })
+                answer = json.loads(await reader.readline() or b'{}')
+                if not answer.get('welcome'):
+                    raise ConnectionError(answer.get('error', 'connection closed'))
+                logger.info(f"Connected to control plane {CLUSTER_ADDRESS} as {WORKER_ID}")
+                delay = 1.0
+                self.writer = writer
+                heartbeat = asyncio.create_task(self.heartbeat())
+                try:
+                    await self.serve(reader)
+                finally:
+                    heartbeat.cancel()
+                    self.writer = None
+                    writer.close()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Control plane unreachable: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def serve(self, reader: asyncio.StreamReader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Control plane closed the connection")
+            asyncio.create_task(self.handle(json.loads(line)))
+
+    async def handle(self, request: dict):
+        handler = getattr(self, f"rpc_{request.get('method')}", None)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown method {request.get('method')}")
+            reply = {'id': request['id'], 'result': await handler(**request.get('params', {}))}
+        except Exception as e:
+            logger.error(f"Request {request.get('method')} failed: {e}")
+            reply = {'id': request['id'], 'error': str(e)}
+        self.notify(reply)
+
+    def staging_path(self, name: str):
+        if not re.fullmatch(r"[\w-]+", name):
+            raise ValueError(f"Bad staging name {name}")
+        return os.path.join(HOSTED_BOTS_DIR, f".cluster-{name}")
+
+    def hosted(self, key: str) -> HostedBot:
+        bot = db.bots.get(key)
+        if bot is None:
+            raise ValueError(f"Unknown bot {key}")
+        return bot
+
+    async def rpc_put(self, name: str, data: str, append: bool):
+        with open(self.staging_path(name), 'ab' if append else 'wb') as f:
+            f.write(base64.b64decode(data))
+        return True
+
+    async def rpc_deploy(self, key: str, user_id: int, bot_hash: str, file_name: str,
+                         project_requirements: bool, autostart: bool):
+        if not re.fullmatch(r"[0-9a-f]+", bot_hash):
+            raise ValueError(f"Bad bot hash {bot_hash}")
+        if key in db.bots:
+            await delete_bot(db.bots[key])
+        archive_path = self.staging_path(key)
+        staging = tempfile.mkdtemp(prefix='.deploy-', dir=HOSTED_BOTS_DIR)
+        try:
+            await asyncio.to_thread(extract_archive, archive_path, staging, 'bot.tar.gz')
+            hosted_bot = HostedBot(user_id, bot_hash, file_name)
+            for child in os.listdir(staging):
+                os.replace(os.path.join(staging, child), os.path.join(hosted_bot.bot_dir, child))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            os.remove(archive_path)
+        hosted_bot.project_requirements = project_requirements
+        db.add_bot(hosted_bot)
+        job = job_scheduler.submit(hosted_bot, autostart=autostart)
+        return {'job': job.to_dict()}
+
+    async def rpc_start(self, key: str):
+        bot = self.hosted(key)
+        supervisor.reset(bot)
+        success, msg = await bot.start()
+        db.save()
+        return {'ok': success, 'msg': msg, 'bot': bot_state(bot)}
+
+    async def rpc_stop(self, key: str):
+        bot = self.hosted(key)
+        success, msg = await bot.stop()
+        db.save()
+        return {'ok': success, 'msg': msg, 'bot': bot_state(bot)}
+
+    async def rpc_delete(self, key: str):
+        if key in db.bots:
+            await delete_bot(db.bots[key])
+        return {'ok': True, 'msg': "Deleted"}
+
+    async def rpc_logs(self, key: str, count: int):
+        return {'lines': await bot_logs.tail(self.hosted(key), count)}
+
+    async def rpc_update(self, key: str, file_name: str):
+        bot = self.hosted(key)
+        path = self.staging_path(key)
+        try:
+            success, msg, job = await bot.update(os.path.basename(file_name), path)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        db.save()
+        return {'ok': success, 'msg': msg, 'bot': bot_state(bot), 'job': job.to_dict() if job else None}
+
+async def run_worker():
+    """Entry point of `kl03.py --worker`: run bots for a control plane instead of serving Telegram"""
+    if not CLUSTER_SECRET:
+        logger.error("❌ ERROR: CLUSTER_SECRET is required to run a worker.")
+        return
+    cgroup_manager.setup()
+    await supervisor.reconcile()
+    job_scheduler.resume()
+    asyncio.create_task(monitor_bots())
+    asyncio.create_task(wheelhouse.prefetch_loop())
+    asyncio.create_task(metrics_collector.run())
+    asyncio.create_task(probe_event_loop_lag())
+    asyncio.create_task(disk_janitor.run())
+    asyncio.create_task(bot_logs.run())
+    if HIBERNATE_AFTER > 0:
+        asyncio.create_task(hibernator.run())
+
+    agent = WorkerAgent()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
+    agent_task = asyncio.create_task(agent.run())
+    try:
+        logger.info(f"✅ Worker {WORKER_ID} is running...")
+        await stop_event.wait()
+    finally:
+        agent_task.cancel()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await on_shutdown()
+
+# ==============================================================================
+# UI HELPERS
+# ==============================================================================
+# Keyboards are immutable, so one instance per distinct layout is built and shared
+@lru_cache(maxsize=None)
+def get_main_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📤 Upload Bot", callback_data="upload_bot"),
+            InlineKeyboardButton(text="📋 My Bots", callback_data="my_bots")
+        ],
+        [InlineKeyboardButton(text="📊 Statistics", callback_data="stats")]
+    ])
+    return keyboard
+
+@lru_cache(maxsize=4096)
+def get_bot_control_keyboard(bot_hash: str, status: str):
+    buttons = []
+    if status == "running":
+        buttons.append([
+            InlineKeyboardButton(text="⏹ Stop", callback_data=f"stop_{bot_hash}"),
+            InlineKeyboardButton(text="🔄 Restart", callback_data=f"restart_{bot_hash}")
+        ])
+    else:
+        buttons.append([
+            InlineKeyboardButton(text="▶️ Start", callback_data=f"start_{bot_hash}"),
+            InlineKeyboardButton(text="🔄 Restart", callback_data=f"restart_{bot_hash}")
+        ])
+    buttons.extend([
+        [
+            InlineKeyboardButton(text="📜 Logs", callback_data=f"logs_{bot_hash}"),
+            InlineKeyboardButton(text="🌐 Ingress", callback_data=f"ingress_{bot_hash}")
+        ],
+        [
+            InlineKeyboardButton(text="🔁 Update", callback_data=f"update_{bot_hash}"),
+            InlineKeyboardButton(text="🗑 Delete", callback_data=f"delete_{bot_hash}")
+        ]
+    ])
+    buttons.append([InlineKeyboardButton(text="« Back", callback_data="my_bots")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_job_keyboard(job: Job):
+    return job_keyboard(job.job_id, job.bot_key.split('_', 1)[1], job.active)
+
+@lru_cache(maxsize=1024)
+def job_keyboard(job_id: str, bot_hash: str, active: bool):
+    buttons = []
+    if active:
+        buttons.append([InlineKeyboardButton(text="🔄 Refresh", callback_data=f"job_{job_id}")])
+    buttons.append([InlineKeyboardButton(text="🤖 View Bot", callback_data=f"view_{bot_hash}")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@lru_cache(maxsize=4096)
+def get_bots_list_keyboard(rows: tuple):
+    """The My Bots list for rows of (bot_hash, status, file_name)"""
+    buttons = []
+    for bot_hash, status, file_name in rows:
+        status_icon = {"running": "🟢", "hibernated": "💤"}.get(status, "🔴")
+        buttons.append([InlineKeyboardButton(text=f"{status_icon} {file_name}", callback_data=f"view_{bot_hash}")])
+    buttons.append([
+        InlineKeyboardButton(text="▶️ Start all", callback_data="fleet_start"),
+        InlineKeyboardButton(text="⏹ Stop all", callback_data="fleet_stop"),
+        InlineKeyboardButton(text="🔄 Restart all", callback_data="fleet_restart")
+    ])
+    buttons.append([InlineKeyboardButton(text="« Back", callback_data="main_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def render_bot_view(bot: HostedBot):
+    online = bot.node is None or bot.node in cluster.nodes
+    head, details = bot_view_parts(bot.bot_hash, bot.status, bot.file_name, bot.node, online, bot.crashes, bot.oom_kills)
+    # Uptime and usage change on every view, so only they are formatted each time
+    text = f"{head}{bot.get_uptime()}{details}"
+    usage = bot_usage(bot)
+    if usage and bot.status == "running":
+        text += (
+            f"\nCPU: {usage['cpu']:.1f}% (avg {usage['cpu_avg']:.1f}%)"
+            f"\nRAM: {format_bytes(usage['rss'])} (peak {format_bytes(usage['rss_max'])})"
+            f"\nThreads: {usage['threads']:.0f} | FDs: {usage['fds']:.0f}"
+        )
+    return text
+
+@lru_cache(maxsize=4096)
+def bot_view_parts(bot_hash: str, status: str, file_name: str, node: Optional[str], online: bool,
+                   crashes: int, oom_kills: int):
+    """The stable parts of a bot's status card, before and after its uptime"""
+    head = f"🤖 <b>{html.escape(file_name)}</b>\nStatus: {status}\nUptime: "
+    details = ""
+    if node:
+        details += f"\nNode: {html.escape(node)}{'' if online else ' (offline)'}"
+    if crashes or oom_kills:
+        details += f"\nCrashes: {crashes} | OOM kills: {oom_kills}"
+    return head, details
+
+def render_ingress(bot: HostedBot):
+    if bot.token_registered:
+        token = "registered by you"
+    elif bot.api_token:
+        token = "found in the upload"
+    else:
+        token = "unknown, set it to enable the ingress"
+    text = (
+        f"🌐 <b>Shared ingress for {html.escape(bot.file_name)}</b>: {'on' if bot.ingress_token else 'off'}\n"
+        f"Token: {token}\n\n"
+        "The host receives your bot's updates by webhook and forwards each one as an HTTP POST "
+        "to the Unix socket in <code>$HOSTED_INGRESS_SOCKET</code>, so the bot needs no polling loop."
+    )
+    toggle = (
+        InlineKeyboardButton(text="Disable", callback_data=f"ingressoff_{bot.bot_hash}") if bot.ingress_token
+        else InlineKeyboardButton(text="Enable", callback_data=f"ingresson_{bot.bot_hash}")
+    )
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, InlineKeyboardButton(text="🔑 Set token", callback_data=f"ingresstoken_{bot.bot_hash}")],
+        [InlineKeyboardButton(text="« Back", callback_data=f"view_{bot.bot_hash}")]
+    ])
+    return text, keyboard
+
+def is_not_modified(error: TelegramBadRequest):
+    return "message is not modified" in str(error)
+
+async def edit_message(message: types.Message, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                       parse_mode: Optional[str] = "HTML"):
+    """edit_text, skipped when the message already shows exactly this content"""
+    shown = message.html_text if parse_mode == "HTML" else message.text
+    # Compared as plain data: objects from an update also carry the bot they came through
+    markup = message.reply_markup.model_dump() if message.reply_markup else None
+    # Telegram trims surrounding whitespace from what it stores
+    if shown == text.strip() and markup == (reply_markup.model_dump() if reply_markup else None):
+        return
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except TelegramBadRequest as e:
+        if not is_not_modified(e):
+            raise
+
+class Outbox:
+    """Rate-limited queue for the progress messages the host edits by itself (jobs, fleet operations).
+
+    Edits of the same message coalesce, so a burst of progress updates costs one API call
+    per OUTBOX_CHAT_INTERVAL at most, and flood-wait replies pause the queue instead of failing.
+    """
+    SENT_MEMORY = 1000
+
+    def __init__(self):
+        self.bot: Optional[Bot] = None
+        # (chat id, message id) -> request, oldest first
+        self.pending: "OrderedDict[tuple, dict]" = OrderedDict()
+        # Last content delivered per edited message
+        self.sent: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.chat_ready: Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+
+    def edit(self, chat_id: int, message_id: int, text: str,
+             reply_markup: Optional[InlineKeyboardMarkup] = None, parse_mode: Optional[str] = "HTML"):
+        if self.bot is None:
+            return
+        key = (chat_id, message_id)
+        content = (text, reply_markup, parse_mode)
+        if key not in self.pending and self.sent.get(key) == content:
+            return
+        # Replaces a queued edit in place, keeping its turn
+        self.pending[key] = {'chat_id': chat_id, 'message_id': message_id, 'content': content}
+        self.wakeup.set()
+
+    def next_ready(self, now: float):
+        """The oldest request whose chat may be written to now, or the time to wait"""
+        wait = None
+        for key, request in self.pending.items():
+            ready = self.chat_ready.get(request['chat_id'], 0.0)
+            if ready <= now:
+                return key, 0.0
+            wait = ready - now if wait is None else min(wait, ready - now)
+        return None, wait
+
+    async def deliver(self, request: dict):
+        text, reply_markup, parse_mode = request['content']
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=request['chat_id'], message_id=request['message_id'],
+                reply_markup=reply_markup, parse_mode=parse_mode
+            )
+        except TelegramBadRequest as e:
+            if not is_not_modified(e):
+                raise
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                key, wait = self.next_ready(time.monotonic())
+                if key is None:
+                    await asyncio.sleep(wait)
+                    continue
+                request = self.pending.pop(key)
+                self.chat_ready[request['chat_id']] = time.monotonic() + OUTBOX_CHAT_INTERVAL
+                try:
+                    await self.deliver(request)
+                    self.sent[key] = request['content']
+                    self.sent.move_to_end(key)
+                    if len(self.sent) > self.SENT_MEMORY:
+                        self.sent.popitem(last=False)
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Outbox: flood control, pausing {e.retry_after}s")
+                    if key not in self.pending:
+                        # Nothing newer was queued for this message meanwhile; retry it first
+                        self.pending[key] = request
+                        self.pending.move_to_end(key, last=False)
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    logger.debug(f"Outbox: message to {request['chat_id']} not delivered: {e}")
+                await asyncio.sleep(1 / OUTBOX_RATE)
+
+outbox = Outbox()
+
+# ==============================================================================
+# HANDLERS
+# ==============================================================================
+async def cmd_start(message: types.Message):
+    await message.answer(
+        "🤖 <b>Bot Hosting Service</b>\nUpload a .py file or a .zip / .tar.gz project to host it.",
+        reply_markup=get_main_keyboard(),
+        parse_mode="HTML"
+    )
+
+async def callback_upload_bot(callback: CallbackQuery, state: FSMContext):
+    await edit_message(
+        callback.message,
+        "📤 Send me your <b>.py</b> file, or a <b>.zip</b> / <b>.tar.gz</b> project.\n"
+        "Projects run main.py or bot.py and use their own requirements.txt if they have one.",
+        parse_mode="HTML"
+    )
+    await state.set_state(BotUpload.waiting_for_file)
+    await callback.answer()
+
+async def callback_my_bots(callback: CallbackQuery):
+    user_bots = db.get_user_bots(callback.from_user.id)
+    if not user_bots:
+        await edit_message(callback.message, "You have no bots.", reply_markup=get_main_keyboard())
+        await callback.answer()
+        return
+
+    await asyncio.gather(*(bot.check_status() for bot in user_bots))
+    db.save()
+
+    keyboard = get_bots_list_keyboard(tuple((bot.bot_hash, bot.status, bot.file_name) for bot in user_bots))
+    await edit_message(callback.message, "📋 <b>Your Hosted Bots</b>", reply_markup=keyboard)
+    await callback.answer()
+
+async def callback_view_bot(callback: CallbackQuery):
+    try:
+        bot_hash = callback.data.split("_")[1]
+        bot = db.get_bot(callback.from_user.id, bot_hash)
+        if not bot:
+            await callback.answer("Bot not found.", show_alert=True)
+            return
+
+        # Opening a hibernated bot is the owner's cue that it is wanted again
+        await hibernator.wake(bot)
+        await bot.check_status()
+        text = render_bot_view(bot)
+        await edit_message(callback.message, text, reply_markup=get_bot_control_keyboard(bot_hash, bot.status), parse_mode="HTML")
+        await callback.answer()
+    except IndexError:
+        await callback.answer("Error viewing bot.")
+
+async def callback_stats(callback: CallbackQuery):
+    user_bots = db.get_user_bots(callback.from_user.id)
+    running = [bot for bot in user_bots if bot.status == "running"]
+    usage = [(bot, bot_usage(bot)) for bot in running if bot_usage(bot)]
+    host = metrics_collector.host
+
+    text = (
+        "📊 <b>Statistics</b>\n"
+        f"Your bots: {len(user_bots)} ({len(running)} running)\n"
+        f"Your usage: CPU {sum(u['cpu'] for _, u in usage):.1f}% | "
+        f"RAM {format_bytes(sum(u['rss'] for _, u in usage))}\n"
+        f"Your disk: {format_bytes(disk_janitor.user_usage(callback.from_user.id))}"
+    )
+    text += f" of {format_bytes(USER_DISK_QUOTA)}\n" if USER_DISK_QUOTA else "\n"
+    for bot, item in sorted(usage, key=lambda pair: pair[1]['cpu'], reverse=True)[:10]:
+        text += f"  • {html.escape(bot.file_name)}: {item['cpu']:.1f}% / {format_bytes(item['rss'])}\n"
+    if host:
+        text += (
+            f"\n🖥 <b>Host</b>\nBots running: {host['bots']}\n"
+            f"Bots CPU: {host['cpu']:.1f}% | Bots RAM: {format_bytes(host['rss'])}\n"
+            f"Hosting service RAM: {format_bytes(host['host_rss'])} | System memory: {host['system_memory']:.0f}%"
+        )
+    if cluster.nodes:
+        text += f"\nWorker nodes: {len(cluster.nodes)} connected"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Refresh", callback_data="stats")],
+        [InlineKeyboardButton(text="« Back", callback_data="main_menu")]
+    ])
+    await edit_message(callback.message, text, reply_markup=keyboard)
+    await callback.answer()
+
+async def callback_ingress_bot(callback: CallbackQuery, state: FSMContext):
+    action, bot_hash = callback.data.split("_", 1)
+    bot = db.get_bot(callback.from_user.id, bot_hash)
+    if not bot:
+        await callback.answer("Bot not found.", show_alert=True)
+        return
+
+    if action == "ingresstoken":
+        await state.set_state(BotUpload.waiting_for_token)
+        await state.update_data(token_hash=bot_hash)
+        await edit_message(
+            callback.message,
+            f"🔑 Send the token of <b>{html.escape(bot.file_name)}</b> from @BotFather.\n"
+            "The ingress uses it to register the webhook; your message is deleted right away.",
+            parse_mode="HTML"
+        )
+        await callback.answer()
+        return
+    if action == "ingresson":
+        success, msg = await ingress.enable(bot)
+        await callback.answer(msg, show_alert=True)
+    elif action == "ingressoff":
+        success, msg = await ingress.disable(bot)
+        await callback.answer(msg, show_alert=True)
+
+    text, keyboard = render_ingress(bot)
+    await edit_message(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    if action == "ingress":
+        await callback.answer()
+
+async def callback_logs_bot(callback: CallbackQuery):
+    bot_hash = callback.data.split("_", 1)[1]
+    bot = db.get_bot(callback.from_user.id, bot_hash)
+    if not bot:
+        await callback.answer("Bot not found.", show_alert=True)
+        return
+
+    lines = await cluster.logs(bot) if bot.node else await bot_logs.tail(bot, 30)
+    output = "\n".join(lines)[-3500:] or "(no output yet)"
+    text = f"📜 <b>{html.escape(bot.file_name)}</b>\n<pre>{html.escape(output)}</pre>"
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Refresh", callback_data=f"logs_{bot_hash}")],
+        [InlineKeyboardButton(text="« Back", callback_data=f"view_{bot_hash}")]
+    ])
+    await edit_message(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+async def send_job_status(message: types.Message, job: Job):
+    if job.message_id is not None:
+        return
+    status_message = await message.answer(
+        job_scheduler.render(job), reply_markup=get_job_keyboard(job), parse_mode="HTML"
+    )
+    job_scheduler.attach(job, status_message.chat.id, status_message.message_id)
+
+async def callback_job_status(callback: CallbackQuery):
+    job = job_scheduler.jobs.get(callback.data.split("_", 1)[1])
+    if not job or job.user_id != callback.from_user.id:
+        await callback.answer("Job not found.", show_alert=True)
+        return
+    await edit_message(callback.message, job_scheduler.render(job), reply_markup=get_job_keyboard(job))
+    await callback.answer()
+
+async def callback_action_bot(callback: CallbackQuery):
+    action, bot_hash = callback.data.split("_", 1)
+    bot = db.get_bot(callback.from_user.id, bot_hash)
+    if not bot: 
+        await callback.answer("Bot not found", show_alert=True)
+        return
+
+    if action in ("start", "restart"):
+        supervisor.reset(bot)
+
+    if action == "start":
+        await callback.answer("Starting...", show_alert=False)
+        success, msg = await bot.start()
+        await callback.answer(msg, show_alert=True)
+    elif action == "stop":
+        await callback.answer("Stopping...", show_alert=False)
+        success, msg = await bot.stop()
+        await callback.answer(msg, show_alert=True)
+    elif action == "restart":
+        await callback.answer("Restarting...", show_alert=False)
+        success, msg = await bot.restart()
+        await callback.answer(msg, show_alert=True)
+    elif action == "delete":
+        await delete_bot(bot)
+        await callback.answer("Deleted", show_alert=True)
+        await callback_my_bots(callback)
+        return
+
+    job = job_scheduler.active_job(bot)
+    if job is not None:
+        await send_job_status(callback.message, job)
+    db.save()
+    await callback_view_bot(callback)
+
+async def callback_update_bot(callback: CallbackQuery, state: FSMContext):
+    bot_hash = callback.data.split("_", 1)[1]
+    bot = db.get_bot(callback.from_user.id, bot_hash)
+    if not bot:
+        await callback.answer("Bot not found", show_alert=True)
+        return
+    await state.set_state(BotUpload.waiting_for_update)
+    await state.update_data(update_hash=bot_hash)
+    await edit_message(
+        callback.message,
+        f"🔁 Send the new version of <b>{html.escape(bot.file_name)}</b> (.py).\n"
+        "The environment is kept; only new dependencies are installed.",
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+async def callback_fleet(callback: CallbackQuery):
+    action = callback.data.split("_", 1)[1]
+    user_bots = db.get_user_bots(callback.from_user.id)
+    if action == "start":
+        bots = [bot for bot in user_bots if bot.status != "running"]
+    else:
+        bots = [bot for bot in user_bots if bot.status in ("running", "hibernated")]
+    if not bots:
+        await callback.answer("Nothing to do.", show_alert=True)
+        return
+    await callback.answer()
+    await FleetOperation(action, bots, f"{action.capitalize()} all my bots").run(callback.message)
+
+async def cmd_stop_using(message: types.Message, command: CommandObject):
+    """/stopusing <package>: stop your running bots that depend on a package (all bots for admins)"""
+    if not command.args:
+        await message.answer("Usage: /stopusing <package>")
+        return
+    package = command.args.split()[0]
+    if message.from_user.id in ADMIN_IDS:
+        candidates = list(db.bots.values())
+    else:
+        candidates = db.get_user_bots(message.from_user.id)
+    bots = [bot for bot in bots_using(package, candidates) if bot.status in ("running", "hibernated")]
+    if not bots:
+        await message.answer(f"No running bots use {html.escape(package)}.")
+        return
+    await FleetOperation("stop", bots, f"Stop bots using {package}").run(message)
+
+async def cmd_restart_all(message: types.Message):
+    """/restartall: restart every running bot on the host, e.g. after an upgrade (admins only)"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Admins only.")
+        return
+    bots = [bot for bot in db.bots.values() if bot.status in ("running", "hibernated")]
+    if not bots:
+        await message.answer("No running bots.")
+        return
+    await FleetOperation("restart", bots, "Restart all bots on the host").run(message)
+
+async def cmd_nodes(message: types.Message):
+    """/nodes: connected worker nodes and their load (admins only)"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Admins only.")
+        return
+    local = sum(1 for bot in db.bots.values() if not bot.node)
+    text = f"🖧 <b>Nodes</b>\n• control plane: {local} bots\n"
+    for node_id in sorted(set(cluster.nodes) | {bot.node for bot in db.bots.values() if bot.node}):
+        node = cluster.nodes.get(node_id)
+        hosted = sum(1 for bot in db.bots.values() if bot.node == node_id)
+        if node is None:
+            text += f"• {html.escape(node_id)}: offline, {hosted} bots\n"
+            continue
+        load = node.load
+        text += (
+            f"• {html.escape(node_id)}: {hosted} bots ({load.get('running', 0)} running) | "
+            f"CPU {load.get('cpu', 0):.1f}% | RAM free {format_bytes(load.get('memory_available', 0))}"
+        )
+        text += " | draining\n" if node_id in cluster.draining else "\n"
+    await message.answer(text, parse_mode="HTML")
+
+async def cmd_drain(message: types.Message, command: CommandObject):
+    """/drain <node>: stop placing bots on a worker and move its bots elsewhere (admins only)"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Admins only.")
+        return
+    if not command.args:
+        await message.answer("Usage: /drain <node>")
+        return
+    node_id = command.args.split()[0]
+    cluster.draining.add(node_id)
+    bots = [bot for bot in db.bots.values() if bot.node == node_id]
+    if not bots:
+        await message.answer(f"{html.escape(node_id)} is draining and hosts no bots.")
+        return
+    await FleetOperation("migrate", bots, f"Drain {node_id}").run(message)
+
+async def cmd_undrain(message: types.Message, command: CommandObject):
+    """/undrain <node>: let a drained worker take new bots again (admins only)"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Admins only.")
+        return
+    if not command.args:
+        await message.answer("Usage: /undrain <node>")
+        return
+    cluster.draining.discard(command.args.split()[0])
+    await message.answer("✅ Node accepts new bots again.")
+
+async def cmd_migrate(message: types.Message, command: CommandObject):
+    """/migrate <bot id> <node | local>: move one bot (admins only)"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("❌ Admins only.")
+        return
+    args = (command.args or "").split()
+    if len(args) != 2:
+        await message.answer("Usage: /migrate <bot id> <node | local>")
+        return
+    bot = next((bot for bot in db.bots.values() if args[0] in (bot.key, bot.bot_hash)), None)
+    if bot is None:
+        await message.answer("❌ Bot not found.")
+        return
+    target = None if args[1] == "local" else args[1]
+    if target is not None and target not in cluster.nodes:
+        await message.answer(f"❌ Worker {html.escape(target)} is not connected.")
+        return
+    await message.answer(f"🚚 Moving {html.escape(bot.file_name)}...")
+    success, msg = await cluster.migrate(bot, target)
+    await message.answer(msg)
+
+async def callback_main_menu(callback: CallbackQuery):
+    await edit_message(
+        callback.message,
+        "🤖 <b>Bot Hosting Service</b>\nUpload a .py file or a .zip / .tar.gz project to host it.",
+        reply_markup=get_main_keyboard(),
         parse_mode="HTML"
     )
     await callback.answer()
 
 async def handle_document(message: types.Message, state: FSMContext):
     document = message.document
-    if not document.file_name.endswith('.py'):
-        await message.answer("❌ Only .py files allowed.")
+    if not (document.file_name or '').endswith(UPLOAD_SUFFIXES):
+        await message.answer("❌ Send a .py file or a .zip / .tar.gz project.")
+        return
+    if document.file_size and document.file_size > MAX_UPLOAD_BYTES:
+        await message.answer(f"❌ Uploads are limited to {format_bytes(MAX_UPLOAD_BYTES)}.")
+        return
+    used = await disk_janitor.measure_user(message.from_user.id) if USER_DISK_QUOTA else 0
+    if USER_DISK_QUOTA and used + (document.file_size or 0) > USER_DISK_QUOTA:
+        await message.answer(
+            f"❌ Disk quota reached: {format_bytes(used)} of {format_bytes(USER_DISK_QUOTA)} used. "
+            "Delete a bot to make room."
+        )
         return
 
-    file = await message.bot.get_file(document.file_id)
-    file_content = await message.bot.download_file(file.file_path)
-    content_bytes = file_content.read()
+    success, result = await receive_upload(message.bot, message.from_user.id, document)
+    if not success:
+        await message.answer(f"❌ {result}")
+        return
+    hosted_bot = result
+    # Counted right away so uploads in quick succession see each other
+    await disk_janitor.track(hosted_bot)
+    if USER_DISK_QUOTA and disk_janitor.user_usage(message.from_user.id) > USER_DISK_QUOTA:
+        await delete_bot(hosted_bot)
+        await message.answer(f"❌ This project would take you over your {format_bytes(USER_DISK_QUOTA)} disk quota.")
+        return
 
-    bot_hash = hashlib.md5(content_bytes).hexdigest()[:16]
+    await asyncio.to_thread(hosted_bot.create_requirements)
+    await asyncio.to_thread(capture_upload_token, hosted_bot)
+    db.add_bot(hosted_bot)
 
-    hosted_bot = HostedBot(message.from_user.id, bot_hash, document.file_name)
+    await message.answer(
+        f"✅ Uploaded! Entry point: {hosted_bot.file_name}. Creating environment...",
+        reply_markup=get_bot_control_keyboard(hosted_bot.bot_hash, "stopped")
+    )
+    job = None
+    node_id = cluster.place(hosted_bot)
+    if node_id is not None:
+        hosted_bot.node = node_id
+        success, msg, job = await cluster.deploy(hosted_bot, node_id)
+        if not success:
+            # Built here instead
+            hosted_bot.node = None
+        db.save()
+    if job is None:
+        job = job_scheduler.submit(hosted_bot)
+    await send_job_status(message, job)
+    await state.clear()
 
-    with open(hosted_bot.script_path, 'wb') as f:
-        f.write(content_bytes)
+async def handle_update(message: types.Message, state: FSMContext):
+    document = message.document
+    file_name = os.path.basename(document.file_name or '')
+    if not file_name.endswith('.py'):
+        await message.answer("❌ Only .py files allowed.")
+        return
+    if document.file_size and document.file_size > MAX_UPLOAD_BYTES:
+        await message.answer(f"❌ Uploads are limited to {format_bytes(MAX_UPLOAD_BYTES)}.")
+        return
 
-    hosted_bot.create_requirements()
-    db.add_bot(hosted_bot)
+    data = await state.get_data()
+    await state.clear()
+    hosted_bot = db.get_bot(message.from_user.id, data.get('update_hash', ''))
+    if not hosted_bot:
+        await message.answer("❌ Bot not found.", reply_markup=get_main_keyboard())
+        return
+    used = await disk_janitor.measure_user(message.from_user.id) if USER_DISK_QUOTA else 0
+    if USER_DISK_QUOTA and used + (document.file_size or 0) > USER_DISK_QUOTA:
+        await message.answer(
+            f"❌ Disk quota reached: {format_bytes(used)} of {format_bytes(USER_DISK_QUOTA)} used. "
+            "Delete a bot to make room."
+        )
+        return
 
-    await message.answer("✅ Uploaded! Creating environment...", reply_markup=get_bot_control_keyboard(bot_hash, "stopped"))
-    await hosted_bot.create_venv()
+    staging = tempfile.mkdtemp(prefix='.upload-', dir=HOSTED_BOTS_DIR)
+    try:
+        download_path = os.path.join(staging, file_name)
+        await message.bot.download(document, destination=download_path)
+        success, msg, job = await hosted_bot.update(file_name, download_path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    if not hosted_bot.node:
+        await disk_janitor.track(hosted_bot)
+        await asyncio.to_thread(capture_upload_token, hosted_bot)
+    db.save()
+    await message.answer(msg, reply_markup=get_bot_control_keyboard(hosted_bot.bot_hash, hosted_bot.status))
+    if job is not None:
+        await send_job_status(message, job)
+
+async def handle_ingress_token(message: types.Message, state: FSMContext):
+    data = await state.get_data()
     await state.clear()
+    # The token should not stay in the chat history
+    try:
+        await message.delete()
+    except TelegramBadRequest:
+        pass
+    hosted_bot = db.get_bot(message.from_user.id, data.get('token_hash', ''))
+    if not hosted_bot:
+        await message.answer("❌ Bot not found.", reply_markup=get_main_keyboard())
+        return
+    if not register_token(hosted_bot, message.text or ''):
+        await message.answer("❌ That does not look like a bot token (123456789:AA...). Open 🌐 Ingress to try again.")
+        return
+    db.save()
+    if hosted_bot.ingress_token:
+        # Already on: move the webhook to the new token
+        await ingress.disable(hosted_bot)
+    success, msg = await ingress.enable(hosted_bot)
+    text, keyboard = render_ingress(hosted_bot)
+    status = html.escape(msg) if success else f"❌ {html.escape(msg)}"
+    await message.answer(f"{status}\n\n{text}", reply_markup=keyboard, parse_mode="HTML")
+
+async def monitor_tick():
+    started = time.perf_counter()
+    changed = False
+    for bot in list(db.bots.values()): 
+        before = bot.status
+        await bot.check_status()
+        if bot.status != before:
+            changed = True
+            supervisor.schedule_restart(bot, None)
+    if changed:
+        db.save()
+    MONITOR_SECONDS.observe(time.perf_counter() - started)
 
 async def monitor_bots():
+    """Slow safety-net sweep; exits are normally reported by the supervisor"""
     while True:
+        await asyncio.sleep(MONITOR_INTERVAL)
         try:
-            if db.bots:
-                for bot in list(db.bots.values()): 
-                    await bot.check_status()
-                db.save()
+            await monitor_tick()
         except Exception as e:
             logger.error(f"Monitor error: {e}")
-        await asyncio.sleep(30)
 
 async def on_shutdown():
     logger.info("Shutting down...")
-    for bot in db.bots.values():
-        if bot.status == "running":
-            await bot.stop()
+    # Bots on worker nodes keep running; their workers own them
+    results = await terminate_bots([
+        bot for bot in db.bots.values() if bot.status in ("running", "hibernated") and not bot.node
+    ])
+    for key, result in results.items():
+        logger.info(f"Shutdown {key}: {result}")
+    zygote_manager.shutdown()
+    await db.flush()
+
+# ==============================================================================
+# WEBHOOK SERVER
+# ==============================================================================
+class WebhookServer:
+    """Receives updates over HTTP and feeds them to the dispatcher from a bounded queue"""
+    def __init__(self, dp: Dispatcher, bot: Bot, app: web.Application):
+        self.dp = dp
+        self.bot = bot
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+        self.workers = []
+        self.accepting = False
+        self.app = app
+        self.app.router.add_post(WEBHOOK_PATH, self.handle)
+        self.runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request):
+        if not self.accepting:
+            return web.Response(status=503, headers={'Retry-After': '5'})
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Back-pressure: Telegram redelivers non-2xx updates later
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        return web.Response()
+
+    async def worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Update {update.update_id} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, WEB_HOST, PORT).start()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(WEBHOOK_WORKERS)]
+        self.accepting = True
+        await self.bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=self.dp.resolve_used_update_types()
+        )
+        logger.info(f"Webhook server listening on {WEB_HOST}:{PORT}{WEBHOOK_PATH}")
+
+    async def stop(self):
+        """Refuse new updates, finish the queued ones, then close the server"""
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook drain timed out with {self.queue.qsize()} updates left")
+        for task in self.workers:
+            task.cancel()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+async def run_webhook(dp: Dispatcher, bot: Bot, app: web.Application):
+    server = WebhookServer(dp, bot, app)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
 
 async def main():
     if not TOKEN:
         logger.error("❌ ERROR: Bot Token is missing.")
         return
 
-    bot = Bot(token=TOKEN)
+    bot = Bot(token=TOKEN, session=api_session())
     dp = Dispatcher(storage=MemoryStorage())
 
     dp.message.register(cmd_start, Command("start"))
+    dp.message.register(cmd_stop_using, Command("stopusing"))
+    dp.message.register(cmd_restart_all, Command("restartall"))
+    dp.message.register(cmd_nodes, Command("nodes"))
+    dp.message.register(cmd_drain, Command("drain"))
+    dp.message.register(cmd_undrain, Command("undrain"))
+    dp.message.register(cmd_migrate, Command("migrate"))
     dp.callback_query.register(callback_upload_bot, F.data == "upload_bot")
     dp.callback_query.register(callback_my_bots, F.data == "my_bots")
     dp.callback_query.register(callback_main_menu, F.data == "main_menu")
+    dp.callback_query.register(callback_stats, F.data == "stats")
     dp.callback_query.register(callback_view_bot, F.data.startswith("view_"))
+    dp.callback_query.register(callback_logs_bot, F.data.startswith("logs_"))
+    dp.callback_query.register(callback_ingress_bot, F.data.startswith(("ingress_", "ingresson_", "ingressoff_", "ingresstoken_")))
+    dp.callback_query.register(callback_job_status, F.data.startswith("job_"))
     dp.callback_query.register(callback_action_bot, F.data.startswith(("start_", "stop_", "restart_", "delete_")))
+    dp.callback_query.register(callback_update_bot, F.data.startswith("update_"))
+    dp.callback_query.register(callback_fleet, F.data.startswith("fleet_"))
     dp.message.register(handle_document, F.document, BotUpload.waiting_for_file)
+    dp.message.register(handle_update, F.document, BotUpload.waiting_for_update)
+    dp.message.register(handle_ingress_token, F.text, BotUpload.waiting_for_token)
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
 
+    cgroup_manager.setup()
+    await supervisor.reconcile()
+    outbox.bot = bot
+    asyncio.create_task(outbox.run())
+    job_scheduler.resume()
     asyncio.create_task(monitor_bots())
+    asyncio.create_task(wheelhouse.prefetch_loop())
+    asyncio.create_task(metrics_collector.run())
+    asyncio.create_task(probe_event_loop_lag())
+    asyncio.create_task(disk_janitor.run())
+    asyncio.create_task(bot_logs.run())
+    if HIBERNATE_AFTER > 0:
+        asyncio.create_task(hibernator.run())
+    if CLUSTER_PORT:
+        if CLUSTER_SECRET:
+            await cluster.start_server()
+        else:
+            logger.error("CLUSTER_PORT is set but CLUSTER_SECRET is not; worker nodes are disabled.")
 
+    app = web.Application()
+    ingress.register(app)
+    runner = None
+    metrics_runner = await start_metrics_server() if METRICS_PORT else None
     try:
         logger.info("✅ Bot is running...")
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot, app)
+        else:
+            if INGRESS_URL:
+                # Polling for the hosting bot itself, but the ingress still needs a listener
+                runner = web.AppRunner(app)
+                await runner.setup()
+                await web.TCPSite(runner, WEB_HOST, PORT).start()
+            await dp.start_polling(bot)
     finally:
+        if runner is not None:
+            await runner.cleanup()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        if cluster.server is not None:
+            cluster.server.close()
         await on_shutdown()
         await bot.session.close()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(run_worker() if "--worker" in sys.argv[1:] else main())
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+
+import pytest
+
+# kl03 reads its configuration and opens its database and log files at import time,
+# so the tests import it from a scratch directory with a fixed environment
+os.environ.update(TOKEN="123456:TEST", METRICS_PORT="0", ADMIN_IDS="1", LAUNCH_MODE="popen")
+os.chdir(tempfile.mkdtemp(prefix="kl03-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TelegramStub:
+    """Minimal Bot API server: records every call and answers with canned results"""
+    def __init__(self):
+        self.calls = []
+        self.called = asyncio.Event()
+        self.runner = None
+        self.url = ""
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls.append((request.match_info["token"], method, data))
+        self.called.set()
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(data.get("chat_id", 1))
+            return web.json_response({"ok": True, "result": {
+                "message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")
+            }})
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": int(request.match_info["token"].split(":")[0]), "is_bot": True, "first_name": "stub", "username": "stub_bot"
+            }})
+        return web.json_response({"ok": True, "result": True})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        port = free_port()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def methods(self):
+        return [method for _, method, _ in self.calls]
+
+    async def wait_for(self, method: str, timeout: float = 5):
+        async def poll():
+            while method not in self.methods():
+                self.called.clear()
+                await self.called.wait()
+        await asyncio.wait_for(poll(), timeout)
+
+
+@pytest.fixture
+def kl03(monkeypatch, tmp_path):
+    import kl03 as module
+    monkeypatch.chdir(tmp_path)
+    module.db.bots.clear()
+    module.db.user_index.clear()
+    return module
+
+
+def make_bot(kl03, code: str, bot_hash: str, user_id: int = 1):
+    """A hosted bot whose venv is the test interpreter"""
+    bot = kl03.HostedBot(user_id, bot_hash, "bot.py")
+    os.makedirs(bot.bot_dir, exist_ok=True)
+    with open(bot.script_path, "w") as f:
+        f.write(code)
+    os.makedirs(os.path.dirname(bot.venv_python), exist_ok=True)
+    if not os.path.exists(bot.venv_python):
+        os.symlink(sys.executable, bot.venv_python)
+    bot.dependencies_installed = True
+    kl03.db.add_bot(bot)
+    return bot
@@ -0,0 +1,26 @@
+def test_admission_without_cgroups_only_guards_memory(kl03, monkeypatch):
+    monkeypatch.setattr(kl03.cgroup_manager, "root", None)
+    admission = kl03.AdmissionController()
+    admission.cpu_capacity = 1.0
+    bots = [kl03.HostedBot(1, f"a{i}", "bot.py") for i in range(3)]
+
+    # Unenforced quotas are not reserved, so more bots than cores still start
+    for bot in bots:
+        assert admission.admit(bot) == (True, "")
+    assert admission.committed() == (0.0, 0)
+
+    monkeypatch.setattr(kl03, "MEMORY_RESERVE", 1 << 60)
+    late = kl03.HostedBot(1, "late", "bot.py")
+    assert admission.admit(late) == (False, "host memory is low")
+    assert admission.admit(late, force=True) == (True, "")
+
+
+def test_admission_with_cgroups_reserves_quota(kl03, monkeypatch, tmp_path):
+    monkeypatch.setattr(kl03.cgroup_manager, "root", str(tmp_path))
+    monkeypatch.setattr(kl03, "BOT_CPU_QUOTA", 1.0)
+    admission = kl03.AdmissionController()
+    admission.cpu_capacity = 1.0
+    first, second = kl03.HostedBot(1, "c1", "bot.py"), kl03.HostedBot(1, "c2", "bot.py")
+    assert admission.admit(first)[0]
+    admitted, reason = admission.admit(second)
+    assert not admitted and "CPU committed" in reason
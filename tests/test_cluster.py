@@ -0,0 +1,145 @@
+"""Cluster harness: a control plane in the test process and two `kl03.py --worker` agents on localhost"""
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import free_port
+
+KL03 = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "kl03.py")
+SCRIPT = "import time\nprint('hello', flush=True)\nwhile True:\n    time.sleep(1)\n"
+
+
+class LocalCluster:
+    def __init__(self, kl03, root, port: int):
+        self.kl03 = kl03
+        self.root = root
+        self.port = port
+        self.workers = {}
+
+    def spawn(self, worker_id: str):
+        directory = self.root / worker_id
+        directory.mkdir()
+        env = {key: value for key, value in os.environ.items() if key != "TOKEN"}
+        env.update(
+            WORKER_ID=worker_id, CLUSTER_SECRET=self.kl03.CLUSTER_SECRET, CLUSTER_ADDRESS=f"127.0.0.1:{self.port}",
+            WORKER_HEARTBEAT="1", METRICS_PORT="0", LAUNCH_MODE="popen", BOT_CPU_QUOTA="0", BOT_MEMORY_MAX="0"
+        )
+        log = open(directory / "worker.out", "w")
+        self.workers[worker_id] = subprocess.Popen(
+            [sys.executable, KL03, "--worker"], cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+
+    def output(self, worker_id: str):
+        return (self.root / worker_id / "worker.out").read_text()
+
+    async def until(self, condition, timeout: float, what: str):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise AssertionError(f"timed out waiting for {what}")
+            await asyncio.sleep(0.2)
+
+    def stop(self):
+        for process in self.workers.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in self.workers.values():
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+@pytest.fixture
+def local_cluster(kl03, monkeypatch, tmp_path):
+    port = free_port()
+    monkeypatch.setattr(kl03, "CLUSTER_PORT", port)
+    monkeypatch.setattr(kl03, "CLUSTER_SECRET", "harness")
+    monkeypatch.setattr(kl03, "WORKER_HEARTBEAT", 1)
+    monkeypatch.setattr(kl03, "MIGRATE_TIMEOUT", 120)
+    monkeypatch.setattr(kl03, "CLUSTER_CALL_TIMEOUT", 30)
+    kl03.cluster.nodes.clear()
+    kl03.cluster.draining.clear()
+    harness = LocalCluster(kl03, tmp_path, port)
+    yield harness
+    harness.stop()
+
+
+def upload(kl03, bot_hash: str):
+    bot = kl03.HostedBot(1, bot_hash, "bot.py")
+    with open(bot.script_path, "w") as f:
+        f.write(SCRIPT)
+    bot.create_requirements()
+    kl03.db.add_bot(bot)
+    return bot
+
+
+def test_placement_migration_and_worker_loss(kl03, local_cluster):
+    cluster = kl03.cluster
+
+    async def logs_show_hello(bot):
+        await local_cluster.until(lambda: bot.status == "running", 30, f"{bot.key} running")
+        for _ in range(50):
+            if "hello" in await cluster.logs(bot):
+                return
+            await asyncio.sleep(0.2)
+        raise AssertionError(f"no output from {bot.key} on {bot.node}")
+
+    async def scenario():
+        await cluster.start_server()
+        try:
+            local_cluster.spawn("w1")
+            local_cluster.spawn("w2")
+            await local_cluster.until(lambda: sorted(cluster.nodes) == ["w1", "w2"], 90, "both workers")
+
+            # Placement spreads new bots over the workers
+            first, second = upload(kl03, "aa01"), upload(kl03, "aa02")
+            first.node, second.node = cluster.place(first), cluster.place(second)
+            assert {first.node, second.node} == {"w1", "w2"}
+            for bot in (first, second):
+                success, msg, job = await cluster.deploy(bot, bot.node, autostart=True)
+                assert success, msg
+                assert await cluster.wait_job(job), job.result
+            for bot in (first, second):
+                await logs_show_hello(bot)
+
+            # Migration builds on the target before stopping at the source
+            source = first.node
+            target = second.node
+            success, msg = await cluster.migrate(first, target)
+            assert success, msg
+            assert first.node == target
+            await logs_show_hello(first)
+            assert not (local_cluster.root / source / "hosted_bots" / first.key).exists()
+
+            # A draining worker takes no new bots
+            cluster.draining.add(source)
+            assert cluster.place(upload(kl03, "aa03")) == target
+            cluster.draining.discard(source)
+
+            # Worker loss: the control plane notices within a few heartbeats
+            local_cluster.workers[target].kill()
+            await local_cluster.until(lambda: target not in cluster.nodes, 10, f"{target} to be dropped")
+            success, msg = await first.stop()
+            assert not success and "offline" in msg
+            late = upload(kl03, "aa04")
+            assert cluster.place(late) == source
+
+            # Bots of the lost worker can be moved to the survivor from the copy kept here
+            second.status = "stopped"
+            success, msg = await cluster.migrate(second, source)
+            assert success, msg
+            success, msg = await second.start()
+            assert success, msg
+            await logs_show_hello(second)
+            await second.stop()
+        finally:
+            cluster.server.close()
+            await cluster.server.wait_closed()
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+import asyncio
+import json
+import threading
+
+from conftest import make_bot
+
+
+def test_rows_are_snapshotted_on_the_loop(kl03, monkeypatch, tmp_path):
+    db = kl03.BotDatabase(str(tmp_path / "bots.db"))
+    bot = make_bot(kl03, "print('hi')\n", "snap")
+    db.add_bot(bot)
+    to_dict = kl03.HostedBot.to_dict
+    threads = set()
+
+    def recording(self):
+        threads.add(threading.current_thread())
+        return to_dict(self)
+
+    monkeypatch.setattr(kl03.HostedBot, "to_dict", recording)
+
+    async def scenario():
+        bot.crashes = 3
+        db.save()
+        await db.flush()
+        # Changed after the snapshot was taken: belongs to the next flush
+        bot.crashes = 4
+
+    asyncio.run(scenario())
+    assert threads == {threading.main_thread()}
+    (row,) = db.conn.execute("SELECT data FROM bots WHERE key = ?", (bot.key,)).fetchone()
+    assert json.loads(row)["crashes"] == 3
@@ -0,0 +1,32 @@
+import os
+
+from conftest import make_bot
+
+
+def test_measure_rewalks_only_what_changed(kl03, monkeypatch):
+    bot = make_bot(kl03, "print('hi')\n", "disk")
+    os.makedirs(bot.site_packages, exist_ok=True)
+    with open(os.path.join(bot.site_packages, "pkg.py"), "w") as f:
+        f.write("x" * 10000)
+
+    walked = []
+    disk_usage = kl03.disk_usage
+    monkeypatch.setattr(kl03, "disk_usage", lambda path: walked.append(path) or disk_usage(path))
+
+    size, state = kl03.measure_bot_dir(bot, None)
+    assert bot.venv_path in walked and bot.script_path in walked
+
+    # A chatty bot: only the log grows, and it is counted without walking anything
+    walked.clear()
+    with open(os.path.join(bot.bot_dir, "output.log"), "wb") as f:
+        f.write(b"line\n" * 20000)
+    grown, state = kl03.measure_bot_dir(bot, state)
+    assert walked == []
+    assert grown > size
+
+    # Installing a package touches site-packages, so only the venv is walked again
+    with open(os.path.join(bot.site_packages, "other.py"), "w") as f:
+        f.write("y")
+    os.utime(bot.site_packages, ns=(1, 1))
+    _, state = kl03.measure_bot_dir(bot, state)
+    assert walked == [bot.venv_path]
@@ -0,0 +1,22 @@
+import threading
+
+
+def test_save_while_scanners_add_entries(kl03, tmp_path, monkeypatch):
+    resolver = kl03.ImportResolver()
+    resolver.path = str(tmp_path / "import_index.json")
+    errors = []
+    monkeypatch.setattr(kl03.logger, "error", errors.append)
+    done = threading.Event()
+
+    def scan():
+        for i in range(20000):
+            resolver.remember_imports(f"digest{i}", ["aiogram", "requests"])
+        done.set()
+
+    scanner = threading.Thread(target=scan)
+    scanner.start()
+    while not done.is_set():
+        resolver.save()
+    scanner.join()
+    resolver.save()
+    assert errors == []
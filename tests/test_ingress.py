@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+from aiohttp import ClientSession, web
+
+from conftest import TelegramStub, free_port, make_bot
+
+TOKEN = "987654321:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw0"
+
+# Reads its token from the environment, so the upload has none to capture
+RECEIVER = """
+import os, socketserver
+from http.server import BaseHTTPRequestHandler
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        with open('received.jsonl', 'ab') as f:
+            f.write(body + b'\\n')
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+token = os.environ.get('MY_BOT_TOKEN')
+socketserver.UnixStreamServer(os.environ['HOSTED_INGRESS_SOCKET'], Handler).serve_forever()
+"""
+
+
+def test_token_is_captured_at_upload(kl03):
+    literal = make_bot(kl03, f"TOKEN = '{TOKEN}'\n", "literal")
+    kl03.capture_upload_token(literal)
+    assert literal.api_token == TOKEN and not literal.token_registered
+
+    from_env = make_bot(kl03, RECEIVER, "env")
+    kl03.capture_upload_token(from_env)
+    assert from_env.api_token is None
+
+
+def test_ingress_with_registered_token_against_local_stub(kl03, monkeypatch):
+    port = free_port()
+    monkeypatch.setattr(kl03, "INGRESS_URL", f"http://127.0.0.1:{port}")
+
+    async def scenario():
+        stub = await TelegramStub().start()
+        monkeypatch.setattr(kl03, "TELEGRAM_API_URL", stub.url)
+        app = web.Application()
+        kl03.ingress.register(app)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        bot = make_bot(kl03, RECEIVER, "ingress")
+        try:
+            # Nothing to find in the script: the owner is told to register the token
+            success, msg = await kl03.ingress.enable(bot)
+            assert not success and "Set token" in msg
+            assert stub.calls == []
+
+            assert not kl03.register_token(bot, "not a token")
+            assert kl03.register_token(bot, f" {TOKEN}\n")
+            success, msg = await kl03.ingress.enable(bot)
+            assert success, msg
+            token, method, data = stub.calls[-1]
+            assert (token, method) == (TOKEN, "setWebhook")
+            assert data["url"] == f"http://127.0.0.1:{port}/ingress/{bot.key}"
+            # A later upload of a script with another literal does not override the owner's token
+            with open(bot.bot_dir + "/.env", "w") as f:
+                f.write("MY_BOT_TOKEN=111111111:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA\n")
+            kl03.capture_upload_token(bot)
+            assert bot.api_token == TOKEN
+
+            await bot.start()
+            update = {"update_id": 7, "message": {"message_id": 1, "date": 0, "text": "hi",
+                                                  "chat": {"id": 5, "type": "private"}}}
+            url = f"{kl03.INGRESS_URL}/ingress/{bot.key}"
+            async with ClientSession() as session:
+                async with session.post(url, json=update) as response:
+                    assert response.status == 401
+                headers = {"X-Telegram-Bot-Api-Secret-Token": kl03.ingress.secret(bot)}
+                async with session.post(url, json=update, headers=headers) as response:
+                    assert response.status == 200
+            received = bot.bot_dir + "/received.jsonl"
+            for _ in range(100):
+                try:
+                    with open(received) as f:
+                        lines = f.read().splitlines()
+                    if lines:
+                        break
+                except FileNotFoundError:
+                    pass
+                await asyncio.sleep(0.1)
+            assert [json.loads(line) for line in lines] == [update]
+
+            success, _ = await kl03.ingress.disable(bot)
+            assert success and stub.methods()[-1] == "deleteWebhook"
+        finally:
+            await bot.stop()
+            await runner.cleanup()
+            await stub.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,21 @@
+import asyncio
+import gc
+
+from conftest import make_bot
+
+
+def test_requirement_locks_are_dropped_when_released(kl03):
+    scheduler = kl03.JobScheduler()
+    first, second = make_bot(kl03, "import requests\n", "req1"), make_bot(kl03, "import requests\n", "req2")
+    for bot in (first, second):
+        with open(bot.requirements_path, "w") as f:
+            f.write("requests\n")
+
+    async def scenario():
+        async with scheduler.requirement_lock(first):
+            # The same requirement set shares one lock while it is in use
+            assert scheduler.requirement_lock(second).locked()
+
+    asyncio.run(scenario())
+    gc.collect()
+    assert len(scheduler.requirement_locks) == 0
@@ -0,0 +1,70 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import psutil
+
+from conftest import make_bot
+
+CHATTY = "import time\nwhile True:\n    print('tick', flush=True)\n    time.sleep(0.05)\n"
+
+HOST = """
+import asyncio, os, sys
+sys.path.insert(0, {repo!r})
+sys.path.insert(0, {tests!r})
+import kl03
+from conftest import make_bot
+os.chdir({cwd!r})
+
+async def main():
+    bot = make_bot(kl03, {code!r}, "adopted")
+    await bot.start()
+    print(bot.pid, flush=True)
+    await asyncio.sleep(0.5)
+    # The host dies without stopping its bots
+    os._exit(0)
+
+asyncio.run(main())
+"""
+
+
+def test_bot_output_survives_host_exit(tmp_path):
+    tests = os.path.dirname(os.path.abspath(__file__))
+    host = HOST.format(repo=os.path.dirname(tests), tests=tests, code=CHATTY, cwd=str(tmp_path))
+    result = subprocess.run([sys.executable, "-c", host], cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    pid = int(result.stdout.split()[-1])
+    log_path = tmp_path / "hosted_bots" / "1_adopted" / "output.log"
+    try:
+        size = log_path.stat().st_size
+        time.sleep(1)
+        # Still running and still writing: nothing depended on a pipe the old host read
+        assert psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        assert log_path.stat().st_size > size
+    finally:
+        psutil.Process(pid).kill()
+
+
+def test_rotation_keeps_the_bot_appending(kl03, monkeypatch):
+    monkeypatch.setattr(kl03, "LOG_MAX_BYTES", 200)
+    monkeypatch.setattr(kl03, "LOG_BACKUP_COUNT", 2)
+
+    async def scenario():
+        bot = make_bot(kl03, CHATTY, "rotate")
+        await bot.start()
+        try:
+            log = kl03.bot_logs.get(bot)
+            while os.path.getsize(log.path) <= 200:
+                await asyncio.sleep(0.05)
+            assert log.rotate_if_needed()
+            assert os.path.getsize(log.path + ".1") > 200
+            await asyncio.sleep(0.3)
+            # O_APPEND: writes continue from the truncated end, with no hole of zeros
+            with open(log.path, "rb") as f:
+                assert f.read().startswith(b"tick")
+            assert (await kl03.bot_logs.tail(bot, 2)) == ["tick", "tick"]
+        finally:
+            await bot.stop()
+
+    asyncio.run(scenario())
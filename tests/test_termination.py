@@ -0,0 +1,30 @@
+import asyncio
+import time
+
+from conftest import make_bot
+
+SLEEPER = "import time\ntime.sleep(60)\n"
+STUBBORN = "import signal, time\nsignal.signal(signal.SIGTERM, signal.SIG_IGN)\ntime.sleep(60)\n"
+
+
+def test_terminate_waits_on_exit_events_not_polling(kl03, monkeypatch):
+    async def no_polling(processes, timeout):
+        assert not processes, "fell back to polling /proc"
+        return []
+
+    monkeypatch.setattr(kl03, "poll_exits", no_polling)
+
+    async def scenario():
+        bots = [make_bot(kl03, SLEEPER, f"t{i}") for i in range(3)] + [make_bot(kl03, STUBBORN, "stubborn")]
+        for bot in bots:
+            await bot.start()
+        await asyncio.sleep(0.5)
+        started = time.monotonic()
+        results = await kl03.terminate_bots(bots, grace=1)
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(scenario())
+    assert [results[f"1_t{i}"] for i in range(3)] == ["terminated"] * 3
+    # Only the bot that ignores SIGTERM waits out the grace period before SIGKILL
+    assert results["1_stubborn"] == "killed"
+    assert elapsed < 2
@@ -0,0 +1,16 @@
+from conftest import make_bot
+
+
+def test_bot_view_reuses_the_stable_parts(kl03):
+    kl03.bot_view_parts.cache_clear()
+    bot = make_bot(kl03, "print('hi')\n", "view")
+    bot.file_name = "<b>.py"
+    first = kl03.render_bot_view(bot)
+    assert first.startswith("🤖 <b>&lt;b&gt;.py</b>\nStatus: stopped\nUptime: ")
+    kl03.render_bot_view(bot)
+    assert kl03.bot_view_parts.cache_info().hits == 1
+
+    # A new status is a new card
+    bot.crashes = 2
+    assert kl03.render_bot_view(bot).endswith("\nCrashes: 2 | OOM kills: 0")
+    assert kl03.bot_view_parts.cache_info().misses == 2
@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+from conftest import make_bot
+
+SLEEPER = "import time\ntime.sleep(60)\n"
+
+
+def write(path, content):
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_update_stays_inside_the_bot_directory(kl03, tmp_path):
+    bot = make_bot(kl03, SLEEPER, "upd")
+    source = tmp_path / "new.py"
+    source.write_text("print('v2')\n")
+
+    success, _, _ = asyncio.run(bot.update("../../escaped.py", str(source)))
+    assert success
+    assert bot.script_path == os.path.join(bot.bot_dir, "escaped.py")
+    assert not os.path.exists(os.path.join(bot.bot_dir, "..", "..", "escaped.py"))
+
+
+def test_rollback_restores_requirements_and_lock(kl03, tmp_path):
+    bot = make_bot(kl03, SLEEPER, "lock")
+    bot.project_requirements = True
+    write(bot.requirements_path, "requests\n")
+    write(bot.lock_path, "requests==2.31.0\n")
+    source = tmp_path / "bot.py"
+    source.write_text("print('v2')\n")
+
+    bot.replace_script("bot.py", str(source))
+    # The build for the new version refreezes the pins
+    write(bot.requirements_path, "requests\nhttpx\n")
+    write(bot.lock_path, "requests==2.31.0\nhttpx==0.27.0\n")
+    bot.rollback_script()
+
+    with open(bot.lock_path) as f:
+        assert f.read() == "requests==2.31.0\n"
+    with open(bot.requirements_path) as f:
+        assert f.read() == "requests\n"
+    with open(bot.script_path) as f:
+        assert f.read() == SLEEPER
+
+
+def test_swap_raises_limits_only_while_versions_overlap(kl03, monkeypatch, tmp_path):
+    monkeypatch.setattr(kl03.cgroup_manager, "root", str(tmp_path / "cgroup"))
+    monkeypatch.setattr(kl03, "UPDATE_HEALTH_DELAY", 0.5)
+    monkeypatch.setattr(kl03, "BOT_MEMORY_MAX", 1000)
+    seen = []
+    prepare = kl03.cgroup_manager.prepare
+
+    def record(bot, scale=1):
+        procs = prepare(bot, scale)
+        with open(os.path.join(kl03.cgroup_manager.path(bot), "memory.max")) as f:
+            seen.append(f.read())
+        return procs
+
+    monkeypatch.setattr(kl03.cgroup_manager, "prepare", record)
+
+    async def scenario():
+        bot = make_bot(kl03, SLEEPER, "swap")
+        await bot.start()
+        source = tmp_path / "bot.py"
+        source.write_text(SLEEPER)
+        success, msg, _ = await bot.update("bot.py", str(source))
+        assert success, msg
+        await bot.stop()
+
+    asyncio.run(scenario())
+    assert seen == ["1000", "2000", "1000"]
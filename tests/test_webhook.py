@@ -0,0 +1,97 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import ClientSession, web
+
+from conftest import TelegramStub, free_port
+
+
+def start_update(update_id: int, user_id: int = 5):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "user"}, "text": "/start"
+    }}
+
+
+async def post(url: str, update: dict, secret=None):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with ClientSession() as session:
+        async with session.post(url, json=update, headers=headers) as response:
+            return response.status
+
+
+def test_webhook_against_local_stub(kl03, monkeypatch):
+    monkeypatch.setattr(kl03, "PORT", free_port())
+    monkeypatch.setattr(kl03, "WEB_HOST", "127.0.0.1")
+    monkeypatch.setattr(kl03, "WEBHOOK_URL", "https://example.test")
+
+    async def scenario():
+        stub = await TelegramStub().start()
+        monkeypatch.setattr(kl03, "TELEGRAM_API_URL", stub.url)
+        bot = Bot(token=kl03.TOKEN, session=kl03.api_session())
+        dp = Dispatcher(storage=MemoryStorage())
+        dp.message.register(kl03.cmd_start, Command("start"))
+        dp.message.register(kl03.cmd_restart_all, Command("restartall"))
+        server = kl03.WebhookServer(dp, bot, web.Application())
+        url = f"http://127.0.0.1:{kl03.PORT}{kl03.WEBHOOK_PATH}"
+        try:
+            await server.start()
+            assert "setWebhook" in stub.methods()
+            _, _, registered = stub.calls[stub.methods().index("setWebhook")]
+            assert registered["secret_token"] == kl03.WEBHOOK_SECRET
+
+            assert await post(url, start_update(1), kl03.WEBHOOK_SECRET) == 200
+            await stub.wait_for("sendMessage")
+            assert await post(url, start_update(2)) == 401
+            assert await post(url, start_update(3), "forged") == 401
+            assert stub.methods().count("sendMessage") == 1
+        finally:
+            await server.stop()
+            await bot.session.close()
+        # Drained and closed: nothing is listening any more
+        try:
+            status = await post(url, start_update(4), kl03.WEBHOOK_SECRET)
+        except OSError:
+            status = None
+        assert status is None
+        await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_webhook_back_pressure(kl03, monkeypatch):
+    monkeypatch.setattr(kl03, "WEBHOOK_QUEUE_SIZE", 1)
+
+    async def scenario():
+        bot = Bot(token=kl03.TOKEN)
+        server = kl03.WebhookServer(Dispatcher(), bot, web.Application())
+        server.accepting = True
+
+        class Request:
+            headers = {"X-Telegram-Bot-Api-Secret-Token": kl03.WEBHOOK_SECRET}
+
+            def __init__(self, update):
+                self.update = update
+
+            async def json(self):
+                return self.update
+
+        assert (await server.handle(Request(start_update(1)))).status == 200
+        full = await server.handle(Request(start_update(2)))
+        assert full.status == 503 and full.headers["Retry-After"] == "1"
+        server.accepting = False
+        assert (await server.handle(Request(start_update(3)))).status == 503
+        await bot.session.close()
+
+    asyncio.run(scenario())
+
+
+def test_hosted_scripts_do_not_see_host_secrets(kl03, monkeypatch):
+    monkeypatch.setenv("WEBHOOK_SECRET", "hook")
+    monkeypatch.setenv("CLUSTER_SECRET", "cluster")
+    monkeypatch.setenv("SOME_SETTING", "kept")
+    env = kl03.scrubbed_environ()
+    assert "TOKEN" not in env and "WEBHOOK_SECRET" not in env and "CLUSTER_SECRET" not in env
+    assert env["SOME_SETTING"] == "kept"